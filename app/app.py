@@ -6,6 +6,7 @@ import sentry_sdk
 from sentry_sdk.integrations.flask import FlaskIntegration
 from sentry_dramatiq import DramatiqIntegration
 from .extensions import dramatiq
+from .middleware import PipestoreFlushMiddleware
 from .api import api
 
 
@@ -23,6 +24,7 @@ def create_app():
     # extension with app.
     app.config.from_pyfile("config.py", silent=True)
     dramatiq.middleware.append(PeriodiqMiddleware())
+    dramatiq.middleware.append(PipestoreFlushMiddleware())
     dramatiq.init_app(app)
 
     app.register_blueprint(api)
@@ -0,0 +1,12 @@
+import os
+import dramatiq
+from ergo_analytics.aws_utilities import PipestoreUploader
+
+
+class PipestoreFlushMiddleware(dramatiq.Middleware):
+    """Finish the background uploads to the pipestore (see
+    "PipestoreUploader") before a worker shuts down."""
+
+    def before_worker_shutdown(self, broker, worker):
+        timeout = float(os.getenv("PIPESTORE_FLUSH_TIMEOUT", 60))
+        PipestoreUploader.flush(timeout=timeout)
@@ -19,6 +19,7 @@ from urllib.error import HTTPError
 from periodiq import cron
 from app.api_client import ApiClient
 from ergo_analytics import LoadElasticSearch
+from ergo_analytics import RawDataCache
 from ergo_analytics import ErgoMetrics, DataFilterPipeline
 from ergo_analytics import ErgoReport
 from ergo_analytics.filters import ConstructDeltaValues
@@ -98,6 +99,11 @@ def run_BSAFE(
     debug = scoring_definition.get("debug", False)
     debug_folder_prepend = scoring_definition.get("debug_folder_prepend", None)
     anchor_data_vs_time = scoring_definition.get("anchor_data_vs_time", False)
+    dtype_policy = scoring_definition.get("dtype_policy", "default")
+    memoize_chunks = scoring_definition.get("memoize_chunks", False)
+    max_workers = scoring_definition.get("max_workers", 1)
+    # (threads: forking the threaded dramatiq workers is not safe)
+    executor = scoring_definition.get("executor", "thread")
 
     _delete_keys(
         [
@@ -111,6 +117,10 @@ def run_BSAFE(
             "debug_folder_prepend",
             "anchor_data_vs_time",
             "with_format_code",
+            "dtype_policy",
+            "memoize_chunks",
+            "max_workers",
+            "executor",
         ],
         scoring_definition,
     )
@@ -120,24 +130,37 @@ def run_BSAFE(
     delta_only_pipeline.add_filter(
         name="construct-delta", filter=ConstructDeltaValues()
     )
-    structured_all_data = delta_only_pipeline.run(
-        on_raw_data=raw_data, with_format_code=with_format_code, use_subsampling=False
-    )[0].data_matrix
-
-    list_of_structured_data_chunks = pipeline.run(
+    # (filters both pipelines start with are applied to the data only once)
+    structured_all_data, list_of_structured_data_chunks = DataFilterPipeline.run_many(
+        runs=[
+            (
+                delta_only_pipeline,
+                dict(use_subsampling=False, dtype_policy=dtype_policy),
+            ),
+            (
+                pipeline,
+                dict(
+                    is_sorted=is_sorted,
+                    use_subsampling=use_subsampling,
+                    number_of_subsamples=number_of_subsamples,
+                    randomize_subsampling=randomize_subsampling,
+                    consecutive_subsamples=consecutive_subsamples,
+                    subsample_size_index=subsample_size_index,
+                    debug=debug,
+                    debug_folder_prepend=debug_folder_prepend,
+                    anchor_data_vs_time=anchor_data_vs_time,
+                    dtype_policy=dtype_policy,
+                    memoize_chunks=memoize_chunks,
+                    max_workers=max_workers,
+                    executor=executor,
+                    **scoring_definition,
+                ),
+            ),
+        ],
         on_raw_data=raw_data,
         with_format_code=with_format_code,
-        is_sorted=is_sorted,
-        use_subsampling=use_subsampling,
-        number_of_subsamples=number_of_subsamples,
-        randomize_subsampling=randomize_subsampling,
-        consecutive_subsamples=consecutive_subsamples,
-        subsample_size_index=subsample_size_index,
-        debug=debug,
-        debug_folder_prepend=debug_folder_prepend,
-        anchor_data_vs_time=anchor_data_vs_time,
-        **scoring_definition,
     )
+    structured_all_data = structured_all_data[0].data_matrix
 
     em = None
     logger.info(f"Retrieved all data for {mac_address}")
@@ -182,6 +205,15 @@ def run_BSAFE(
             )  # just put something for now
 
 
+def _data_loader(scoring_definition):
+    """An Elastic Search loader decoding the raw data straight into the
+    dtypes of the "dtype_policy" of the scoring definition (rather than
+    float64 copied to float32 by the pipeline)."""
+    data_loader = LoadElasticSearch()
+    data_loader.dtype_policy = scoring_definition.get("dtype_policy", "default")
+    return data_loader
+
+
 def _delete_keys(keys, scoring_definition):
     for key in keys:
         if key in scoring_definition:
@@ -215,6 +247,8 @@ def automated_analysis():
         index = os.getenv("ELASTIC_SEARCH_INDEX")
 
     bsafe_setup_filename = os.getenv("BSAFE_SETUP_FILENAME")
+    # analyze this many wearables per task (fetching their data together):
+    devices_per_task = int(os.getenv("DEVICES_PER_ANALYSIS_TASK", 1))
 
     logger.info("Here is the env: {}".format(os.environ))
     logger.info("from_alias: {}".format(from_alias))
@@ -231,13 +265,9 @@ def automated_analysis():
         response.raise_for_status()
         wearables = response.json()["data"]
         logger.info(f"Running automated analysis for {len(wearables)}")
-        for wearable in wearables:
-            mac_address = wearable["attributes"]["mac"]
-            logger.info(f'Running analysis for wearable with MAC: "{mac_address}"')
-            safety_score_analysis.send(
-                mac_address,
-                start_time,
-                end_time,
+        mac_addresses = [wearable["attributes"]["mac"] for wearable in wearables]
+        for ix in range(0, len(mac_addresses), devices_per_task):
+            kwargs = dict(
                 host=host,
                 index=index,
                 from_alias=from_alias,
@@ -245,6 +275,17 @@ def automated_analysis():
                 run_as_test=run_as_test,
                 bsafe_setup_filename=bsafe_setup_filename,
             )
+            if devices_per_task > 1:
+                # fetch the data of these wearables together in one search:
+                these_mac_addresses = mac_addresses[ix : ix + devices_per_task]
+                logger.info(f"Running analysis for wearables: {these_mac_addresses}")
+                fleet_safety_score_analysis.send(
+                    these_mac_addresses, start_time, end_time, **kwargs
+                )
+            else:
+                mac_address = mac_addresses[ix]
+                logger.info(f'Running analysis for wearable with MAC: "{mac_address}"')
+                safety_score_analysis.send(mac_address, start_time, end_time, **kwargs)
         logger.info(f"Enqueued all analyses")
     except HTTPError as http_err:
         logger.error(f"HTTP error occurred: {http_err}", exc_info=True)
@@ -287,7 +328,12 @@ def safety_score_analysis(
         bsafe_setup_filename=bsafe_setup_filename
     )
 
-    data_loader = LoadElasticSearch()
+    # read long time ranges in this many parallel sliced scrolls:
+    number_of_slices = os.getenv("ELASTIC_SEARCH_NUMBER_OF_SLICES")
+    # reuse the data of overlapping lookback windows from the local disk:
+    cache = RawDataCache() if os.getenv("RAW_DATA_CACHE_DIR") else None
+
+    data_loader = _data_loader(scoring_definition=scoring_definition)
     raw_data = data_loader.retrieve_data(
         mac_address=mac_address,
         start_time=start_time,
@@ -297,7 +343,10 @@ def safety_score_analysis(
         find_alias_among_indexes=find_alias_among_indexes,
         index=index,
         host=host,
+        number_of_slices=number_of_slices,
+        cache=cache,
     )
+    logger.info(f"Elastic Search cache: {LoadElasticSearch.cache_info()}")
 
     run_BSAFE(
         raw_data=raw_data,
@@ -310,10 +359,87 @@ def safety_score_analysis(
     )
 
 
+@dramatiq.actor(max_retries=3)
+def fleet_safety_score_analysis(
+    mac_addresses,
+    start_time,
+    end_time,
+    from_alias=None,
+    find_alias_among_indexes=None,
+    run_as_test=False,
+    host=None,
+    index=None,
+    bsafe_setup_filename=None,
+):
+    """Like "safety_score_analysis" but for many wearables over the same
+    time window, with their data fetched from Elastic Search in one go.
+    The wearables failing to be analyzed are sent on to
+    "safety_score_analysis" one by one (to be retried like any other)."""
+    logger.info("Starting function 'fleet_safety_score_analysis'")
+    logger.info(f"Getting safety scores for {len(mac_addresses)} wearables")
+
+    number_of_slices = os.getenv("ELASTIC_SEARCH_NUMBER_OF_SLICES")
+
+    data_loader = _data_loader(
+        scoring_definition=parse_bsafe_setup_file(
+            bsafe_setup_filename=bsafe_setup_filename
+        )[0]
+    )
+    all_raw_data = data_loader.retrieve_data_for_devices(
+        mac_addresses=mac_addresses,
+        start_time=start_time,
+        end_time=end_time,
+        from_alias=from_alias,
+        find_alias_among_indexes=find_alias_among_indexes,
+        index=index,
+        host=host,
+        number_of_slices=number_of_slices,
+    )
+    logger.info(f"Elastic Search cache: {LoadElasticSearch.cache_info()}")
+
+    failed_mac_addresses = []
+    for mac_address, raw_data in all_raw_data.items():
+        # run_BSAFE consumes its scoring definition so parse one per device:
+        scoring_definition, scoring_hash = parse_bsafe_setup_file(
+            bsafe_setup_filename=bsafe_setup_filename
+        )
+        try:
+            run_BSAFE(
+                raw_data=raw_data,
+                mac_address=mac_address,
+                run_as_test=run_as_test,
+                with_format_code=data_loader.data_format_codes.get(mac_address),
+                scoring_definition=scoring_definition,
+                scoring_hash=scoring_hash,
+                bsafe_setup_filename=bsafe_setup_filename,
+            )
+        except Exception as err:
+            logger.error(f"Failure to analyze {mac_address}: {err}", exc_info=True)
+            failed_mac_addresses.append(mac_address)
+
+    for mac_address in failed_mac_addresses:
+        logger.info(f"Sending the analysis of {mac_address} to be retried")
+        safety_score_analysis.send(
+            mac_address,
+            start_time,
+            end_time,
+            from_alias=from_alias,
+            find_alias_among_indexes=find_alias_among_indexes,
+            run_as_test=run_as_test,
+            host=host,
+            index=index,
+            bsafe_setup_filename=bsafe_setup_filename,
+        )
+
+
 def run_status():
     """Created to more easily test the status endpoint"""
 
-    data_loader = LoadElasticSearch()
+    scoring_definition, scoring_hash = parse_bsafe_setup_file(
+        bsafe_setup_filename="bsafe_run_setup.yml"
+    )
+
+    data_loader = _data_loader(scoring_definition=scoring_definition)
     mac_address, raw_data = data_loader.retrieve_any_macaddress_with_data(
         at_least_this_much_data_in_total=50, return_max_this_much_data=20
     )
@@ -326,10 +452,6 @@ def run_status():
         )
         return 500
 
-    scoring_definition, scoring_hash = parse_bsafe_setup_file(
-        bsafe_setup_filename="bsafe_run_setup.yml"
-    )
-
     logger.info("Running BSAFE on data!")
     score = run_BSAFE(
         raw_data=raw_data,
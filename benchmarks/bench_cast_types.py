@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of "BaseData._cast_to_correct_types" on strings as read from the
+wearables' files (format "5"), compared to the element-wise casting it
+replaced.
+
+================================
+How to run (from project root):
+================================
+>> python benchmarks/bench_cast_types.py --rows 1000000
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Iterate Labs, Inc."
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from constants import DATA_FORMAT_CODES  # noqa: E402
+from ergo_analytics.data_raw import BaseData  # noqa: E402
+
+
+def make_raw_data(rows=None, prefix=""):
+    names = DATA_FORMAT_CODES["5"]["NAMES"]
+    raw = pd.DataFrame(
+        np.round(np.random.RandomState(0).randn(rows, len(names) - 1) * 100, 2),
+        columns=names[1:],
+    ).astype(str)
+    times = pd.date_range("2019-07-14 14:27:28.566", periods=rows, freq="10ms")
+    raw.insert(0, names[0], prefix + pd.Series(times.strftime("%m/%d/%y %H:%M:%S.%f")))
+    return raw
+
+
+def cast_element_wise(raw=None):
+    """The casting as it was: one Python call per value."""
+    conv = dict(zip(DATA_FORMAT_CODES["5"]["NAMES"], DATA_FORMAT_CODES["5"]["TYPES"]))
+    data = raw.apply(conv)
+    data.index = list(map(int, data.index))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Casting throughput")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument(
+        "--element-wise-rows",
+        type=int,
+        default=20000,
+        help="rows timed with the element-wise casting (extrapolated)",
+    )
+    args = parser.parse_args()
+
+    for prefix in ["", "RTC: "]:
+        raw = make_raw_data(rows=args.rows, prefix=prefix)
+
+        BaseData._timestamp_formats.clear()
+        start = time.perf_counter()
+        BaseData()._cast_to_correct_types(all_data=raw, data_format_code="5")
+        vectorized = time.perf_counter() - start
+
+        few = raw.iloc[: args.element_wise_rows]
+        start = time.perf_counter()
+        cast_element_wise(few)
+        element_wise = (time.perf_counter() - start) * args.rows / len(few)
+
+        print(
+            f"{args.rows} rows{' with ' + repr(prefix) if prefix else ''}: "
+            f"{vectorized:.2f} s vectorized, ~{element_wise:.0f} s element-wise "
+            f"({element_wise / vectorized:.0f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of "LoadDataFromLocalDisk.get_data" on a day-long device dump made
+by repeating the demo files "Demos/real_data/demo/8D_B8_*.csv" (about 10
+rows per second for 24 hours), with the pyarrow and the pandas engine -
+and of "LoadMemmap.get_data" on the dump converted to the binary format.
+
+================================
+How to run (from project root):
+================================
+>> python benchmarks/bench_load_flat_file.py --hours 24
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Iterate Labs, Inc."
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from ergo_analytics.data_raw import LoadDataFromLocalDisk  # noqa: E402
+from ergo_analytics.data_raw import LoadMemmap  # noqa: E402
+from ergo_analytics.data_raw import convert_to_memmap  # noqa: E402
+
+
+def write_day_long_dump(path=None, hours=None):
+    """Repeat the rows of the demo files until "hours" at 10 Hz."""
+    files = sorted(glob.glob(os.path.join(ROOT_DIR, "Demos/real_data/demo/*.csv")))
+    rows = []
+    header = None
+    for name in files:
+        with open(name, "r") as fd:
+            header = fd.readline()
+            rows.extend(fd.readlines())
+
+    number_of_rows = int(hours * 3600 * 10)
+    with open(path, "w") as fd:
+        fd.write(header)
+        for start in range(0, number_of_rows, len(rows)):
+            fd.writelines(rows[: number_of_rows - start])
+
+    return number_of_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flat file loading time")
+    parser.add_argument("--hours", type=float, default=24)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "dump.csv")
+        number_of_rows = write_day_long_dump(path=path, hours=args.hours)
+        size = os.path.getsize(path) / 1e6
+
+        timings = dict()
+        for engine in ["pandas", "pyarrow"]:
+            start = time.perf_counter()
+            data = LoadDataFromLocalDisk(engine=engine).get_data(
+                path=path, destination=folder
+            )
+            timings[engine] = time.perf_counter() - start
+            assert len(data) == number_of_rows
+
+        destination = convert_to_memmap(path=path)
+        start = time.perf_counter()
+        data = LoadMemmap().get_data(path=destination)
+        timings["memmap"] = time.perf_counter() - start
+        assert len(data) == number_of_rows
+
+        print(
+            f"{number_of_rows} rows ({size:.0f} MB): "
+            f"{timings['pandas']:.2f} s with pandas, "
+            f"{timings['pyarrow']:.2f} s with pyarrow "
+            f"({timings['pandas'] / timings['pyarrow']:.1f}x), "
+            f"{timings['memmap'] * 1000:.1f} ms memory-mapped "
+            f"({os.path.getsize(destination) / 1e6:.0f} MB)"
+        )
+
+
+if __name__ == "__main__":
+    main()
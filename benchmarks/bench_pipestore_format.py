@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Size and load time of pipeline results in the pipestore: the pickled list
+of "StructuredData" chunks it used to store against the compressed Arrow
+file of "dump_structured_data" - loading one chunk and all of them.
+
+The results are those of a pipeline constructing the delta values of a
+day-long recording at 10 Hz (the demo data repeated), in chunks of 600
+points as scored by "run_v2.py".
+
+================================
+How to run (from project root):
+================================
+>> python benchmarks/bench_pipestore_format.py --hours 8
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Iterate Labs, Inc."
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import argparse
+import os
+import pickle
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from ergo_analytics.data_structured import StructuredData  # noqa: E402
+from ergo_analytics.data_structured import dump_structured_data  # noqa: E402
+from ergo_analytics.data_structured import load_structured_data  # noqa: E402
+
+
+def make_results(hours=None, chunk_size=600):
+    """Structured data chunks of "hours" of delta values at 10 Hz."""
+    demo = pd.read_csv(os.path.join(ROOT_DIR, "Demos/demo-format-4/data.csv"))
+    number_of_points = int(hours * 3600 * 10)
+    repeats = number_of_points // len(demo) + 1
+
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(
+        {
+            "Date-Time": pd.date_range(
+                "2020-07-15T06:00:00", periods=number_of_points, freq="100ms"
+            ),
+            **{
+                column: np.tile(demo[column].to_numpy(float), repeats)[
+                    :number_of_points
+                ]
+                + rng.normal(scale=0.01, size=number_of_points)
+                for column in ["DeltaYaw", "DeltaPitch", "DeltaRoll"]
+            },
+        }
+    )
+
+    return [
+        StructuredData(
+            data=data.iloc[start : start + chunk_size].reset_index(drop=True),
+            data_format_code="4",
+        )
+        for start in range(0, number_of_points, chunk_size)
+    ]
+
+
+def timed(function=None, repeat=3):
+    """Best time of "repeat" calls (and the last result)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def load_all(loaded=None):
+    return [chunk.data_matrix for chunk in loaded]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipestore format size/speed")
+    parser.add_argument("--hours", type=float, default=8)
+    args = parser.parse_args()
+
+    results = make_results(hours=args.hours)
+    number_of_points = sum(chunk.number_of_points for chunk in results)
+    print(f"{len(results)} chunks, {number_of_points} points\n")
+
+    formats = dict(
+        pickle=(pickle.dumps, pickle.loads),
+        arrow=(
+            lambda data: dump_structured_data(structured_data=data),
+            lambda data: load_structured_data(data=data),
+        ),
+    )
+
+    print(f"{'format':>8} {'MB':>7} {'dump s':>8} {'open+1 ms':>10} {'all s':>7}")
+    for name, (dump, load) in formats.items():
+        dump_time, data = timed(function=lambda: dump(results))
+        first_time, _ = timed(function=lambda: load(data)[0].data_matrix)
+        all_time, _ = timed(function=lambda: load_all(loaded=load(data)))
+        print(
+            f"{name:>8} {len(data) / 1e6:>7.2f} {dump_time:>8.2f} "
+            f"{first_time * 1000:>10.1f} {all_time:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput report for reading wearable data from Elastic Search with
+sliced scrolls ("LoadElasticSearch.retrieve_data(number_of_slices=...)").
+
+The scrolls are served by the in-memory Elastic Search used in our tests
+with a simulated network latency per request, so the numbers show how the
+retrieval scales with the number of slices when it is bound by round trips
+(as it is against the AWS cluster) rather than by the decoding.
+
+================================
+How to run (from project root):
+================================
+>> python benchmarks/bench_sliced_scroll.py --documents 60000 --latency 0.02
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Iterate Labs, Inc."
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tests", "ergo_analytics", "data_raw"))
+
+from ergo_analytics.data_raw import LoadElasticSearch  # noqa: E402
+from fake_elastic_search import FakeElasticSearchConnection  # noqa: E402
+from fake_elastic_search import make_documents  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sliced scroll throughput")
+    parser.add_argument("--documents", type=int, default=30000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--slices", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    mac_address = "F9:E2:82:9A:55:61"
+    FakeElasticSearchConnection.reset(
+        documents=make_documents(
+            mac_addresses=[mac_address], number_per_device=args.documents
+        ),
+        latency=args.latency,
+    )
+
+    LoadElasticSearch._create_client = staticmethod(
+        lambda host=None, credentials=None: FakeElasticSearchConnection.client()
+    )
+    loader = LoadElasticSearch()
+
+    print(f"{args.documents} documents, {args.latency * 1000:.0f} ms per request\n")
+    print(f"{'slices':>6} {'seconds':>8} {'docs/s':>10} {'speed-up':>9}")
+
+    baseline = None
+    for number_of_slices in args.slices:
+        FakeElasticSearchConnection.requests = []
+        t0 = time.perf_counter()
+        data = loader.retrieve_data(
+            mac_address=mac_address,
+            start_time="2020-07-15T00:00:00Z",
+            end_time="2020-07-15T23:59:59Z",
+            index="cassia-test",
+            number_of_slices=number_of_slices,
+        )
+        elapsed = time.perf_counter() - t0
+        assert len(data) == args.documents
+        assert data["Date-Time"].is_monotonic_increasing
+
+        baseline = baseline or elapsed
+        print(
+            f"{number_of_slices:>6} {elapsed:>8.2f} "
+            f"{len(data) / elapsed:>10.0f} {baseline / elapsed:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+Convert flat files of raw data to the memory-mapped binary format read by
+"LoadMemmap".
+
+>> python convert_to_memmap.py demo/*.csv --output-dir demo/
+"""
+from ergo_analytics.data_raw.load_memmap import main
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,9 @@ __version__ = "Alpha"
 from .data_raw import *
 from .data_structured import *
 from .data_filter_pipeline import *
+from .pipeline_stats import *
 from .setup_utilities import *
 from .ergo_metrics import *
 from .ergo_report import *
 from .utilities import *
+from .disk_cache import *
@@ -6,76 +6,220 @@ Copyright 2018 Iterate Labs, Inc.
 All Rights Reserved.
 """
 
-__all__ = ["Pipestore"]
+__all__ = ["Pipestore", "PipestoreUploader"]
 __author__ = "Iterate Labs, Inc."
 __version__ = "Alpha"
 
+import atexit
 import boto3
 from botocore.errorfactory import ClientError
-import pickle
-import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from ergo_analytics.disk_cache import DiskLRUCache
+from ergo_analytics.data_structured import load_structured_data
+import threading
+import time
 import os
 import logging
 
 logger = logging.getLogger()
 
+PIPESTORE_MODES = ["s3", "local"]
+
 
 class Pipestore(object):
     """Here we can interact with the S3 bucket where we hold runs such as those
-    from data pipelines."""
+    from data pipelines.
+
+    A size-limited cache on the local disk can sit in front of the bucket
+    (when a folder for it is given): lookups try it first and everything
+    downloaded or uploaded is kept in it, so re-running a pipeline on the
+    same data does not go to S3. In "local" mode the bucket is not used at
+    all (for local development and tests without AWS).
+    """
+
+    _bucket_name = os.environ.get("OUTPUT_S3")
+    _mode = None
+    _local = None  # the cache on the local disk (None if not used)
+
+    # process-wide S3 clients (per credentials), shared by all pipestores:
+    _clients = dict()
+    _clients_lock = threading.Lock()
+
+    def __init__(self, mode=None, local_dir=None, local_max_bytes=None):
+        """
+        :param mode: "s3" (the bucket in the "OUTPUT_S3" environment variable,
+        with the local cache in front of it if "local_dir" is set) or "local"
+        (the local cache only); defaults to the "PIPESTORE_MODE" environment
+        variable, else "local" if "local_dir" is set and no bucket is, else
+        "s3".
+        :param local_dir: folder of the local cache; defaults to the
+        "PIPESTORE_LOCAL_DIR" environment variable. Without it there is no
+        local cache in "s3" mode, and "~/.cache/bsafe/pipestore" in "local"
+        mode.
+        :param local_max_bytes: size limit of the local cache; defaults to the
+        "PIPESTORE_LOCAL_MAX_BYTES" environment variable or 1 GB.
+        """
+        self._bucket_name = os.environ.get("OUTPUT_S3")
+
+        if local_dir is None:
+            local_dir = os.getenv("PIPESTORE_LOCAL_DIR")
+
+        if mode is None:
+            mode = os.getenv(
+                "PIPESTORE_MODE",
+                "local" if local_dir and not self._bucket_name else "s3",
+            )
+        mode = mode.strip().lower()
+        if mode not in PIPESTORE_MODES:
+            msg = f"Unknown pipestore mode '{mode}'! Valid options: {PIPESTORE_MODES}"
+            logger.error(msg)
+            raise Exception(msg)
+        if mode == "s3" and not self._bucket_name:
+            msg = (
+                "Please set OUTPUT_S3 to the bucket of the pipestore "
+                "(or PIPESTORE_MODE=local)!"
+            )
+            logger.error(msg)
+            raise Exception(msg)
+        self._mode = mode
+
+        if not local_dir and mode == "local":
+            local_dir = "~/.cache/bsafe/pipestore"
+        if local_max_bytes is None:
+            local_max_bytes = int(os.getenv("PIPESTORE_LOCAL_MAX_BYTES", 10**9))
+
+        if local_dir:
+            self._local = DiskLRUCache(directory=local_dir, max_bytes=local_max_bytes)
+
+    @property
+    def mode(self):
+        return self._mode
 
-    _bucket_name = os.environ.get("OUTPUT_S3");
+    @property
+    def uses_s3(self):
+        return self._mode == "s3"
+
+    def _local_get(self, key=None):
+        return self._local.get(key=key) if self._local is not None else None
+
+    def _local_put(self, key=None, data=None):
+        if self._local is not None:
+            self._local.put(key=key, data=data)
+
+    def _local_delete(self, key=None):
+        if self._local is not None:
+            self._local.delete(key=key)
 
     def delete_data(self, hash=None):
         """Delete all data under given hash."""
-        bucket = self._get_s3_resource().Bucket(self._bucket_name)
-        bucket.objects.filter(Prefix=self._return_folder(hash=hash)).delete()
+        self._local_delete(key=self._return_path(hash=hash))
+
+        if not self.uses_s3:
+            return
+
+        client = self._get_s3_client()
+        listing = client.list_objects_v2(
+            Bucket=self._bucket_name, Prefix=self._return_folder(hash=hash)
+        )
+        keys = [dict(Key=obj["Key"]) for obj in listing.get("Contents", [])]
+        if len(keys) > 0:
+            client.delete_objects(Bucket=self._bucket_name, Delete=dict(Objects=keys))
 
     def _get_s3_client(self):
-        """Return S3 object in form of a client."""
-        client = boto3.client(
-            "s3",
-            aws_access_key_id=os.environ.get(
-                "BSAFE_AWS_ACCESS_KEY", os.environ.get("AWS_ACCESS_KEY")
-            ),
-            aws_secret_access_key=os.environ.get(
-                "BSAFE_AWS_SECRET_KEY", os.environ.get("AWS_SECRET_KEY")
-            ),
+        """Return S3 object in form of a client.
+
+        Clients are kept for the lifetime of the process (per credentials)
+        so their connections are reused; boto3 clients are thread-safe.
+        """
+        credentials = (
+            os.environ.get("BSAFE_AWS_ACCESS_KEY", os.environ.get("AWS_ACCESS_KEY")),
+            os.environ.get("BSAFE_AWS_SECRET_KEY", os.environ.get("AWS_SECRET_KEY")),
         )
+        with self._clients_lock:
+            client = self._clients.get(credentials)
+            if client is None:
+                client = boto3.client(
+                    "s3",
+                    aws_access_key_id=credentials[0],
+                    aws_secret_access_key=credentials[1],
+                )
+                self._clients[credentials] = client
         return client
 
-    def _get_s3_resource(self):
-        """Returns S3 object in form of a resource."""
-        return boto3.resource(
-            "s3",
-            aws_access_key_id=os.environ.get(
-                "BSAFE_AWS_ACCESS_KEY", os.environ.get("AWS_ACCESS_KEY")
-            ),
-            aws_secret_access_key=os.environ.get(
-                "BSAFE_AWS_SECRET_KEY", os.environ.get("AWS_SECRET_KEY")
-            ),
-        )
+    @classmethod
+    def clear_clients(cls):
+        """Forget the cached S3 clients (e.g. after the credentials change)."""
+        with cls._clients_lock:
+            cls._clients.clear()
 
     def _check_if_data_exists(self, path=None):
         """Let's see if the data exists."""
+        if self._local is not None and path in self._local:
+            return True
+        if not self.uses_s3:
+            return False
+
         try:
-            logger.info("BUCKET NAME [%s]",self._bucket_name)
+            logger.info("BUCKET NAME [%s]", self._bucket_name)
             self._get_s3_client().head_object(Bucket=self._bucket_name, Key=path)
             return True
         except ClientError:
             # Not found
             return False
 
-    def upload_data(self, hash=None, data=None, metadata=None):
-        """Upload data under a given hash in the pipestore."""
+    def upload_data(self, hash=None, data=None, metadata=None, background=False):
+        """Upload data under a given hash in the pipestore.
 
-        path = self._return_path(hash=hash)
-        s3o = self._get_s3_resource().Object(self._bucket_name, path)
+        :param background: return once the data is in the local cache and
+        upload it to S3 in the background (see "PipestoreUploader").
+        """
+        self._upload(
+            path=self._return_path(hash=hash),
+            data=data,
+            metadata=metadata,
+            background=background,
+        )
 
-        if metadata is not None:
-            response = s3o.put(Body=data, Metadata=metadata)
+    def upload_chunk(self, hash=None, data=None, background=False):
+        """Upload a transformed chunk of data (bytes) under its hash (see
+        "DataFilterPipeline.run" with "memoize_chunks")."""
+        self._upload(
+            path=self._return_chunk_path(hash=hash), data=data, background=background
+        )
+
+    def get_chunk(self, hash=None):
+        """Return the bytes of the chunk under "hash" or None if not there."""
+        path = self._return_chunk_path(hash=hash)
+
+        data = self._local_get(key=path)
+        if data is None and self.uses_s3:
+            data = self._download(path=path)
+
+        return data
+
+    def _upload(self, path=None, data=None, metadata=None, background=False):
+        """Upload bytes to "path" (and keep them in the local cache, if
+        any)."""
+        self._local_put(key=path, data=data)
+
+        if not self.uses_s3:
+            return
+
+        if background:
+            PipestoreUploader.submit(
+                pipestore=self, path=path, data=data, metadata=metadata
+            )
         else:
-            response = s3o.put(Body=data)
+            self._put_object(path=path, data=data, metadata=metadata)
+
+    def _put_object(self, path=None, data=None, metadata=None):
+        """Upload bytes to "path" on S3."""
+        arguments = dict(Bucket=self._bucket_name, Key=path, Body=data)
+        if metadata is not None:
+            arguments["Metadata"] = metadata
+        response = self._get_s3_client().put_object(**arguments)
 
         assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
 
@@ -85,27 +229,314 @@ class Pipestore(object):
 
     def _return_path(self, hash=None):
         """Returns path to data on S3 given hash."""
+        # (the name is kept so earlier, pickled results are still found)
         return self._return_folder(hash=hash) + "pipeline_results.pkl"
 
+    def _return_chunk_path(self, hash=None):
+        """Returns path to a transformed chunk of data given its hash."""
+        return "data_pipeline_chunks" + "/" + hash + "/" + "chunk.arrow"
+
     def _download(self, path=None):
-        """Download data from S3."""
+        """Download data from S3 (into the local cache); None if not there."""
+        try:
+            obj = self._get_s3_client().get_object(Bucket=self._bucket_name, Key=path)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ["NoSuchKey", "404"]:
+                return None
+            if code in ["AccessDenied", "403"]:
+                # (S3 answers this for a missing key without "s3:ListBucket")
+                logger.warning(f"Access denied to {path} on S3, taken as missing.")
+                return None
+            raise
+
+        data = obj["Body"].read()
+        self._local_put(key=path, data=data)
+        return data
+
+    def prefetch(self, hashes=None, max_workers=8):
+        """Download the results under "hashes" that are on S3 into the local
+        cache, so looking them up later does not go to S3. The bucket is
+        listed once (instead of a request per hash) and the results found
+        are downloaded concurrently.
+
+        :param hashes: list of pipestore hashes (see
+        "DataFilterPipeline.get_run_hash").
+        :param max_workers: number of concurrent downloads.
+        :return: set of the hashes found (locally or on S3).
+        """
+        return set(self._fetch_many(hashes=hashes, max_workers=max_workers))
 
-        obj = self._get_s3_resource().Object(bucket_name=self._bucket_name, key=path)
-        buffer = io.BytesIO(obj.get()["Body"].read())
-        return pickle.loads(buffer.read())
+    def get_many(self, hashes=None, max_workers=8):
+        """Return the results (see "pipestore_hash_exists") of all "hashes" in
+        the pipestore: a dict of hash -> results for those found. As
+        "prefetch", this lists the bucket once and downloads concurrently.
+        """
+        results = dict()
+        for hash, data in self._fetch_many(
+            hashes=hashes, max_workers=max_workers
+        ).items():
+            try:
+                results[hash] = load_structured_data(data=data)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable pipestore entry {hash}: {e}")
+                self._local_delete(key=self._return_path(hash=hash))
+
+        return results
+
+    def _fetch_many(self, hashes=None, max_workers=8):
+        """The bytes of the results under "hashes" (hash -> bytes, for those
+        found): from the local cache, else downloaded from S3."""
+        found = dict()
+        missing = []
+        for hash in dict.fromkeys(hashes):
+            data = self._local_get(key=self._return_path(hash=hash))
+            if data is None:
+                missing.append(hash)
+            else:
+                found[hash] = data
+
+        if len(missing) == 0 or not self.uses_s3:
+            return found
+
+        on_s3 = self._list_keys(prefix="data_pipeline/")
+        to_download = [
+            hash for hash in missing if self._return_path(hash=hash) in on_s3
+        ]
+        logger.debug(
+            f"Pipestore: {len(found)} results found locally, downloading "
+            f"{len(to_download)} of {len(missing)} from S3."
+        )
+
+        def download(hash):
+            return hash, self._download(path=self._return_path(hash=hash))
+
+        # (the S3 client is shared by the threads)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as workers:
+            for hash, data in workers.map(download, to_download):
+                if data is not None:
+                    found[hash] = data
+
+        return found
+
+    def _list_keys(self, prefix=None):
+        """Return the set of keys under "prefix" on S3."""
+        client = self._get_s3_client()
+        keys = set()
+        arguments = dict(Bucket=self._bucket_name, Prefix=prefix)
+        while True:
+            listing = client.list_objects_v2(**arguments)
+            keys.update(obj["Key"] for obj in listing.get("Contents", []))
+            if not listing.get("IsTruncated"):
+                return keys
+            arguments["ContinuationToken"] = listing["NextContinuationToken"]
 
     def pipestore_hash_exists(self, hash=None):
-        """Check if hash is present in the pipestore."""
+        """Check if hash is present in the pipestore (the local cache first,
+        then S3) and return the data if so (see "load_structured_data")."""
 
         path = self._return_path(hash=hash)
-        data_exists = self._check_if_data_exists(path=path)
 
-        exists = False
-        data = None
-        if data_exists:
-            # download the data
-            exists = True
+        data = self._local_get(key=path)
+        if data is not None:
+            try:
+                return True, load_structured_data(data=data)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable pipestore entry: {e}")
+                self._local_delete(key=path)
 
-            data = self._download(path=path)
+        if not self.uses_s3:
+            return False, None
+
+        # (one request: a missing key is not worth a "head" first)
+        data = self._download(path=path)
+        if data is None:
+            return False, None
+
+        return True, load_structured_data(data=data)
+
+
+class PipestoreUploader(object):
+    """Uploads to the pipestore bucket in a bounded pool of background
+    threads (see "Pipestore.upload_data" with "background"), so a pipeline
+    run does not wait for them.
+
+    At most "PIPESTORE_UPLOAD_MAX_PENDING" uploads (environment variable,
+    default 16) are in the pool; submitting more waits for one to finish.
+    A failed upload goes to a retry queue and is tried again - after 1, 2,
+    4, ... seconds, up to "PIPESTORE_UPLOAD_MAX_ATTEMPTS" times (default 5)
+    - when later uploads are submitted and on "flush". Call "flush" before
+    the process exits: it is registered with "atexit" and the dramatiq
+    workers of the app flush on shutdown. "metrics" counts what happened.
+    """
+
+    _lock = threading.Lock()
+    _pid = None  # (a forked process starts its own pool)
+    _executor = None
+    _slots = None  # bounds the uploads in the pool
+    _pending = set()
+    _retries = deque()
+    _max_attempts = None
+    _max_retries = None
+    _retry_delay = 1.0  # seconds before the first retry (doubling after)
+    _metrics = dict(
+        submitted=0, uploaded=0, bytes_uploaded=0, failed=0, retried=0, dropped=0
+    )
+
+    @classmethod
+    def submit(cls, pipestore=None, path=None, data=None, metadata=None):
+        """Upload bytes to "path" with "pipestore" (see "Pipestore._put_object")
+        in the background."""
+        cls._retry()
+        with cls._lock:
+            cls._metrics["submitted"] += 1
+        cls._submit(
+            upload=dict(
+                pipestore=pipestore,
+                path=path,
+                data=data,
+                metadata=metadata,
+                attempts=0,
+                next_attempt=None,
+            )
+        )
+
+    @classmethod
+    def flush(cls, timeout=None):
+        """Wait for the uploads in the pool and retry the failed ones until
+        they are uploaded or dropped (or "timeout" seconds have passed).
+
+        :return: True if nothing is left to upload.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0, deadline - time.monotonic())
+
+        while True:
+            with cls._lock:
+                pending = list(cls._pending)
+            wait(pending, timeout=remaining())
+
+            with cls._lock:
+                if len(cls._pending) > 0 and remaining() == 0:
+                    break
+                if len(cls._pending) > 0:
+                    continue
+                if len(cls._retries) == 0:
+                    return True
+                next_attempt = min(upload["next_attempt"] for upload in cls._retries)
+
+            delay = max(0, next_attempt - time.monotonic())
+            if deadline is not None and delay >= remaining():
+                break
+            time.sleep(delay)
+            cls._retry()
+
+        metrics = cls.metrics()
+        logger.error(
+            f"Pipestore uploads not finished on flush: {metrics['pending']} "
+            f"pending and {metrics['queued_for_retry']} queued for retry."
+        )
+        return False
+
+    @classmethod
+    def metrics(cls):
+        """Counts of the uploads: submitted, uploaded (and bytes), failed
+        attempts, retried, dropped (given up on) - and those pending and
+        queued for retry now."""
+        with cls._lock:
+            metrics = dict(cls._metrics)
+            metrics["pending"] = len(cls._pending)
+            metrics["queued_for_retry"] = len(cls._retries)
+        return metrics
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._lock:
+            if cls._executor is None or cls._pid != os.getpid():
+                max_workers = int(os.getenv("PIPESTORE_UPLOAD_WORKERS", 2))
+                max_pending = int(os.getenv("PIPESTORE_UPLOAD_MAX_PENDING", 16))
+                cls._max_attempts = int(os.getenv("PIPESTORE_UPLOAD_MAX_ATTEMPTS", 5))
+                cls._max_retries = int(os.getenv("PIPESTORE_UPLOAD_MAX_RETRIES", 100))
+
+                if cls._pid is None:
+                    atexit.register(cls.flush)
+                cls._pid = os.getpid()
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="pipestore-upload"
+                )
+                cls._slots = threading.BoundedSemaphore(max_pending)
+                cls._pending = set()
+                cls._retries = deque()
+            return cls._executor
+
+    @classmethod
+    def _submit(cls, upload=None):
+        executor = cls._get_executor()
+        cls._slots.acquire()
+        with cls._lock:
+            future = executor.submit(cls._upload, upload)
+            cls._pending.add(future)
+        future.add_done_callback(cls._done)
+
+    @classmethod
+    def _done(cls, future=None):
+        with cls._lock:
+            cls._pending.discard(future)
+        cls._slots.release()
+
+    @classmethod
+    def _upload(cls, upload=None):
+        upload["attempts"] += 1
+        try:
+            upload["pipestore"]._put_object(
+                path=upload["path"], data=upload["data"], metadata=upload["metadata"]
+            )
+        except Exception as e:
+            cls._failed(upload=upload, error=e)
+            return
+
+        with cls._lock:
+            cls._metrics["uploaded"] += 1
+            cls._metrics["bytes_uploaded"] += len(upload["data"])
+
+    @classmethod
+    def _failed(cls, upload=None, error=None):
+        with cls._lock:
+            cls._metrics["failed"] += 1
+            retry = (
+                upload["attempts"] < cls._max_attempts
+                and len(cls._retries) < cls._max_retries
+            )
+            if retry:
+                upload["next_attempt"] = time.monotonic() + cls._retry_delay * 2 ** (
+                    upload["attempts"] - 1
+                )
+                cls._retries.append(upload)
+            else:
+                cls._metrics["dropped"] += 1
+
+        if retry:
+            logger.warning(
+                f"Upload of '{upload['path']}' to the pipestore failed "
+                f"('{error}'); retrying later."
+            )
+        else:
+            logger.error(
+                f"Upload of '{upload['path']}' to the pipestore failed "
+                f"('{error}') after {upload['attempts']} attempts; dropping it."
+            )
+
+    @classmethod
+    def _retry(cls):
+        """Submit the uploads in the retry queue that are due."""
+        now = time.monotonic()
+        with cls._lock:
+            due = [upload for upload in cls._retries if upload["next_attempt"] <= now]
+            for upload in due:
+                cls._retries.remove(upload)
+            cls._metrics["retried"] += len(due)
 
-        return exists, data
+        for upload in due:
+            cls._submit(upload=upload)
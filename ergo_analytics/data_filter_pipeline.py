@@ -12,22 +12,42 @@ __all__ = ["DataFilterPipeline"]
 __author__ = "Iterate Labs, Inc."
 __version__ = "Alpha"
 
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+import functools
 import hashlib
+import inspect
+import threading
+import time
 import os
+import sys
 import json
 import numpy as np
 import pandas as pd
 import pickle
+import pyarrow as pa
 import shutil
 import matplotlib.pyplot as plt
 from ergo_analytics.filters import CreateStructuredData
 from ergo_analytics.utilities import subsample_data
+from ergo_analytics.utilities import subsample_stream
+from ergo_analytics.utilities import apply_dtype_policy
 from ergo_analytics.aws_utilities import Pipestore
+from ergo_analytics.data_structured import dump_structured_data
+from ergo_analytics.data_structured import compress_bytes
+from ergo_analytics.data_structured import decompress_bytes
+from ergo_analytics.pipeline_stats import PipelineRunStats
 import logging
 
 logger = logging.getLogger()
 
+# the copy of the pipeline each worker runs chunks with (see
+# "_init_chunk_worker"):
+_worker = threading.local()
+
 
 class DataFilterPipeline(object):
     """
@@ -42,6 +62,10 @@ class DataFilterPipeline(object):
     _do_verify_pipeline = None
     _most_recent_pipestore_hash = None
     _found_in_pipestore = None
+    _count_copies = None
+    _bytes_copied = None
+    _run_stats = None
+    _chunk_stats = None
 
     def __init__(self, verify_pipeline=True):
         """
@@ -55,6 +79,38 @@ class DataFilterPipeline(object):
         self._pipeline = dict()  # dict is ordered
         self._results = dict()
         self._do_verify_pipeline = verify_pipeline
+        self._count_copies = False
+        self._bytes_copied = []
+
+    @property
+    def carries_state_between_chunks(self):
+        """Does any filter pass information from one chunk to the next?"""
+        return any(
+            filter.carries_state_between_chunks for filter in self._pipeline.values()
+        )
+
+    @property
+    def bytes_copied(self):
+        """With "count_copies" on: the bytes each filter allocated (copied
+        or computed anew) in each chunk of the latest run - a list with a
+        dict of {filter name: bytes} per chunk."""
+        return self._bytes_copied
+
+    @property
+    def run_stats(self):
+        """The cost of each filter in each chunk of the latest run (see
+        "PipelineRunStats"); None before the first run."""
+        return self._run_stats
+
+    def count_copies(self, enable=True):
+        """
+        Count the bytes the filters allocate in each chunk (see
+        "bytes_copied"); for debugging memory use. The chunks are processed
+        one after the other while counting.
+
+        :param enable: turn counting on or off.
+        """
+        self._count_copies = enable
 
     def update_params(self, new_params=None):
         """
@@ -129,13 +185,18 @@ class DataFilterPipeline(object):
     #     import pdb
     #     pdb.set_trace()
 
-    def get_pipestore_hash(self, data=None, options=None):
-        """Hash this pipeline as per the pipestore."""
-        _hash = hashlib.sha256()
+    def get_pipestore_hash(self, data=None, options=None, _hash=None):
+        """Hash this pipeline as per the pipestore.
 
-        # hash the data:
-        data_hash = pd.util.hash_pandas_object(data, index=True).values
-        _hash.update(data_hash)
+        :param _hash: a hash already updated with the data (see
+        "_hash_stream"), in which case "data" is not used.
+        """
+        if _hash is None:
+            _hash = hashlib.sha256()
+
+            # hash the data:
+            data_hash = pd.util.hash_pandas_object(data, index=True).values
+            _hash.update(data_hash)
 
         # hash the filters (notice the order matters)
         for _, (_, filter) in enumerate(self._pipeline.items()):
@@ -150,6 +211,74 @@ class DataFilterPipeline(object):
 
         return _hash.hexdigest()
 
+    @staticmethod
+    def _hash_stream(chunks=None, _hash=None):
+        """Pass "chunks" through while hashing them into "_hash" (the row
+        hashes of the chunks are those of all the data concatenated)."""
+        for chunk in chunks:
+            _hash.update(pd.util.hash_pandas_object(chunk, index=True).values)
+            yield chunk
+
+    def get_run_hash(self, on_raw_data=None, **run_arguments):
+        """The pipestore hash "run" looks up when run on "on_raw_data" (a
+        DataFrame) with these arguments - to fetch the results of many runs
+        at once (see "Pipestore.get_many") and pass them to "run" as
+        "prefetched".
+        """
+        arguments = inspect.signature(self.run).bind(
+            on_raw_data=on_raw_data, **run_arguments
+        )
+        arguments.apply_defaults()
+        arguments = arguments.arguments
+
+        dtype_policy = arguments["dtype_policy"]
+        if dtype_policy not in [None, "default"]:
+            on_raw_data = apply_dtype_policy(
+                data=on_raw_data, dtype_policy=dtype_policy
+            )
+
+        options = self._run_options(
+            **{
+                name: value
+                for name, value in arguments.items()
+                if name in inspect.signature(self._run_options).parameters
+            }
+        )
+        return self.get_pipestore_hash(data=on_raw_data, options=options)
+
+    @staticmethod
+    def _run_options(
+        is_sorted=None,
+        use_subsampling=None,
+        number_of_subsamples=None,
+        randomize_subsampling=None,
+        consecutive_subsamples=None,
+        subsample_size_index=None,
+        debug=None,
+        debug_folder_prepend=None,
+        anchor_data_vs_time=None,
+        dtype_policy=None,
+        kwargs=None,
+    ):
+        """The arguments of "run" that decide the pipestore hash."""
+        options = (
+            is_sorted,
+            use_subsampling,
+            number_of_subsamples,
+            randomize_subsampling,
+            consecutive_subsamples,
+            subsample_size_index,
+            debug,
+            debug_folder_prepend,
+            anchor_data_vs_time,
+            kwargs,
+        )
+        if dtype_policy not in [None, "default"]:
+            # (the default leaves the data - and the hashes - as they were)
+            options += (dtype_policy,)
+
+        return options
+
     def check_pipestore(self, data=None, options=None):
         """Check the pipestore for whether this pipeline was already run and return results if so."""
 
@@ -173,45 +302,115 @@ class DataFilterPipeline(object):
         debug=False,
         debug_folder_prepend=None,
         anchor_data_vs_time=False,
+        dtype_policy="default",
+        max_workers=1,
+        executor="process",
+        shared_prefix=None,
+        memoize_chunks=False,
+        prefetched=None,
         **kwargs,
     ):
         """Run the pipeline on the incoming raw data.
 
         This is done by splitting the data into chunks and iterating over
         said chunks. The chunk size can be controlled via the incoming
-        parameters.
-
-        :param on_raw_data: Pandas DataFrame with raw data to be processed.
+        parameters. The pointwise filters the pipeline starts with (see
+        "BaseTransformation.pointwise") are applied to all of the data once
+        instead when the chunks cover it (consecutive or overlapping chunks).
+        What each filter cost in each chunk is in "run_stats" afterwards.
+
+        :param on_raw_data: Pandas DataFrame with raw data to be processed,
+        or an iterable of DataFrames (such as "LoadElasticSearch.
+        retrieve_data_iter"). With consecutive subsamples (and the data not
+        anchored in time) the iterable is consumed chunk by chunk so only
+        about one subsample of raw data is in memory at a time; otherwise the
+        chunks are first concatenated. A streamed run is not looked up in the
+        pipestore (that takes all the data) but its results are uploaded.
         :param num_rows_per_chunk: how many rows per chunk of data (if this
         value exceeds the number of total rows then there will be 1 chunk of
         data to process)
 
         :param do_randomize_chunks: should the chunks of data be
         selected at random?
+        :param dtype_policy: "default" carries the angles as float64,
+        "compact" as float32 (half the memory); see "apply_dtype_policy".
+        :param max_workers: when no filter carries state between chunks (see
+        "carries_state_between_chunks") the chunks are processed in parallel
+        by this many workers (None: one per CPU); 1 (the default) processes
+        them one after the other. Only worth it for many chunks - and not
+        with processes inside a process that has threads or is one of a pool
+        itself.
+        :param executor: "process" or "thread" - what the workers are.
+        :param shared_prefix: the leading filters of this pipeline already
+        applied to all of the data (see "run_many").
+        :param memoize_chunks: keep each transformed chunk in the pipestore
+        under the hash of its raw data and of the filters (with their
+        parameters), and reuse it when a chunk with the same data comes by
+        again - e.g. rerunning on a recording that has grown only runs the
+        new chunks. Not done when a filter carries state between chunks, nor
+        in debug mode. The filter results ("get_result") are those of the
+        latest chunk that was not reused.
+        :param prefetched: dict of pipestore hash -> results (see
+        "get_run_hash" and "Pipestore.get_many"); the pipestore is then not
+        looked up, the run is found only if its hash is in the dict.
         """
-        raw_data = on_raw_data.copy()
+        start = time.perf_counter()
+        self._run_stats = PipelineRunStats()
+
+        is_stream = on_raw_data is not None and not isinstance(
+            on_raw_data, pd.DataFrame
+        )
+        if is_stream and not (
+            use_subsampling and consecutive_subsamples and not anchor_data_vs_time
+        ):
+            # these ways of subsampling need all of the data at once:
+            on_raw_data = pd.concat(list(on_raw_data))
+            is_stream = False
 
         if with_format_code is not None:
             # ensure the data has the correct columns
             with_format_code = str(with_format_code).strip()
 
         # options that will decide the cache state:
-        options = (
-            is_sorted,
-            use_subsampling,
-            number_of_subsamples,
-            randomize_subsampling,
-            consecutive_subsamples,
-            subsample_size_index,
-            debug,
-            debug_folder_prepend,
-            anchor_data_vs_time,
-            kwargs,
-        )
-
-        pipeline_run_found, results, pipestore_hash = self.check_pipestore(
-            data=raw_data, options=options
+        options = self._run_options(
+            is_sorted=is_sorted,
+            use_subsampling=use_subsampling,
+            number_of_subsamples=number_of_subsamples,
+            randomize_subsampling=randomize_subsampling,
+            consecutive_subsamples=consecutive_subsamples,
+            subsample_size_index=subsample_size_index,
+            debug=debug,
+            debug_folder_prepend=debug_folder_prepend,
+            anchor_data_vs_time=anchor_data_vs_time,
+            dtype_policy=dtype_policy,
+            kwargs=kwargs,
         )
+        if dtype_policy not in [None, "default"]:
+            if is_stream:
+                on_raw_data = (
+                    apply_dtype_policy(data=chunk, dtype_policy=dtype_policy)
+                    for chunk in on_raw_data
+                )
+            elif on_raw_data is not None:
+                on_raw_data = apply_dtype_policy(
+                    data=on_raw_data, dtype_policy=dtype_policy
+                )
+
+        if is_stream:
+            # hash the data as it streams by:
+            stream_hash = hashlib.sha256()
+            on_raw_data = self._hash_stream(chunks=on_raw_data, _hash=stream_hash)
+            pipeline_run_found, results, pipestore_hash = False, None, None
+        elif prefetched is not None:
+            # (what is not among the prefetched results is not in the
+            # pipestore)
+            pipestore_hash = self.get_pipestore_hash(data=on_raw_data, options=options)
+            pipeline_run_found = pipestore_hash in prefetched
+            results = prefetched.get(pipestore_hash)
+        else:
+            pipeline_run_found, results, pipestore_hash = self.check_pipestore(
+                data=on_raw_data, options=options
+            )
 
         self._most_recent_pipestore_hash = pipestore_hash
         self._found_in_pipestore = pipeline_run_found
@@ -220,10 +419,58 @@ class DataFilterPipeline(object):
             msg = "Previous pipeline results found in pipestore, returning those"
             print(msg)
             logger.debug(msg)
+            self._run_stats.found_in_pipestore = True
+            self._run_stats.wall_time = time.perf_counter() - start
             return results
 
         logger.info(f"Anchor data chunks in time?: {anchor_data_vs_time}.")
 
+        # the leading filters another pipeline shares with this one are
+        # applied to all of the data once; the chunks start after them:
+        first_filter = 0
+        if shared_prefix is not None and not is_stream and not debug:
+            on_raw_data = shared_prefix.apply(
+                data=on_raw_data,
+                data_format_code=with_format_code,
+                dtype_policy=dtype_policy,
+                stats=self._run_stats,
+            )
+            first_filter = shared_prefix.number_of_filters
+            for filter, result in zip(self._pipeline.values(), shared_prefix.results):
+                filter.update(new_params=dict(data_format_code=with_format_code))
+                self._results[filter] = result
+
+        # so are the leading pointwise filters (see "BaseTransformation.
+        # pointwise") when the chunks hold at least as many rows as the data
+        # (e.g. chunks anchored in time overlap) - rather than per chunk:
+        hoisted = self._leading_pointwise_filters(first_filter=first_filter)
+        if (
+            len(hoisted) > 0
+            and isinstance(on_raw_data, pd.DataFrame)
+            and not debug
+            and self._rows_in_chunks(
+                number_of_rows=len(on_raw_data),
+                use_subsampling=use_subsampling,
+                number_of_subsamples=number_of_subsamples,
+                consecutive_subsamples=consecutive_subsamples,
+                subsample_size_index=subsample_size_index,
+            )
+            >= len(on_raw_data)
+        ):
+            logger.debug(f"Applying the pointwise filters {list(hoisted)} once.")
+            hoisted = _SharedPrefix(filters=hoisted)
+            on_raw_data = hoisted.apply(
+                data=on_raw_data,
+                data_format_code=with_format_code,
+                dtype_policy=dtype_policy,
+                stats=self._run_stats,
+            )
+            for filter, result in zip(
+                list(self._pipeline.values())[first_filter:], hoisted.results
+            ):
+                self._results[filter] = result
+            first_filter += hoisted.number_of_filters
+
         if debug:
             logger.debug("Creating pipeline folder - results will go there...")
             pipeline_folder = kwargs.get("debug_folder", "pipeline")
@@ -239,10 +486,11 @@ class DataFilterPipeline(object):
             logger.debug(f"Switching to folder '{pipeline_folder}'")
             os.chdir(pipeline_folder)
 
-            columns_to_plot = list(set(on_raw_data.columns) - {"Date-Time"})
-            plot_incoming_data = on_raw_data.loc[:, columns_to_plot]
-            plot_incoming_data.plot()
-            plt.savefig("incoming_raw_data.png")
+            if not is_stream:
+                columns_to_plot = list(set(on_raw_data.columns) - {"Date-Time"})
+                plot_incoming_data = on_raw_data.loc[:, columns_to_plot]
+                plot_incoming_data.plot()
+                plt.savefig("incoming_raw_data.png")
 
         logger.debug("Subsample settings:")
         logger.debug(f"Number of subsamples = {number_of_subsamples}")
@@ -256,9 +504,14 @@ class DataFilterPipeline(object):
         # was originally introduced due to the zero-line-filter
         parameters = dict()
 
-        list_of_transformed_data_chunks = []
-        for j, (this_chunk, sample_info) in enumerate(
-            subsample_data(
+        if is_stream:
+            subsamples = subsample_stream(
+                chunks=on_raw_data,
+                subsample_size_index=subsample_size_index,
+                exact_chunk_size=kwargs.get("exact_chunk_size", True),
+            )
+        else:
+            subsamples = subsample_data(
                 data=on_raw_data,
                 number_of_subsamples=number_of_subsamples,
                 subsample_size_index=subsample_size_index,
@@ -268,7 +521,44 @@ class DataFilterPipeline(object):
                 anchor_data_vs_time=anchor_data_vs_time,
                 **kwargs,
             )
-        ):
+
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        run_in_parallel = (
+            use_subsampling
+            and max_workers > 1
+            and not debug
+            and not self._count_copies
+            and not self.carries_state_between_chunks
+        )
+
+        memo = None
+        if memoize_chunks and not debug and not self.carries_state_between_chunks:
+            memo = _ChunkMemo.create(
+                pipeline=self,
+                first_filter=first_filter,
+                data_format_code=with_format_code,
+                dtype_policy=dtype_policy,
+            )
+
+        self._bytes_copied = []
+        list_of_transformed_data_chunks = []
+        if run_in_parallel:
+            list_of_transformed_data_chunks = self._run_chunks_in_parallel(
+                subsamples=subsamples,
+                max_workers=max_workers,
+                executor=executor,
+                is_sorted=is_sorted,
+                data_format_code=with_format_code,
+                dtype_policy=dtype_policy,
+                first_filter=first_filter,
+                memo=memo,
+            )
+            # (the chunks were consumed above)
+            subsamples = []
+
+        for j, (this_chunk, sample_info) in enumerate(subsamples):
 
             # here we process the data in chunks generated by the iterator
             # "subsample_data". We do this for this main reason:
@@ -295,13 +585,26 @@ class DataFilterPipeline(object):
                 curr_dir = os.getcwd()
                 os.chdir(chunk_dir_name)
 
-            this_structured_data_chunk = self._run_chunk(
-                on_raw_data_chunk=this_chunk,
-                is_sorted=is_sorted,
-                parameters=parameters,
-                debug=debug,
-                data_format_code=with_format_code,
-            )
+            this_structured_data_chunk = None
+            if memo is not None:
+                memo_key = memo.key(chunk=this_chunk)
+                this_structured_data_chunk = memo.get(key=memo_key)
+
+            if this_structured_data_chunk is not None:
+                self._run_stats.add_chunk(memoized=True)
+            else:
+                this_structured_data_chunk = self._run_chunk(
+                    on_raw_data_chunk=this_chunk,
+                    is_sorted=is_sorted,
+                    parameters=parameters,
+                    debug=debug,
+                    data_format_code=with_format_code,
+                    dtype_policy=dtype_policy,
+                    first_filter=first_filter,
+                )
+                self._run_stats.add_chunk(filters=self._chunk_stats)
+                if memo is not None:
+                    memo.put(key=memo_key, data=this_structured_data_chunk)
 
             list_of_transformed_data_chunks.append(this_structured_data_chunk)
 
@@ -318,6 +621,11 @@ class DataFilterPipeline(object):
         # all_structured_data.reset_index(drop=True, inplace=True)
         # also: if subsampling is False we just have a 1-element list now.
 
+        if memo is not None:
+            logger.info(
+                f"Memoized chunks: {memo.hits} reused, {memo.misses} processed."
+            )
+
         logger.debug("Raw data successfully converted to structured data!")
         # always create structured data at the end of the pipeline:
         all_structured_data = DataFilterPipeline._create_structured_data(
@@ -328,21 +636,226 @@ class DataFilterPipeline(object):
             os.chdir(orig_dir)
             plt.close()
 
+        if is_stream:
+            # the stream has been consumed so we know its hash now:
+            pipestore_hash = self.get_pipestore_hash(options=options, _hash=stream_hash)
+            self._most_recent_pipestore_hash = pipestore_hash
+
         # now upload to the pipestore
-        data_to_upload = pickle.dumps(all_structured_data)
+        try:
+            data_to_upload = dump_structured_data(structured_data=all_structured_data)
+        except Exception as e:
+            logger.warning(f"Storing the results pickled ('{e}').")
+            data_to_upload = pickle.dumps(all_structured_data)
 
+        # (to S3 in the background - see "PipestoreUploader")
         logger.debug("Uploading results to the pipestore.")
         try:
             self._upload_to_pipestore(hash=pipestore_hash, data=data_to_upload)
         except Exception as e:
-            print("Upload to data store failed with '{}', continuing.".format(e))
+            logger.warning(f"Upload to the pipestore failed with '{e}', continuing.")
+
+        self._run_stats.wall_time = time.perf_counter() - start
+        logger.debug(f"Pipeline run: {self._run_stats}")
 
         return all_structured_data
 
+    @staticmethod
+    def run_many(runs=None, on_raw_data=None, with_format_code=None):
+        """Run several pipelines on the same raw data.
+
+        The pointwise filters (see "BaseTransformation.pointwise") all the
+        pipelines start with - same filters with the same parameters in the
+        same order - are applied to all of the data once; each pipeline then
+        only runs the filters after them. This gives the same results (and
+        pipestore hashes) as running the pipelines one by one.
+
+        Example:
+        >> structured_all_data, chunks = DataFilterPipeline.run_many(
+        >>     runs=[
+        >>         (delta_only_pipeline, dict(use_subsampling=False)),
+        >>         (pipeline, dict(use_subsampling=True, ...)),
+        >>     ],
+        >>     on_raw_data=raw_data,
+        >>     with_format_code="5",
+        >> )
+
+        :param runs: list of (pipeline, dict of arguments to its "run").
+        :param on_raw_data: Pandas DataFrame with the raw data.
+        :param with_format_code: the format of the raw data.
+        :return: list of the results of the runs (in order).
+        """
+        shared_prefix = None
+        if isinstance(on_raw_data, pd.DataFrame) and len(runs) > 1:
+            prefix = DataFilterPipeline._find_shared_prefix(
+                pipelines=[pipeline for pipeline, _ in runs]
+            )
+            if len(prefix) > 0:
+                logger.debug(f"Applying the shared filters {list(prefix)} once.")
+                shared_prefix = _SharedPrefix(filters=prefix)
+
+        return [
+            pipeline.run(
+                on_raw_data=on_raw_data,
+                with_format_code=with_format_code,
+                shared_prefix=shared_prefix,
+                **kwargs,
+            )
+            for pipeline, kwargs in runs
+        ]
+
+    @staticmethod
+    def _find_shared_prefix(pipelines=None):
+        """The leading pointwise filters (name -> filter of the first
+        pipeline) that all "pipelines" have in common."""
+        all_filters = [list(pipeline._pipeline.items()) for pipeline in pipelines]
+
+        prefix = dict()
+        for filters in zip(*all_filters):
+            name, first = filters[0]
+            if not all(
+                type(filter) is type(first)
+                and filter.pointwise
+                and _same_parameters(filter.get_parameters(), first.get_parameters())
+                for _, filter in filters
+            ):
+                break
+            prefix[name] = first
+
+        return prefix
+
+    def _leading_pointwise_filters(self, first_filter=0):
+        """The pointwise filters (name -> filter) the pipeline runs first,
+        starting from "first_filter"."""
+        filters = dict()
+        for name, filter in list(self._pipeline.items())[first_filter:]:
+            if not filter.pointwise:
+                break
+            filters[name] = filter
+
+        return filters
+
+    @staticmethod
+    def _rows_in_chunks(
+        number_of_rows=None,
+        use_subsampling=False,
+        number_of_subsamples=10,
+        consecutive_subsamples=False,
+        subsample_size_index=1000,
+    ):
+        """About how many rows the chunks of data with "number_of_rows"
+        rows hold together (see "subsample_data")."""
+        if not use_subsampling or consecutive_subsamples:
+            # (all rows; more when the chunks are anchored in time)
+            return number_of_rows
+
+        return int(number_of_subsamples) * int(subsample_size_index)
+
+    def _run_chunks_in_parallel(
+        self,
+        subsamples=None,
+        max_workers=None,
+        executor="process",
+        is_sorted=True,
+        data_format_code=None,
+        dtype_policy="default",
+        first_filter=0,
+        memo=None,
+    ):
+        """Run the pipeline on the chunks in "subsamples" in a pool of
+        workers and return the transformed chunks in order.
+
+        Only a few chunks per worker are in flight at a time, so a stream of
+        chunks is still consumed as it goes.
+
+        :param memo: chunks found in this "_ChunkMemo" are not sent to the
+        workers; those that are get stored in it.
+        """
+        if executor not in ["process", "thread"]:
+            msg = f"Unknown executor '{executor}'! Valid options: process, thread"
+            logger.error(msg)
+            raise Exception(msg)
+
+        # as when running the chunks here, the filters take on the format:
+        for filter in self._pipeline.values():
+            filter.update(new_params=dict(data_format_code=data_format_code))
+
+        # the workers run copies of the filters (not their results) - only
+        # those not applied to all of the data already:
+        pipeline = DataFilterPipeline(verify_pipeline=False)
+        pipeline._pipeline = dict(list(self._pipeline.items())[first_filter:])
+
+        pool = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        logger.debug(f"Processing chunks in parallel ({max_workers} {executor}es).")
+
+        list_of_transformed_data_chunks = []
+        with pool(
+            max_workers=max_workers,
+            initializer=_init_chunk_worker,
+            initargs=(pipeline,),
+        ) as workers:
+            in_flight = deque()
+            for j, (this_chunk, sample_info) in enumerate(subsamples):
+                msg = (
+                    f"...Processing chunk {j + 1}; "
+                    f"chunk indices=({this_chunk.index[0]}, "
+                    f"{this_chunk.index[-1]})."
+                )
+                logger.debug(msg)
+                print(msg)
+
+                memo_key, transformed_data_chunk = None, None
+                if memo is not None:
+                    memo_key = memo.key(chunk=this_chunk)
+                    transformed_data_chunk = memo.get(key=memo_key)
+
+                if transformed_data_chunk is not None:
+                    # (kept in order with the chunks still in the workers)
+                    future = Future()
+                    future.set_result((transformed_data_chunk, dict(), None))
+                    in_flight.append((None, future))
+                    continue
+
+                in_flight.append(
+                    (
+                        memo_key,
+                        workers.submit(
+                            _run_chunk_in_worker,
+                            on_raw_data_chunk=this_chunk,
+                            is_sorted=is_sorted,
+                            data_format_code=data_format_code,
+                            dtype_policy=dtype_policy,
+                        ),
+                    )
+                )
+                while len(in_flight) >= 2 * max_workers:
+                    list_of_transformed_data_chunks.append(
+                        self._collect_chunk(*in_flight.popleft(), memo=memo)
+                    )
+
+            while len(in_flight) > 0:
+                list_of_transformed_data_chunks.append(
+                    self._collect_chunk(*in_flight.popleft(), memo=memo)
+                )
+
+        return list_of_transformed_data_chunks
+
+    def _collect_chunk(self, memo_key=None, future=None, memo=None):
+        """The transformed chunk of a worker (keeping the filter results of
+        the latest chunk, as when running the chunks here); stored in "memo"
+        under "memo_key" if given."""
+        transformed_data_chunk, results, chunk_stats = future.result()
+        for filter_name, result in results.items():
+            self._results[self._pipeline[filter_name]] = result
+        self._run_stats.add_chunk(filters=chunk_stats, memoized=chunk_stats is None)
+        if memo is not None and memo_key is not None:
+            memo.put(key=memo_key, data=transformed_data_chunk)
+        return transformed_data_chunk
+
     def _upload_to_pipestore(self, hash=None, data=None):
         """Upload data to the pipestore."""
         pst = Pipestore()
-        pst.upload_data(hash=hash, data=data, metadata=None)
+        pst.upload_data(hash=hash, data=data, metadata=None, background=True)
 
     def _run_chunk(
         self,
@@ -351,24 +864,36 @@ class DataFilterPipeline(object):
         is_sorted=True,
         debug=False,
         data_format_code=None,
+        dtype_policy="default",
+        first_filter=0,
     ):
         """Run the pipeline on incoming raw data.
 
+        :param first_filter: skip the filters before this one (they were
+        already applied to the data).
         :return: structured data.
         """
-        # make sure the raw data points have unique indices:
-        on_raw_data_chunk.reset_index(drop=True, inplace=True)
-
-        initial_columns = list(on_raw_data_chunk.columns)
-
-        initial_data = on_raw_data_chunk
-
         all_added_columns = []  # keep track of any additional/derivative data
         all_removed_columns = []
 
-        current_data = on_raw_data_chunk.copy()
+        # copy-on-write: the filters get a frame of their own which shares
+        # the arrays of the incoming chunk (often a view of all of the raw
+        # data); it is only copied before a filter writing into the arrays
+        # (see "BaseTransformation.mutates_input"):
+        current_data = on_raw_data_chunk.copy(deep=False)
+        # make sure the raw data points have unique indices:
+        current_data.index = pd.RangeIndex(len(current_data))
+        is_copied = False
+
+        self._chunk_stats = []  # (see "PipelineRunStats")
         for filter_ix, (filter_name, filter) in enumerate(self._pipeline.items()):
             # now loop over, and apply, each filter to this chunk of data:
+            if filter_ix < first_filter:
+                continue
+
+            # (filters may add columns to the frame they are given)
+            arrays_before_filter = _base_arrays(data=current_data)
+            rows_in = len(current_data)
 
             if debug:
                 # create filter directory inside this data chunk
@@ -392,10 +917,40 @@ class DataFilterPipeline(object):
             # pass data format code into all filters
             parameters[filter_name]["data_format_code"] = data_format_code
 
+            start = time.perf_counter()
+            copies = 0
+            if filter.mutates_input and not is_copied:
+                current_data = current_data.copy()
+                is_copied = True
+                copies = 1
+
             self._results[filter] = dict()
             current_data, changes = filter.apply(
                 data=current_data, parameters=parameters[filter_name]
             )
+            if dtype_policy not in [None, "default"]:
+                current_data = apply_dtype_policy(
+                    data=current_data, dtype_policy=dtype_policy
+                )
+
+            wall_time = time.perf_counter() - start
+
+            self._chunk_stats.append(
+                dict(
+                    filter=filter_name,
+                    wall_time=wall_time,
+                    rows_in=rows_in,
+                    rows_out=len(current_data),
+                    bytes_allocated=int(
+                        sum(
+                            values.nbytes
+                            for key, values in _base_arrays(data=current_data).items()
+                            if key not in arrays_before_filter
+                        )
+                    ),
+                    copies=copies,
+                )
+            )
             self._results[filter]["data"] = current_data
             self._results[filter]["changes"] = changes
 
@@ -450,33 +1005,15 @@ class DataFilterPipeline(object):
             list(np.unique(list(on_raw_data_chunk.columns) + all_added_columns))
         )
 
-        # now what data remains?
-        # first get the indices
-        data_post_pipeline = initial_data.iloc[current_data.index, :]
-        # now update the data in the columns
-
-        # update the initial data to the "data post pipeline" values:
-        for col in initial_columns + all_added_columns:
-            data_post_pipeline[col] = current_data[col]
-
-        # sort, drop duplicates, and reset index:
-        logger.debug(
-            "Dropping duplicate data "
-            "points - currently we have "
-            "{} pts.".format(len(data_post_pipeline))
-        )
-
-        # TODO(JTK): these should be filters too (sorting etc.)
-        if not is_sorted:
-            data_post_pipeline.sort_values(
-                by=["Date-Time"], ascending=True, inplace=True
+        if self._count_copies:
+            bytes_copied = {
+                stats["filter"]: stats["bytes_allocated"] for stats in self._chunk_stats
+            }
+            self._bytes_copied.append(bytes_copied)
+            logger.debug(
+                f"Bytes copied in this chunk: {sum(bytes_copied.values())} "
+                f"({bytes_copied})."
             )
-        data_post_pipeline.drop_duplicates(subset=["Date-Time"], inplace=True)
-
-        logger.debug(
-            "After dropping duplicates we have "
-            "{} pts.".format(len(data_post_pipeline))
-        )
 
         if debug:
             plt.close()
@@ -484,8 +1021,10 @@ class DataFilterPipeline(object):
         return current_data
 
     def describe(self):
-        """List this pipeline with its filters and associated parameter values."""
+        """List this pipeline with its filters and associated parameter values
+        (and, after a run, what each filter cost in it - see "run_stats")."""
         structure = dict()  # pipeline structure
+        stats = self._run_stats.by_filter() if self._run_stats is not None else {}
 
         for filter_ix, (filter_name, filter) in enumerate(self._pipeline.items()):
 
@@ -495,6 +1034,8 @@ class DataFilterPipeline(object):
             structure[key]["parameters"] = filter.get_parameters()
             structure[key]["user_defined_name"] = filter_name
             structure[key]["position"] = filter_ix  # position in the pipeline
+            if filter_name in stats:
+                structure[key]["stats"] = stats[filter_name]
 
         return structure
 
@@ -522,3 +1063,239 @@ class DataFilterPipeline(object):
     def get_parameters(self, name=None):
         """Return the parameters of a filter in the data pipeline."""
         return self._pipeline[name].get_parameters()
+
+
+def _init_chunk_worker(pipeline=None):
+    """Give this worker its own copy of the pipeline (filters keep the data
+    they are applied to, so they cannot be shared between threads)."""
+    _worker.pipeline = deepcopy(pipeline)
+
+
+def _run_chunk_in_worker(on_raw_data_chunk=None, **kwargs):
+    """Run the pipeline of this worker on a chunk; return the transformed
+    chunk, the filter results (by filter name) and the filter stats."""
+    pipeline = _worker.pipeline
+    transformed_data_chunk = pipeline._run_chunk(
+        on_raw_data_chunk=on_raw_data_chunk, parameters=dict(), **kwargs
+    )
+    results = {
+        filter_name: pipeline._results[filter]
+        for filter_name, filter in pipeline._pipeline.items()
+        if filter in pipeline._results
+    }
+    return transformed_data_chunk, results, pipeline._chunk_stats
+
+
+class _SharedPrefix(object):
+    """Leading filters of a pipeline applied to all of the data at once:
+    those several pipelines start with (see "run_many") - applied the first
+    time a pipeline asks for them - or its pointwise filters (see "run")."""
+
+    _pipeline = None
+    _transformed = None
+
+    def __init__(self, filters=None):
+        self._pipeline = DataFilterPipeline(verify_pipeline=False)
+        for name, filter in filters.items():
+            self._pipeline.add_filter(name=name, filter=filter)
+        self._transformed = dict()
+
+    @property
+    def number_of_filters(self):
+        return len(self._pipeline._pipeline)
+
+    @property
+    def results(self):
+        """The results of the filters (see "get_result")."""
+        return [
+            self._pipeline._results[filter]
+            for filter in self._pipeline._pipeline.values()
+        ]
+
+    def apply(
+        self, data=None, data_format_code=None, dtype_policy="default", stats=None
+    ):
+        """Return "data" with the filters applied (once per dtype policy;
+        the data is the same for all pipelines).
+
+        :param stats: "PipelineRunStats" to record the cost in (if the
+        filters are applied now).
+        """
+        if dtype_policy not in self._transformed:
+            self._transformed[dtype_policy] = self._pipeline._run_chunk(
+                on_raw_data_chunk=data.copy(deep=False),
+                parameters=dict(),
+                data_format_code=data_format_code,
+                dtype_policy=dtype_policy,
+            )
+            if stats is not None:
+                stats.add_chunk(
+                    filters=self._pipeline._chunk_stats, applied_to_all=True
+                )
+        return self._transformed[dtype_policy]
+
+
+class _ChunkMemo(object):
+    """Transformed chunks kept in the pipestore under the hash of the raw
+    chunk and of the filters that transform it (see "run" with
+    "memoize_chunks").
+
+    The filters are hashed by class and parameters, and by the code they
+    run (see "_code_fingerprint"): chunks stored by another version of the
+    code are not reused. Failing to read or store a chunk only costs the
+    time to transform it.
+    """
+
+    _pipestore = None
+    _filters_hash = None
+    hits = None
+    misses = None
+
+    def __init__(
+        self,
+        pipeline=None,
+        first_filter=0,
+        data_format_code=None,
+        dtype_policy="default",
+        pipestore=None,
+    ):
+        """
+        :param pipeline: the pipeline whose filters transform the chunks.
+        :param first_filter: the filters before this one are not run on the
+        chunks (they were applied to all of the data).
+        :param pipestore: where to keep the chunks (default: "Pipestore()").
+        """
+        self._pipestore = pipestore if pipestore is not None else Pipestore()
+        self.hits = 0
+        self.misses = 0
+
+        # the filters the chunks go through (in order):
+        filters = []
+        for filter in list(pipeline._pipeline.values())[first_filter:]:
+            parameters = {
+                k: v
+                for k, v in filter.get_parameters().items()
+                if k != "data_format_code"
+            }
+            filters.append([filter.__class__.__name__, parameters])
+
+        code = _code_fingerprint(
+            modules=tuple(
+                sorted(
+                    {
+                        cls.__module__
+                        for filter in pipeline._pipeline.values()
+                        for cls in type(filter).__mro__
+                    }
+                )
+            )
+        )
+
+        self._filters_hash = hashlib.sha256()
+        self._filters_hash.update(
+            json.dumps(
+                [filters, data_format_code, dtype_policy, code],
+                sort_keys=True,
+                default=str,
+            ).encode()
+        )
+
+    @classmethod
+    def create(cls, **kwargs):
+        """A memo, or None (with a warning) if there is no pipestore."""
+        try:
+            return cls(**kwargs)
+        except Exception as e:
+            logger.warning(f"Not memoizing the chunks ('{e}').")
+            return None
+
+    def key(self, chunk=None):
+        """The hash of a raw chunk of data going through the filters."""
+        _hash = self._filters_hash.copy()
+        # (the filters see the chunk with a fresh index)
+        _hash.update(pd.util.hash_pandas_object(chunk, index=False).values)
+        _hash.update(json.dumps([str(c) for c in chunk.columns]).encode())
+        return _hash.hexdigest()
+
+    def get(self, key=None):
+        """The transformed chunk under "key", or None."""
+        try:
+            data = self._pipestore.get_chunk(hash=key)
+            if data is not None:
+                data = decompress_bytes(data=data)
+                data = pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+        except Exception as e:
+            logger.warning(f"Could not read memoized chunk {key} ('{e}').")
+            data = None
+
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, key=None, data=None):
+        """Store the transformed chunk "data" under "key"."""
+        try:
+            table = pa.Table.from_pandas(data, preserve_index=True)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            data = compress_bytes(data=sink.getvalue(), compression="zstd")
+            self._pipestore.upload_chunk(hash=key, data=data, background=True)
+        except Exception as e:
+            logger.warning(f"Could not memoize chunk {key} ('{e}').")
+
+
+@functools.lru_cache(maxsize=None)
+def _code_fingerprint(modules=()):
+    """Hash of the source files of the "ergo_analytics" package and of the
+    modules "modules" (those outside of it) - which changes with any change
+    to the code the filters run. Raises if a source file cannot be read."""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+
+    paths = []
+    for folder, folders, files in os.walk(package_dir):
+        folders[:] = sorted(f for f in folders if f != "__pycache__")
+        paths += [os.path.join(folder, f) for f in sorted(files) if f.endswith(".py")]
+    for name in modules:
+        path = getattr(sys.modules.get(name), "__file__", None)
+        if path is not None and not os.path.abspath(path).startswith(package_dir):
+            # (e.g. filters defined elsewhere)
+            paths.append(path)
+
+    _hash = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as fd:
+            _hash.update(os.path.relpath(path, package_dir).encode())
+            _hash.update(fd.read())
+
+    return _hash.hexdigest()
+
+
+def _same_parameters(parameters=None, other_parameters=None):
+    """Do two filters have the same parameters (whatever the data format
+    code they were last run with)?"""
+    parameters = {k: v for k, v in parameters.items() if k != "data_format_code"}
+    other_parameters = {
+        k: v for k, v in other_parameters.items() if k != "data_format_code"
+    }
+    try:
+        return bool(parameters == other_parameters)
+    except (TypeError, ValueError):
+        # (e.g. arrays as parameters)
+        return False
+
+
+def _base_arrays(data=None):
+    """The numpy arrays holding the columns of "data" (by id) - to tell
+    which columns share memory."""
+    arrays = dict()
+    for col in data:
+        values = getattr(data[col].array, "_ndarray", None)
+        if values is None:
+            values = data[col].to_numpy()
+        while isinstance(values.base, np.ndarray):
+            values = values.base
+        arrays[id(values)] = values
+    return arrays
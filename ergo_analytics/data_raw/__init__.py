@@ -16,9 +16,13 @@ Copyright 2018
 __author__ = "Jesper Kristensen"
 __version__ = "Alpha"
 
+from .ring_buffer import *
 from .base_data import *
+from .raw_data_cache import *
 from .arduino_data import *
 from .load_flat_file import *
+from .load_memmap import *
+from .stream_producers import *
 from .load_google_drive import *
 from .load_aws_s3 import *
 from .load_elastic_search import *
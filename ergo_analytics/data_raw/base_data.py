@@ -20,9 +20,26 @@ import numpy as np
 import pandas as pd
 from constants import *
 from constants import DATA_FORMAT_CODES
+from constants import DATE
+from ergo_analytics.utilities import DTYPE_POLICIES
+from ergo_analytics.data_raw.ring_buffer import RingBuffer
 import logging
 
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
 logger = logging.getLogger()
+
+# formats of the timestamps written by the wearables (tried when pandas
+# cannot guess the format itself):
+DEVICE_TIMESTAMP_FORMATS = [
+    "%m/%d/%y %H:%M:%S.%f",
+    "%m/%d/%y %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S.%f",
+    "%m/%d/%Y %H:%M:%S",
+]
 try:
     with open("settings.yml", "r") as fd:
         config = yaml.load(fd, yaml.SafeLoader)
@@ -36,6 +53,11 @@ class BaseData(object):
     _data_column_names = None  # name of columns in the data
     _number_of_points = None
     _data_format_code = None
+    _quarantined_data = None  # raw rows that could not be decoded
+    _dtype_policy = "default"  # see "DTYPE_POLICIES"
+    _casting_plans = dict()  # data format code -> how to cast its columns
+    _timestamp_formats = dict()  # data format code -> format of its timestamps
+    _stream = None  # ring buffer of live samples (see "open_stream")
 
     def __init__(self):
         pass
@@ -48,10 +70,109 @@ class BaseData(object):
     def data_column_names(self):
         return self._data_column_names
 
+    @property
+    def dtype_policy(self):
+        """How the data is stored: "default" (float64 angles) or "compact"
+        (float32 angles)."""
+        return self._dtype_policy
+
+    @dtype_policy.setter
+    def dtype_policy(self, dtype_policy=None):
+        if dtype_policy not in DTYPE_POLICIES:
+            msg = (
+                f"Unknown dtype policy '{dtype_policy}'! "
+                f"Valid options: {list(DTYPE_POLICIES)}"
+            )
+            logger.error(msg)
+            raise Exception(msg)
+        self._dtype_policy = dtype_policy
+
     @property
     def number_of_points(self):
         return self._number_of_points
 
+    @property
+    def quarantined_data(self):
+        """Raw rows set aside during the most recent decode."""
+        return self._quarantined_data
+
+    @property
+    def number_of_quarantined_points(self):
+        if self._quarantined_data is None:
+            return 0
+        return len(self._quarantined_data)
+
+    @property
+    def stream(self):
+        """The ring buffer of live samples (None until "open_stream")."""
+        return self._stream
+
+    def open_stream(self, data_format_code=None, capacity=10 * 60 * 60):
+        """
+        Start taking in live samples of "data_format_code": producers (see
+        "ReplayProducer" and "SerialProducer") "push" samples into a ring
+        buffer of the latest "capacity" samples, consumers take views of
+        them with "latest".
+
+        :param data_format_code: the format of the samples.
+        :param capacity: how many samples to hold (default: one hour at 10
+        Hz).
+        :return: the ring buffer.
+        """
+        data_format_code = str(data_format_code).strip()
+        if data_format_code not in DATA_FORMAT_CODES:
+            msg = f"Unknown data format code '{data_format_code}'!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        plan = self._casting_plan(data_format_code, dtype_policy=self._dtype_policy)
+        if len(plan["time_columns"]) != 1:
+            msg = f"Cannot stream data of format {data_format_code}!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        self._stream = RingBuffer(
+            capacity=capacity,
+            columns=list(plan["dtypes"]),
+            time_column=plan["time_columns"][0],
+            dtype=DTYPE_POLICIES[self._dtype_policy],
+        )
+        self._data_format_code = data_format_code
+        self._data_column_names = self._stream.columns
+        self._number_of_points = 0
+
+        return self._stream
+
+    def push(self, timestamps=None, values=None):
+        """
+        Add live samples to the stream (see "RingBuffer.push").
+
+        :param timestamps: the time of each sample.
+        :param values: array-like of shape (samples, numeric columns).
+        """
+        if self._stream is None:
+            msg = "Please open the stream first!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        self._stream.push(timestamps=timestamps, values=values)
+        self._number_of_points = self._stream.number_of_points
+
+    def latest(self, seconds=None, number_of_points=None):
+        """
+        Return the latest live samples as a pd.DataFrame viewing the ring
+        buffer (no copy; see "RingBuffer.latest").
+
+        :param seconds: the samples of the last "seconds"...
+        :param number_of_points: ...or the last "number_of_points" samples.
+        """
+        if self._stream is None:
+            msg = "Please open the stream first!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        return self._stream.latest(seconds=seconds, number_of_points=number_of_points)
+
     @staticmethod
     def _find_data_format_code(path=None):
         """Find correct data format codes to load data from path."""
@@ -76,10 +197,124 @@ class BaseData(object):
 
         return dfc
 
+    @classmethod
+    def _casting_plan(cls, data_format_code=None, dtype_policy="default"):
+        """
+        Compile (once per data format code and dtype policy) how to cast data
+        of that format: the columns in order, the timestamp columns and the
+        dtype of each numeric column.
+        """
+        data_format_code = str(data_format_code).strip()
+        key = (data_format_code, dtype_policy)
+        if key not in cls._casting_plans:
+            names = DATA_FORMAT_CODES[data_format_code]["NAMES"]
+            types = DATA_FORMAT_CODES[data_format_code]["TYPES"]
+
+            time_columns = []
+            dtypes = dict()
+            for name, _type in zip(names, types):
+                if _type is DATE:
+                    time_columns.append(name)
+                elif _type is int:
+                    dtypes[name] = np.int64
+                else:
+                    dtypes[name] = DTYPE_POLICIES[dtype_policy]
+
+            cls._casting_plans[key] = dict(
+                columns=[name for name, _ in zip(names, types)],
+                time_columns=time_columns,
+                dtypes=dtypes,
+            )
+
+        return cls._casting_plans[key]
+
+    @classmethod
+    def _parse_timestamps(cls, timestamps=None, data_format_code=None, errors="raise"):
+        """
+        Parse a column of timestamps coming from the device in one pass.
+
+        The "RTC:" some devices prepend is stripped and the timestamp format
+        found for "data_format_code" is remembered, so only the first batch
+        of a format pays for finding it.
+
+        :param timestamps: pd.Series of timestamps (strings or times).
+        :param data_format_code: the format of the data the timestamps are in.
+        :param errors: as in "pd.to_datetime".
+        :return: pd.Series of datetimes.
+        """
+        if not (
+            pd.api.types.is_object_dtype(timestamps)
+            or pd.api.types.is_string_dtype(timestamps)
+        ):
+            return pd.to_datetime(timestamps, errors=errors)
+
+        timestamps = timestamps.astype(str).str.strip()
+        if timestamps.str.startswith("RTC:").any():
+            # some data includes the "RTC:" prepended:
+            timestamps = timestamps.str.replace(r"^RTC:\s*", "", regex=True)
+
+        key = None if data_format_code is None else str(data_format_code).strip()
+        if key not in cls._timestamp_formats:
+            cls._timestamp_formats[key] = cls._find_timestamp_format(timestamps)
+        timestamp_format = cls._timestamp_formats[key]
+
+        if timestamp_format is None:
+            return pd.to_datetime(timestamps, errors=errors)
+
+        dates = pd.to_datetime(timestamps, format=timestamp_format, errors="coerce")
+        is_unparsed = dates.isna() & timestamps.notna()
+        if is_unparsed.all() and len(timestamps) > 0:
+            # not (or no longer) the format of this data:
+            logger.debug(
+                f"Timestamps are not in the format '{timestamp_format}' "
+                f"found for data format code {key}; inferring it again."
+            )
+            cls._timestamp_formats.pop(key, None)
+            return pd.to_datetime(timestamps, errors=errors)
+
+        if is_unparsed.any():
+            # odd rows out are left to pandas (which raises or coerces):
+            dates[is_unparsed] = pd.to_datetime(timestamps[is_unparsed], errors=errors)
+
+        return dates
+
+    @staticmethod
+    def _find_timestamp_format(timestamps=None, sample_size=100):
+        """
+        Return the format of the (stripped) timestamp strings or None to let
+        pandas infer it (ISO 8601 timestamps are parsed fastest that way).
+        """
+        sample = timestamps.dropna()
+        sample = sample[sample != ""].iloc[:sample_size]
+        if len(sample) == 0 or sample.str.match(r"\d{4}-\d{2}-\d{2}").all():
+            return None
+
+        try:
+            expected = pd.to_datetime(sample)
+        except (ValueError, TypeError):
+            return None
+
+        candidates = [guess_datetime_format(sample.iloc[0])] + DEVICE_TIMESTAMP_FORMATS
+        for candidate in candidates:
+            if candidate is None:
+                continue
+            try:
+                parsed = pd.to_datetime(sample, format=candidate)
+            except (ValueError, TypeError):
+                continue
+            if parsed.equals(expected):
+                return candidate
+
+        return None
+
     def _cast_to_correct_types(self, all_data=None, data_format_code=None):
         """
         Makes sure the data is in the format expected from its streaming type.
 
+        The numeric columns are cast with a single "astype" and the
+        timestamps are parsed in one pass (see "_casting_plan" and
+        "_parse_timestamps").
+
         :param all_data: pd.DataFrame containing data.
         :param data_format_code: what is the streaming type of data?
         :return:
@@ -90,20 +325,202 @@ class BaseData(object):
             raise Exception(msg)
 
         # now convert data based on the types we know:
-        data_column_names = DATA_FORMAT_CODES[data_format_code]["NAMES"]
-        data_column_types = DATA_FORMAT_CODES[data_format_code]["TYPES"]
-
-        conv = dict(zip(data_column_names, data_column_types))
-        all_data = all_data.apply(conv)
+        plan = self._casting_plan(data_format_code, dtype_policy=self._dtype_policy)
+
+        numerics = all_data[list(plan["dtypes"])].astype(plan["dtypes"])
+        columns = dict()
+        for name in plan["columns"]:
+            if name in plan["time_columns"]:
+                columns[name] = self._parse_timestamps(
+                    all_data[name], data_format_code=data_format_code
+                )
+            else:
+                columns[name] = numerics[name]
 
         # make sure index is ints (can convert to "float64" if there are
-        # some NaNs here and there):
-        all_data.index = list(map(int, all_data.index))
+        # some NaNs here and there) - and a RangeIndex when it is contiguous:
+        index = all_data.index
+        if not isinstance(index, pd.RangeIndex):
+            index = pd.Index(index.astype(np.int64))
+            if len(index) > 0 and (np.diff(index.values) == 1).all():
+                index = pd.RangeIndex(index[0], index[0] + len(index))
+
+        all_data = pd.DataFrame(columns)
+        all_data.index = index
 
         self._number_of_points = len(all_data)
 
         return all_data
 
+    @staticmethod
+    def _find_data_format_code_from_width(width=None):
+        """Return the data format code whose columns match the given width."""
+        for code in DATA_FORMAT_CODES:
+            if len(DATA_FORMAT_CODES[code]["NAMES"]) == width:
+                return code
+        return None
+
+    def _decode_values(self, values=None, timestamps=None, data_format_code=None):
+        """
+        Decodes raw comma-separated values coming from the wearable into
+        typed columns in one vectorized pass over all rows: one split,
+        one float conversion and one timestamp parse.
+
+        Rows that do not match the data format (wrong number of fields,
+        non-numeric values or unreadable timestamps) are quarantined (see
+        "quarantined_data") instead of failing the whole batch.
+
+        :param values: sequence of raw strings, e.g. "yaw1,pitch1,roll1,...".
+        :param timestamps: optional sequence of timestamps, one per value,
+        which becomes the "Date-Time" column. If None, the timestamp is
+        expected to be the first field of each value.
+        :param data_format_code: which format is the data in? If None (or if
+        no rows match it) the format is found from the number of fields.
+        :return: typed pd.DataFrame or None if no rows could be decoded.
+        """
+        values = pd.Series(values, dtype=object).astype(str)
+        values = values.str.rstrip("\r\n")
+
+        if timestamps is not None:
+            timestamps = pd.Series(timestamps, dtype=object).astype(str)
+            values = timestamps.str.cat(values, sep=",")
+
+        values.reset_index(drop=True, inplace=True)
+        self._quarantined_data = values.iloc[:0]
+
+        if len(values) == 0:
+            return None
+
+        widths = values.str.count(",") + 1
+
+        if data_format_code is not None:
+            data_format_code = str(data_format_code).strip()
+            width = len(DATA_FORMAT_CODES[data_format_code]["NAMES"])
+            if not (widths == width).any():
+                logger.warning(
+                    f"No rows match data format code {data_format_code}; "
+                    f"trying to find the data format code now!"
+                )
+                data_format_code = None
+
+        if data_format_code is None:
+            # the most common width decides the format:
+            for width in widths.value_counts().index:
+                data_format_code = self._find_data_format_code_from_width(width)
+                if data_format_code is not None:
+                    break
+
+            if data_format_code is None:
+                msg = "Please provide the correct Data Format Code!"
+                logger.warning(msg)
+                self._quarantined_data = values
+                return None
+
+            logger.info(f"Found the data format code to be: {data_format_code}")
+
+        names = DATA_FORMAT_CODES[data_format_code]["NAMES"]
+        types = DATA_FORMAT_CODES[data_format_code]["TYPES"]
+        time_column = names[0]
+        numeric_columns = names[1:]
+
+        is_good = (widths == len(names)).values
+
+        fields = values[is_good].str.split(",", expand=True)
+        fields.columns = names
+
+        raw_numerics = fields[numeric_columns].to_numpy()
+        try:
+            numerics = raw_numerics.astype(np.float64)
+        except ValueError:
+            # some rows are corrupt - coerce and quarantine those rows:
+            numerics = (
+                fields[numeric_columns]
+                .apply(pd.to_numeric, errors="coerce")
+                .to_numpy(dtype=np.float64)
+            )
+            is_literal_nan = (
+                fields[numeric_columns].apply(lambda col: col.str.strip().str.lower())
+                == "nan"
+            ).to_numpy()
+            is_corrupt = (np.isnan(numerics) & ~is_literal_nan).any(axis=1)
+            is_good[np.flatnonzero(is_good)[is_corrupt]] = False
+            numerics = numerics[~is_corrupt]
+            fields = fields[~is_corrupt]
+
+        dates = self._parse_timestamps(
+            fields[time_column], data_format_code=data_format_code, errors="coerce"
+        )
+        is_bad_date = dates.isna().values
+        if is_bad_date.any():
+            is_good[np.flatnonzero(is_good)[is_bad_date]] = False
+            numerics = numerics[~is_bad_date]
+            dates = dates[~is_bad_date]
+
+        self._quarantined_data = values[~is_good]
+        if len(self._quarantined_data) > 0:
+            logger.warning(
+                f"Quarantined {len(self._quarantined_data)} of {len(values)} "
+                f"rows not matching data format code {data_format_code}."
+            )
+
+        if len(dates) == 0:
+            return None
+
+        data = pd.DataFrame(
+            numerics.astype(DTYPE_POLICIES[self._dtype_policy], copy=False),
+            columns=numeric_columns,
+        )
+        for name, _type in zip(numeric_columns, types[1:]):
+            if _type is int:
+                data[name] = data[name].astype(np.int64)
+        data.insert(0, time_column, dates.array)
+
+        self._data_format_code = data_format_code
+        self._data_column_names = names
+        self._number_of_points = len(data)
+
+        return data
+
+    def _retrieve_from_cache(
+        self,
+        cache=None,
+        mac_address=None,
+        start_time=None,
+        end_time=None,
+        limit=None,
+        fetch=None,
+    ):
+        """
+        Retrieve data through a "RawDataCache" so only the time ranges missing
+        from it are fetched.
+
+        :param fetch: function (start_time, end_time) -> decoded pd.DataFrame
+        or None; typically the loader's own "retrieve_data".
+        """
+
+        def fetch_with_format(start_time, end_time):
+            data = fetch(start_time=start_time, end_time=end_time)
+            return data, self._data_format_code
+
+        data, data_format_code = cache.retrieve(
+            mac_address=mac_address,
+            start_time=start_time,
+            end_time=end_time,
+            fetch=fetch_with_format,
+        )
+
+        if data is None:
+            return None
+
+        if limit is not None:
+            data = data.iloc[:limit]
+
+        self._data_format_code = data_format_code
+        self._data_column_names = list(data.columns)
+        self._number_of_points = len(data)
+
+        return data
+
     def retrieve_any_macaddress_with_data(
         self,
         at_least_this_much_data_in_total=50,
@@ -173,37 +590,15 @@ class BaseData(object):
                 conn,
             )
 
-        format_code_found = False
-        names = None  # will be set first iteration
-        the_code = None
-        all_data = []
-        for row in df.itertuples():
-            this_data = np.r_[
-                pd.to_datetime(row.wearable_timestamp), row.value.split(",")
-            ]
-
-            if not format_code_found:
-                the_code = None
-                for code in DATA_FORMAT_CODES:
-                    names = DATA_FORMAT_CODES[code]["NAMES"]
-                    if len(names) == len(this_data):
-                        the_code = code
-                        break
-                if the_code is None:
-                    raise Exception("Data is in unknown format!")
-                format_code_found = True
-
-            this_df = pd.DataFrame(data=[this_data], columns=names)
-            all_data.append(this_df)
+        # decode all rows at once (the data format code is found from the
+        # number of fields):
+        raw_data = self._decode_values(
+            values=df["value"], timestamps=df["wearable_timestamp"]
+        )
+        if raw_data is None:
+            raise Exception("Data is in unknown format!")
 
         this_mac = df.iloc[0].device
-        raw_data = pd.concat(all_data)
-
-        self._data_format_code = the_code
-
-        raw_data = self._cast_to_correct_types(
-            all_data=raw_data, data_format_code=self._data_format_code
-        )
 
         raw_data.sort_values("Date-Time", inplace=True)
 
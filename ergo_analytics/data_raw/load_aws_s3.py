@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 """
+Loads wearable data from the Parquet backup of the Elastic Search database.
+The data is stored in hourly partitions ("year/month/day/hour" prefixes) and
+read with pyarrow datasets from any fsspec filesystem (S3 by default).
 
 @ author Jesper Kristensen
 Copyright IterateLabs.co 2018-
@@ -13,49 +16,84 @@ import logging
 import datetime
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 import s3fs
 from ergo_analytics.data_raw import BaseData
 
 logger = logging.getLogger()
 
-fs = s3fs.S3FileSystem(
-    anon=False,
-    key=os.getenv("BSAFE_AWS_ACCESS_KEY", os.getenv("AWS_ACCESS_KEY")),
-    secret=os.environ.get("BSAFE_AWS_SECRET_KEY", os.environ.get("AWS_SECRET_KEY")),
-)
-
 
 class LoadS3(BaseData):
     """
     Load data from S3.
+
+    Only the hourly partitions overlapping the requested time window are
+    listed, only the needed columns are read and the device and time filters
+    are pushed down into the scan of the Parquet row groups.
     """
 
-    def __init__(self):
+    _filesystem = None
+    _root = None
+
+    def __init__(self, root="cassia-data-parquet", filesystem=None):
         """
         Construct the data loader.
+
+        :param root: where the partitions are: the bucket (and prefix) on S3
+        or a folder on the "filesystem".
+        :param filesystem: any fsspec filesystem; if None we connect to S3.
         """
         super().__init__()
 
-        logger.info("Data loading with Elastic Search object created!")
+        if filesystem is None:
+            filesystem = s3fs.S3FileSystem(
+                anon=False,
+                key=os.getenv("BSAFE_AWS_ACCESS_KEY", os.getenv("AWS_ACCESS_KEY")),
+                secret=os.getenv("BSAFE_AWS_SECRET_KEY", os.getenv("AWS_SECRET_KEY")),
+            )
+
+        self._filesystem = filesystem
+        self._root = root.rstrip("/")
+
+        logger.info("Data loading with S3 object created!")
 
     def return_folder_given_time(self, timestamp=None):
         """Given timestamp, return folder prefix on S3."""
-        # get year:
-        year = timestamp.strftime("%Y")
+        return "{}/{}".format(self._root, timestamp.strftime("%Y/%m/%d/%H"))
 
-        # get month:
-        month = timestamp.strftime("%m")
+    def return_files_given_time(
+        self, start_time=None, end_time=None, partition_slack_hours=1
+    ):
+        """
+        Return the Parquet files in the hourly partitions overlapping the
+        time window. The partitions are by when the data arrived in the
+        backup so we also look "partition_slack_hours" to either side.
+        """
+        start_time = _as_utc(start_time).floor("H")
+        end_time = _as_utc(end_time).floor("H")
+        slack = datetime.timedelta(hours=partition_slack_hours)
 
-        # get day:
-        day = timestamp.strftime("%d")
+        files = []
+        for hour in pd.date_range(start_time - slack, end_time + slack, freq="H"):
+            folder = self.return_folder_given_time(timestamp=hour)
+            if self._filesystem.exists(folder):
+                files.extend(sorted(self._filesystem.glob(folder + "/*.parquet")))
 
-        # get hour:
-        hour = timestamp.strftime("%H")
+        logger.debug(f"Found {len(files)} files for the time window.")
 
-        return "cassia-data/es-backup{}/{}/{}/{}".format(year, month, day, hour)
+        return files
 
     def retrieve_data(
-        self, mac_address=None, start_time=None, end_time=None, limit=None,
+        self,
+        mac_address=None,
+        start_time=None,
+        end_time=None,
+        limit=None,
+        data_format_code=None,
+        time_column="received_timestamp",
+        partition_slack_hours=1,
+        cache=None,
     ):
         """Retrieve wearable data from S3.
 
@@ -63,7 +101,13 @@ class LoadS3(BaseData):
         :param start_time:
         :param end_time:
         :param limit: should the number of returned data points be ceiled at limit?
-        :return:
+        :param data_format_code: Which data format code are we using? If None
+        it is found from the data.
+        :param time_column: the column holding the time of each data point.
+        :param partition_slack_hours: see "return_files_given_time".
+        :param cache: optional "RawDataCache"; only the time ranges missing
+        from the cache are then read from S3.
+        :return: pd.DataFrame or None if no data was found.
         """
 
         if not start_time or not end_time:
@@ -71,63 +115,135 @@ class LoadS3(BaseData):
                 "Please provide both the start_time and the end_time parameters!"
             )
 
-        prev_hour = starttime - datetime.timedelta(hours=1)
-        next_hour = starttime + datetime.timedelta(hours=1)
-
-        # get current time +/- 1 hour:
-        prev_folder = self.return_folder_given_time(timestamp=prev_hour)
-        curr_folder = self.return_folder_given_time(timestamp=starttime)
-        next_folder = self.return_folder_given_time(timestamp=next_hour)
+        if cache is not None:
+            return self._retrieve_from_cache(
+                cache=cache,
+                mac_address=mac_address,
+                start_time=start_time,
+                end_time=end_time,
+                limit=limit,
+                fetch=lambda start_time=None, end_time=None: self.retrieve_data(
+                    mac_address=mac_address,
+                    start_time=start_time,
+                    end_time=end_time,
+                    data_format_code=data_format_code,
+                    time_column=time_column,
+                    partition_slack_hours=partition_slack_hours,
+                ),
+            )
 
-        # So only read files from those three prefixes
-        # Then use pyarrow to get all that data:
-        """
-        # Read in user specified partitions of a partitioned parquet file
+        files = self.return_files_given_time(
+            start_time=start_time,
+            end_time=end_time,
+            partition_slack_hours=partition_slack_hours,
+        )
+        if len(files) == 0:
+            logger.info("No files found for device {}".format(mac_address))
+            return None
 
-        import s3fs
-        import pyarrow.parquet as pq
-        s3 = s3fs.S3FileSystem()
+        dataset = ds.dataset(files, format="parquet", filesystem=self._filesystem)
 
-        keys = ['keyname/blah_blah/part-00000-cc2c2113-3985-46ac-9b50-987e9463390e-c000.snappy.parquet'\
-                 ,'keyname/blah_blah/part-00001-cc2c2113-3985-46ac-9b50-987e9463390e-c000.snappy.parquet'\
-                 ,'keyname/blah_blah/part-00002-cc2c2113-3985-46ac-9b50-987e9463390e-c000.snappy.parquet'\
-                 ,'keyname/blah_blah/part-00003-cc2c2113-3985-46ac-9b50-987e9463390e-c000.snappy.parquet']
+        is_in_window = self._time_filter(
+            field_type=dataset.schema.field(time_column).type,
+            time_column=time_column,
+            start_time=start_time,
+            end_time=end_time,
+        )
+        table = dataset.to_table(
+            columns=[time_column, "value"],
+            filter=(ds.field("device") == mac_address) & is_in_window,
+        )
 
-        bucket = 'bucket_yada_yada_yada'
+        if table.num_rows == 0:
+            logger.info("No documents found for device {}".format(mac_address))
+            return None
 
-        # Add s3 prefix and bucket name to all keys in list
-        parq_list=[]
-        for key in keys:
-            parq_list.append('s3://'+bucket+'/'+key)
+        table = table.sort_by(time_column)
 
-        # Create your dataframe
-        df = pq.ParquetDataset(parq_list, filesystem=s3).read_pandas(columns=['Var1','Var2','Var3']).to_pandas()
-"""
+        logger.info(
+            "{} documents found for device {}.".format(table.num_rows, mac_address)
+        )
 
-        # narrow in: find the files of interest now
-        # do a lookup function that takes in the exact time to the minute
-        # and returns the file for that +/- 15 min (which may include looking in next/prev folders).
-        # We could combine all files together in one list, then just extract the minute marker
-        # then bisect on that (since we will have the full file paths its fine to combine)
-        files = self.return_files_given_time(
-            prev_folder=prev_folder,
-            curr_folder=curr_folder,
-            next_folder=next_folder,
-            start_time=start_time,
-            end_time=end_time,
+        # times are in UTC (like in Elastic Search):
+        timestamps = table.column(time_column)
+        if pa.types.is_integer(timestamps.type):
+            timestamps = timestamps.cast(pa.timestamp("ms", tz="UTC"))
+        elif pa.types.is_timestamp(timestamps.type) and timestamps.type.tz is None:
+            timestamps = timestamps.cast(pa.timestamp(timestamps.type.unit, tz="UTC"))
+        timestamps = timestamps.to_pandas().astype(str)
+
+        data = self._decode_values(
+            values=table.column("value").to_pandas(),
+            timestamps=timestamps,
+            data_format_code=data_format_code,
         )
+        if data is None:
+            return None
+
+        # the pushed down filter can be coarser than the window (for times
+        # stored as strings) so now cut the data to the exact window:
+        times = data["Date-Time"]
+        start_time, end_time = _as_utc(start_time), _as_utc(end_time)
+        if times.dt.tz is None:
+            start_time = start_time.tz_localize(None)
+            end_time = end_time.tz_localize(None)
+        data = data[(times >= start_time) & (times <= end_time)]
 
-        # finally, extract content from files:
+        if limit is not None:
+            data = data.iloc[:limit]
 
-        import pdb
+        data = data.reset_index(drop=True)
+        self._number_of_points = len(data)
 
-        pdb.set_trace()
+        return data if len(data) > 0 else None
+
+    @staticmethod
+    def _time_filter(field_type=None, time_column=None, start_time=None, end_time=None):
+        """
+        The "start_time" <= time <= "end_time" filter expression in the type of
+        the time column: timestamps, epoch milliseconds or ISO-8601 UTC
+        strings (compared as text, to the whole second). Strings may separate
+        the date and the time by "T" or by a space (which sorts before "T")
+        so we match either.
+        """
+        start_time = _as_utc(start_time)
+        end_time = _as_utc(end_time)
+
+        if pa.types.is_timestamp(field_type):
+            if field_type.tz is None:
+                start_time = start_time.tz_localize(None)
+                end_time = end_time.tz_localize(None)
+            start = pa.scalar(start_time, type=field_type)
+            end = pa.scalar(end_time, type=field_type)
+        elif pa.types.is_integer(field_type):
+            start = start_time.value // 1_000_000
+            end = end_time.value // 1_000_000
+        else:
+            # whole seconds: "~" sorts after any fraction or time zone
+            time = ds.field(time_column)
+            is_in_window = [
+                (time >= start_time.strftime(time_format))
+                & (time <= end_time.strftime(time_format) + "~")
+                for time_format in ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"]
+            ]
+            return is_in_window[0] | is_in_window[1]
+
+        return (ds.field(time_column) >= start) & (ds.field(time_column) <= end)
+
+
+def _as_utc(timestamp=None):
+    """Return "timestamp" as a UTC pd.Timestamp (naive times are UTC)."""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC")
 
 
 if __name__ == "__main__":
     ls = LoadS3()
     endtime = pd.to_datetime("2020-07-15 03:00:00")
     starttime = endtime - datetime.timedelta(minutes=15)
-    ls.retrieve_data(
+    data = ls.retrieve_data(
         mac_address="F9:E2:82:9A:55:61", start_time=starttime, end_time=endtime
     )
+    print(data)
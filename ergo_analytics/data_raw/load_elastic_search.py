@@ -10,12 +10,20 @@ __author__ = "Jesper Kristensen"
 __version__ = "Alpha"
 
 import os
+import heapq
 import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 import numpy as np
 import pandas as pd
 import elasticsearch
 from elasticsearch_dsl import Search
 from elasticsearch import Elasticsearch, RequestsHttpConnection
+from elasticsearch.helpers import scan
 from requests_aws4auth import AWS4Auth
 import yaml
 from constants import *
@@ -38,6 +46,16 @@ class LoadElasticSearch(BaseData):
     the elastic search database, analyze the data, and send back the results.
     """
 
+    _data_format_codes = None  # per device, see "retrieve_data_for_devices"
+
+    # process-wide caches shared by all loaders (see "cache_info"):
+    _clients = dict()  # (host, credentials) -> Elastic Search client
+    _indexes_by_alias = dict()  # (host, alias, among) -> (expiry, indexes)
+    _cache_counts = Counter()
+    _cache_lock = threading.Lock()
+    _slice_buffer_size = 5000  # hits read ahead per sliced scroll
+    alias_cache_ttl = float(os.getenv("ELASTIC_SEARCH_ALIAS_CACHE_TTL", 300))
+
     def __init__(self):
         """
         Construct the data loader.
@@ -46,75 +64,117 @@ class LoadElasticSearch(BaseData):
 
         logger.info("Data loading with Elastic Search object created!")
 
-    def retrieve_data(
-        self,
-        mac_address=None,
-        start_time=None,
-        end_time=None,
-        from_alias=None,
-        find_alias_among_indexes=None,
-        host=None,
-        index=None,
-        data_format_code=None,
-        limit=None,
-    ):
+    @property
+    def data_format_codes(self):
+        """Data format code of each device from "retrieve_data_for_devices"."""
+        return self._data_format_codes
+
+    @classmethod
+    def cache_info(cls):
         """
-        Retrieves the data from the Elastic Search database specified
-        by "host". See the example under our "Test" folder for more details
-        and/or the official website.
-        Some good details on how to search the Elastic Search database can
-        be found here:
-        "https://marcobonzanini.com/2015/02/02/
-        how-to-query-elasticsearch-with-python/"
-        :param mac_address:
-        :param start_time:
-        :param end_time:
-        :param host:
-        :param data_format_code: Which data format code are we using? This
-        determines how the data is streaming in (such as, which order etc.)
-        :param limit: should the number of returned data points be ceiled at limit?
-        :return:
+        Hits and misses of the process-wide client and alias caches, e.g.
+        {"client_hits": 10, "client_misses": 1, "alias_hits": 9, ...}.
         """
-
-        if not start_time or not end_time:
-            raise Exception(
-                "Please provide both the start_time and the " "end_time parameters!"
+        with cls._cache_lock:
+            return {
+                name: cls._cache_counts[name]
+                for name in [
+                    "client_hits",
+                    "client_misses",
+                    "alias_hits",
+                    "alias_misses",
+                ]
+            }
+
+    @classmethod
+    def clear_cache(cls):
+        """Forget all cached clients, alias resolutions and cache counts."""
+        with cls._cache_lock:
+            cls._clients.clear()
+            cls._indexes_by_alias.clear()
+            cls._cache_counts.clear()
+
+    def _get_client(self, host=None):
+        """Return an Elastic Search client connected to "host".
+
+        Clients are kept for the lifetime of the process (per host and
+        credentials) so their HTTP keep-alive connections are reused across
+        calls (and dramatiq tasks) instead of being set up for every search.
+
+        :param host: the AWS host of the Elastic Search cluster; if None we
+        connect to a local Elastic Search database instead.
+        """
+        credentials = None
+        if host is not None:
+            credentials = (
+                os.getenv("ES_AWS_ACCESS_KEY", os.getenv("AWS_ACCESS_KEY")),
+                os.getenv("ES_AWS_SECRET_KEY", os.getenv("AWS_SECRET_KEY")),
+                os.getenv("ES_AWS_REGION", os.getenv("AWS_REGION")),
             )
 
-        logger.debug('from "retrieve_data" function:')
-        logger.debug("from_alias: {}".format(from_alias))
-        logger.debug("find_alias_among_indexes: {}".format(find_alias_among_indexes))
-        logger.debug("host: {}".format(host))
-        logger.debug("index: {}".format(index))
+        with self._cache_lock:
+            es = self._clients.get((host, credentials))
+            if es is not None:
+                self._cache_counts["client_hits"] += 1
+                return es
+
+            self._cache_counts["client_misses"] += 1
+            es = self._create_client(host=host, credentials=credentials)
+            self._clients[(host, credentials)] = es
 
+        return es
+
+    @staticmethod
+    def _create_client(host=None, credentials=None):
+        """Create a new Elastic Search client (see "_get_client")."""
         if host is None:
             # used locally
             host = ["localhost:9200"]
-            es = Elasticsearch(hosts=host, use_ssl=False, verify_certs=False)
-        else:
-            # used in staging and production on AWS to connect to ES
-            # cluster on AWS:
-            awsauth = AWS4Auth(
-                os.getenv("ES_AWS_ACCESS_KEY", os.getenv("AWS_ACCESS_KEY")),
-                os.getenv("ES_AWS_SECRET_KEY", os.getenv("AWS_SECRET_KEY")),
-                os.getenv("ES_AWS_REGION", os.getenv("AWS_REGION")),
-                "es",
-            )
-            logger.debug("Connecting to ES host {} port 443".format(host))
-            es = Elasticsearch(
-                hosts=[{"host": host, "port": 443}],
-                http_auth=awsauth,
-                use_ssl=True,
-                verify_certs=True,
-                connection_class=RequestsHttpConnection,
-            )
+            return Elasticsearch(hosts=host, use_ssl=False, verify_certs=False)
+
+        # used in staging and production on AWS to connect to ES
+        # cluster on AWS:
+        awsauth = AWS4Auth(*credentials, "es")
+        logger.debug("Connecting to ES host {} port 443".format(host))
+        return Elasticsearch(
+            hosts=[{"host": host, "port": 443}],
+            http_auth=awsauth,
+            use_ssl=True,
+            verify_certs=True,
+            connection_class=RequestsHttpConnection,
+        )
 
+    def _find_indexes(
+        self,
+        es=None,
+        host=None,
+        from_alias=None,
+        find_alias_among_indexes=None,
+        index=None,
+    ):
+        """
+        Return the comma-separated indexes to search: either "index" or the
+        indexes carrying the alias "from_alias". Alias resolutions are cached
+        for "alias_cache_ttl" seconds.
+        """
         if from_alias is not None:
             # we are using alias with elastic search
             # look for the given alias and automatically collect the relevant indexes
             if find_alias_among_indexes is None:
                 find_alias_among_indexes = "*"
 
+            key = (host, from_alias, find_alias_among_indexes)
+            with self._cache_lock:
+                expires_at, cached_index = self._indexes_by_alias.get(key, (0, None))
+                is_cached = time.monotonic() < expires_at
+                self._cache_counts["alias_hits" if is_cached else "alias_misses"] += 1
+
+            if is_cached:
+                logger.debug(
+                    "Found index(es) via cached alias: '{}'".format(cached_index)
+                )
+                return cached_index
+
             logger.debug(
                 'Finding alias among these indexes: "{}"'.format(
                     find_alias_among_indexes
@@ -141,155 +201,445 @@ class LoadElasticSearch(BaseData):
             print(msg)
             logger.debug(msg)
 
+            with self._cache_lock:
+                self._indexes_by_alias[key] = (
+                    time.monotonic() + self.alias_cache_ttl,
+                    ",".join(index),
+                )
+
         logger.debug("Established connection to the Elastic Search database.")
         logger.debug("Searching indexes: '{}'".format(index))
 
-        data_all_devices = []
-        try:
-            search = (
-                Search(using=es, index=",".join(list(np.atleast_1d(index))))
-                .query("match", device__keyword=mac_address)
-                .query(
-                    "range",
-                    **{"received_timestamp": {"gte": start_time, "lte": end_time}},
-                )
-                .sort("received_timestamp")
+        return ",".join(list(np.atleast_1d(index)))
+
+    @staticmethod
+    def _search_device(
+        es=None, index=None, mac_address=None, start_time=None, end_time=None
+    ):
+        """The search for the data of one device, in time order."""
+        return (
+            Search(using=es, index=index)
+            .query("match", device__keyword=mac_address)
+            .query(
+                "range",
+                **{"received_timestamp": {"gte": start_time, "lte": end_time}},
+            )
+            .sort("received_timestamp")
+            .source(["received_timestamp", "value"])
+        )
+
+    def retrieve_data(
+        self,
+        mac_address=None,
+        start_time=None,
+        end_time=None,
+        from_alias=None,
+        find_alias_among_indexes=None,
+        host=None,
+        index=None,
+        data_format_code=None,
+        limit=None,
+        number_of_slices=None,
+        cache=None,
+    ):
+        """
+        Retrieves the data from the Elastic Search database specified
+        by "host". See the example under our "Test" folder for more details
+        and/or the official website.
+        Some good details on how to search the Elastic Search database can
+        be found here:
+        "https://marcobonzanini.com/2015/02/02/
+        how-to-query-elasticsearch-with-python/"
+        :param mac_address:
+        :param start_time:
+        :param end_time:
+        :param host:
+        :param data_format_code: Which data format code are we using? This
+        determines how the data is streaming in (such as, which order etc.)
+        :param limit: should the number of returned data points be ceiled at limit?
+        :param number_of_slices: split the scroll into this many Elastic
+        Search sliced scrolls read in parallel (useful for long time ranges).
+        :param cache: optional "RawDataCache"; only the time ranges missing
+        from the cache are then fetched from Elastic Search.
+        :return:
+        """
+
+        if not start_time or not end_time:
+            raise Exception(
+                "Please provide both the start_time and the " "end_time parameters!"
+            )
+
+        if cache is not None:
+            return self._retrieve_from_cache(
+                cache=cache,
+                mac_address=mac_address,
+                start_time=start_time,
+                end_time=end_time,
+                limit=limit,
+                fetch=lambda start_time=None, end_time=None: self.retrieve_data(
+                    mac_address=mac_address,
+                    start_time=start_time,
+                    end_time=end_time,
+                    from_alias=from_alias,
+                    find_alias_among_indexes=find_alias_among_indexes,
+                    host=host,
+                    index=index,
+                    data_format_code=data_format_code,
+                    number_of_slices=number_of_slices,
+                ),
             )
-            _count = search.count()  # used to test connection
+
+        logger.debug('from "retrieve_data" function:')
+        logger.debug("from_alias: {}".format(from_alias))
+        logger.debug("find_alias_among_indexes: {}".format(find_alias_among_indexes))
+        logger.debug("host: {}".format(host))
+        logger.debug("index: {}".format(index))
+
+        es = self._get_client(host=host)
+
+        index = self._find_indexes(
+            es=es,
+            host=host,
+            from_alias=from_alias,
+            find_alias_among_indexes=find_alias_among_indexes,
+            index=index,
+        )
+
+        search = self._search_device(
+            es=es,
+            index=index,
+            mac_address=mac_address,
+            start_time=start_time,
+            end_time=end_time,
+        )
+
+        # data is stored in the value key on elasticsearch
+        # elastic search data never has date in "value":
+        # will always be in this format (example):
+        # {timestamp: 'data', device: 'mac',
+        # values: 'yaw1,pitch1,roll1,yaw2,pitch2,roll2}
+        # BSAFE loads the data as "time + values" in one bulk decode below.
+        # new format: received_timestamp is when cassia received the data
+        # we also have wearable_timestamp which can be used to sort the data
+        # (no separate count: an empty scroll tells us there is no data)
+        received_timestamps = []
+        values = []
+        try:
+            for _, source in self._scan(
+                es=es,
+                query=search.to_dict(),
+                index=index,
+                number_of_slices=number_of_slices,
+            ):
+                received_timestamps.append(source["received_timestamp"])
+                values.append(source["value"])
+
+                if limit is not None and len(values) >= limit:
+                    break
         except elasticsearch.exceptions.ConnectionError as e:
-            msg = "Elastic Search Connection Issue!"
-            msg += "\nCommon Cause: Have you started the Elasticnet database server?\n"
-            msg += "The error was: '{}'".format(e)
-            logger.exception(msg)
-            raise Exception(msg)
-
-        device_data = []
-        if search.count() == 0:
+            self._raise_connection_error(e)
+
+        if len(values) == 0:
             logger.info("No documents found for device {}".format(mac_address))
             return None
 
-        if _count > 50000:
+        if len(values) > 50000:
             logger.warning("Warning: You are searching a lot of indexes!")
 
-        _search = search.params(preserve_order=True, raise_on_error=False)
-
-        for ix, hit in enumerate(_search.scan()):
-
-            # data is stored in the value key on elasticsearch
-            # elastic search data never has date in "value":
-            # will always be in this format (example):
-            # {timestamp: 'data', device: 'mac',
-            # values: 'yaw1,pitch1,roll1,yaw2,pitch2,roll2}
-            # BSAFE loads the data as "time + values" in _load_datum(...):
-            # data = [f"{hit['timestamp']}, {hit['value']}",
-            #         hit['device'], hit['timestamp']]
-            data = [
-                f"{hit['received_timestamp']}, {hit['value']}",
-                hit["device"],
-                hit["received_timestamp"],
-                hit["wearable_timestamp"],
-            ]
-            # new format: received_timestamp is when cassia received the data
-            # we also have wearable_timestamp which can be used to sort the data
-            device_data.append(data)
-
-        device_df = pd.DataFrame(device_data)
-        device_df.columns = [
-            "value",
-            "device",
-            "received_timestamp",
-            "wearable_timestamp",
-        ]
         logger.info(
-            "{} documents found for this device.".format(len(device_df), mac_address)
+            "{} documents found for device {}.".format(len(values), mac_address)
         )
-        data_all_devices.append(device_df)
-
-        logger.info(device_df.head(10))
 
-        if len(data_all_devices) > 0:
+        all_data = self._decode_values(
+            values=values,
+            timestamps=received_timestamps,
+            data_format_code=data_format_code,
+        )
 
-            all_data = []
-            data = pd.concat(data_all_devices, axis=0)["value"].values
-            for ix, datum in enumerate(data):
-                datapoint, data_format_code = self._load_datum(
-                    datum=datum, data_format_code=data_format_code
+        if all_data is None:
+            logger.warning(
+                "None of the documents for device {} could be decoded!".format(
+                    mac_address
                 )
+            )
 
-                if datapoint is None:
-                    continue  # skip
+        return all_data
 
-                all_data.append(datapoint)
+    def retrieve_data_iter(
+        self,
+        mac_address=None,
+        start_time=None,
+        end_time=None,
+        from_alias=None,
+        find_alias_among_indexes=None,
+        host=None,
+        index=None,
+        data_format_code=None,
+        chunk_size=10000,
+        number_of_slices=None,
+    ):
+        """
+        Like "retrieve_data" but yields the data while scrolling through it,
+        as typed pd.DataFrames of (at most) "chunk_size" rows in time order.
+        Only about one chunk of data is held in memory at a time so this is
+        the way to go through long time ranges; the chunks can be passed on
+        directly to "DataFilterPipeline.run". The index of the chunks runs on
+        from one chunk to the next as if they were one DataFrame.
+
+        :param chunk_size: number of documents decoded into each chunk.
+        :return: iterator of pd.DataFrame (nothing if there is no data).
+        """
 
-                if limit is not None and ix >= limit - 1:
-                    break
+        if not start_time or not end_time:
+            raise Exception(
+                "Please provide both the start_time and the " "end_time parameters!"
+            )
+
+        es = self._get_client(host=host)
+        index = self._find_indexes(
+            es=es,
+            host=host,
+            from_alias=from_alias,
+            find_alias_among_indexes=find_alias_among_indexes,
+            index=index,
+        )
+        search = self._search_device(
+            es=es,
+            index=index,
+            mac_address=mac_address,
+            start_time=start_time,
+            end_time=end_time,
+        )
 
-            all_data = pd.concat(all_data)
+        hits = self._scan(
+            es=es,
+            query=search.to_dict(),
+            index=index,
+            number_of_slices=number_of_slices,
+        )
 
-            # cast data types once:
-            all_data = self._cast_to_correct_types(
-                all_data=all_data, data_format_code=data_format_code
+        number_of_points = 0
+        quarantined_data = []
+        while True:
+            received_timestamps = []
+            values = []
+            try:
+                for _, source in hits:
+                    received_timestamps.append(source["received_timestamp"])
+                    values.append(source["value"])
+                    if len(values) >= chunk_size:
+                        break
+            except elasticsearch.exceptions.ConnectionError as e:
+                self._raise_connection_error(e)
+
+            if len(values) == 0:
+                break
+
+            data = self._decode_values(
+                values=values,
+                timestamps=received_timestamps,
+                data_format_code=data_format_code,
             )
+            quarantined_data.append(self._quarantined_data)
 
-            return all_data
+            if data is not None:
+                # the first chunk decides the format of the remaining chunks:
+                data_format_code = self._data_format_code
+                data.index = pd.RangeIndex(
+                    number_of_points, number_of_points + len(data)
+                )
+                number_of_points += len(data)
+                self._number_of_points = number_of_points
+                yield data
 
-    def _load_datum(self, datum=None, data_format_code=None):
-        """
-        Loads a datum sent from the wearable.
+        logger.info(
+            "{} data points found for device {}.".format(number_of_points, mac_address)
+        )
+        if len(quarantined_data) > 0:
+            self._quarantined_data = pd.concat(quarantined_data)
 
-        :param datum: The datum to load from the device.
-        :return: data and the data format code (can change if incoming is incorrect).
+    def retrieve_data_for_devices(
+        self,
+        mac_addresses=None,
+        start_time=None,
+        end_time=None,
+        from_alias=None,
+        find_alias_among_indexes=None,
+        host=None,
+        index=None,
+        data_format_code=None,
+        number_of_slices=None,
+        devices_per_query=1000,
+    ):
         """
-        if data_format_code is not None:
-            names = DATA_FORMAT_CODES[data_format_code]["NAMES"]
-        else:
-            if self._data_column_names is not None:
-                names = self._data_column_names
-            else:
-                names = DATA_FORMAT_CODES["1"]["NAMES"]  # try something at first
+        Retrieves the data of many devices over the same time window. Rather
+        than one search per device (see "retrieve_data") the whole fleet is
+        fetched with one "terms" query per "devices_per_query" devices over
+        one client connection; the hits are grouped by device as they stream
+        in and each device is then decoded in bulk.
 
-        try:
-            datum = datum.rstrip("\n").rstrip("\r").rstrip("\r").rstrip("\n")
-            datum = np.asarray(datum.split(","))
+        :param mac_addresses: the devices to retrieve data for.
+        :param start_time:
+        :param end_time:
+        :param host:
+        :param data_format_code: Which data format code are we using? If None
+        it is found for each device from its data.
+        :param number_of_slices: split each scroll into this many Elastic
+        Search sliced scrolls read in parallel.
+        :param devices_per_query: at most this many devices per "terms" query.
+        :return: dict from mac address to its pd.DataFrame (None if the device
+        had no data). The format code of each device is in "data_format_codes".
+        """
 
-            data = pd.DataFrame(
-                data=np.atleast_2d(datum).reshape(1, len(names)), columns=names
+        if not start_time or not end_time:
+            raise Exception(
+                "Please provide both the start_time and the " "end_time parameters!"
             )
-        except ValueError as vale:
-            logger.warning(
-                "When loading the data from ES, this error was raised: {}".format(vale)
+
+        mac_addresses = list(dict.fromkeys(np.atleast_1d(mac_addresses)))
+        self._data_format_codes = dict()
+
+        es = self._get_client(host=host)
+        index = self._find_indexes(
+            es=es,
+            host=host,
+            from_alias=from_alias,
+            find_alias_among_indexes=find_alias_among_indexes,
+            index=index,
+        )
+
+        received_timestamps = {mac_address: [] for mac_address in mac_addresses}
+        values = {mac_address: [] for mac_address in mac_addresses}
+        for ix in range(0, len(mac_addresses), devices_per_query):
+            search = (
+                Search(using=es, index=index)
+                .filter(
+                    "terms",
+                    device__keyword=mac_addresses[ix : ix + devices_per_query],
+                )
+                .filter(
+                    "range",
+                    **{"received_timestamp": {"gte": start_time, "lte": end_time}},
+                )
+                .sort("received_timestamp")
+                .source(["device", "received_timestamp", "value"])
             )
-            logger.info("Trying to guess the data format code now!")
 
-            # try finding the right data format code:
-            data = None
-            for new_data_format_code in DATA_FORMAT_CODES:
-                new_names = DATA_FORMAT_CODES[new_data_format_code]["NAMES"]
-                try:
-                    data = pd.DataFrame(
-                        data=np.atleast_2d(datum).reshape(1, len(new_names)),
-                        columns=new_names,
+            try:
+                for _, source in self._scan(
+                    es=es,
+                    query=search.to_dict(),
+                    index=index,
+                    number_of_slices=number_of_slices,
+                ):
+                    received_timestamps[source["device"]].append(
+                        source["received_timestamp"]
                     )
-                    break  # we found it, stop on first hit (assumption)
-                except ValueError as vale:
-                    logger.warning("Tried '{}' but not correct.".format(vale))
-                    pass
-
-            if data is None:
-                return None, "Please provide the correct Data Format Code!"
+                    values[source["device"]].append(source["value"])
+            except elasticsearch.exceptions.ConnectionError as e:
+                self._raise_connection_error(e)
 
+        all_data = dict()
+        for mac_address in mac_addresses:
             logger.info(
-                "Found the data format code to be: {}".format(new_data_format_code)
+                "{} documents found for device {}.".format(
+                    len(values[mac_address]), mac_address
+                )
             )
-            self._data_format_code = new_data_format_code
-            return data, new_data_format_code
 
-        except Exception as e:
-            logger.warning("Error loading data! The error is: '{}'".format(e))
-            return None, None
+            all_data[mac_address] = None
+            if len(values[mac_address]) > 0:
+                all_data[mac_address] = self._decode_values(
+                    values=values[mac_address],
+                    timestamps=received_timestamps[mac_address],
+                    data_format_code=data_format_code,
+                )
 
-        self._data_format_code = data_format_code
-        return data, data_format_code
+            if all_data[mac_address] is not None:
+                self._data_format_codes[mac_address] = self._data_format_code
+
+        return all_data
+
+    @staticmethod
+    def _raise_connection_error(error=None):
+        msg = "Elastic Search Connection Issue!"
+        msg += "\nCommon Cause: Have you started the Elasticnet database server?\n"
+        msg += "The error was: '{}'".format(error)
+        logger.exception(msg)
+        raise Exception(msg)
+
+    def _scan(self, es=None, query=None, index=None, number_of_slices=None):
+        """
+        Scrolls through all hits of "query" and yields (sort key, source)
+        in "received_timestamp" order.
+
+        With "number_of_slices" > 1 the scroll is split into that many
+        Elastic Search sliced scrolls which are read by a thread pool; each
+        slice comes back sorted so they are merged back into order with a
+        k-way merge on the client as the hits arrive (each slice buffers at
+        most "_slice_buffer_size" hits ahead of the merge).
+        """
+        if number_of_slices is None or int(number_of_slices) <= 1:
+            yield from self._scan_slice(es=es, query=query, index=index)
+            return
+
+        number_of_slices = int(number_of_slices)
+        logger.debug(f"Reading the data in {number_of_slices} sliced scrolls.")
+
+        stop = threading.Event()  # set when we stop reading (e.g. "limit")
+        buffers = [
+            queue.Queue(maxsize=self._slice_buffer_size)
+            for _ in range(number_of_slices)
+        ]
+
+        def put(buffer, item):
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_slice(slice_id):
+            sliced_query = dict(query, slice={"id": slice_id, "max": number_of_slices})
+            try:
+                for hit in self._scan_slice(es=es, query=sliced_query, index=index):
+                    if not put(buffers[slice_id], hit):
+                        return
+            except Exception as e:
+                put(buffers[slice_id], e)
+                return
+            put(buffers[slice_id], None)  # this slice is done
+
+        def drain(buffer):
+            while True:
+                hit = buffer.get()
+                if hit is None:
+                    return
+                if isinstance(hit, Exception):
+                    raise hit
+                yield hit
+
+        executor = ThreadPoolExecutor(max_workers=number_of_slices)
+        try:
+            for slice_id in range(number_of_slices):
+                executor.submit(read_slice, slice_id)
+            yield from heapq.merge(*map(drain, buffers), key=itemgetter(0))
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    def _scan_slice(es=None, query=None, index=None):
+        """Scroll through one (slice of a) query in sorted order."""
+        for hit in scan(
+            es, query=query, index=index, preserve_order=True, raise_on_error=False
+        ):
+            source = hit["_source"]
+            # sort on what Elastic Search sorted on (epoch millis for dates):
+            sort_key = hit.get("sort") or [source["received_timestamp"]]
+            yield sort_key[0], source
 
 
 if __name__ == "__main__":
@@ -17,6 +17,8 @@ __version__ = "Alpha"
 import os
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
 from ergo_analytics.data_raw import BaseData
 from ergo_analytics.utilities import is_numeric
 from constants import *
@@ -24,16 +26,33 @@ import logging
 
 logger = logging.getLogger()
 
+# timestamps pyarrow can parse (without the time zone):
+ISO_TIMESTAMP = r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d{1,9})?"
+
 
 class LoadDataFromLocalDisk(BaseData):
     """
     Loads data from disk on local harddrive. Simplest form of loading data.
     """
 
-    def __init__(self):
+    _engine = None
+
+    def __init__(self, engine="pyarrow"):
+        """
+        :param engine: "pyarrow" reads the files with the multithreaded CSV
+        reader of pyarrow (falling back to "pandas" for files it cannot
+        read); "pandas" reads them with "pd.read_csv".
+        """
 
         super().__init__()
 
+        if engine not in ["pyarrow", "pandas"]:
+            msg = f"Unknown engine '{engine}' for reading files!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        self._engine = engine
+
         logger.debug("Data loading object created!")
 
     def _read_datafile(self, path=None, data_format_code=None):
@@ -46,17 +65,48 @@ class LoadDataFromLocalDisk(BaseData):
         :return: Pandas DataFrame with data loaded from disk.
         """
 
+        if not os.path.isfile(path):
+            msg = f"Could not find local file at '{path}'!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        # the first few KB tell the format and where the data starts:
+        lines = self._sniff(path=path)
+
         if data_format_code is None:
-            data_format_code = self._find_data_format_code(path=path)
+            # the most common number of columns decides the format:
+            widths = pd.Series([line.count(b",") + 1 for line in lines], dtype=int)
+            for width in widths.value_counts().index:
+                data_format_code = self._find_data_format_code_from_width(width)
+                if data_format_code is not None:
+                    break
+
+            if data_format_code is None:
+                msg = "The data format code could not found for the data!"
+                logger.error(msg)
+                raise Exception(msg)
+
+            logger.info(f"Found the data format code to be: {data_format_code}")
 
         self._data_format_code = data_format_code
         data_column_names = DATA_FORMAT_CODES[data_format_code]["NAMES"]
         self._data_column_names = data_column_names
 
-        if not os.path.isfile(path):
-            msg = f"Could not find local file at '{path}'!"
-            logger.error(msg)
-            raise Exception(msg)
+        if self._engine == "pyarrow":
+            try:
+                data = self._read_datafile_with_pyarrow(
+                    path=path, lines=lines, data_format_code=data_format_code
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Could not read '{path}' with pyarrow ({e}); "
+                    f"reading it with pandas instead."
+                )
+                data = None
+
+            if data is not None:
+                logger.debug("Successful loading of data...")
+                return data
 
         data = pd.read_csv(path, names=self.data_column_names)
 
@@ -189,3 +239,123 @@ class LoadDataFromLocalDisk(BaseData):
                 ix += 1
 
         return data.iloc[ix:, :]
+
+    @staticmethod
+    def _sniff(path=None, sample_bytes=64 * 1024):
+        """
+        Return the complete lines (with their line endings) among the first
+        "sample_bytes" of the file.
+        """
+        with open(path, "rb") as fd:
+            sample = fd.read(sample_bytes)
+            at_end = len(fd.read(1)) == 0
+
+        lines = sample.splitlines(keepends=True)
+        if len(lines) > 0 and not at_end and not lines[-1].endswith(b"\n"):
+            lines = lines[:-1]  # cut off by the sample size
+
+        return lines
+
+    def _find_first_valid_row(self, lines=None, data_format_code=None):
+        """
+        Find the first of "lines" with a timestamp and numbers in all numeric
+        columns - in one vectorized pass.
+
+        :return: (index of that line, number of leading columns before the
+        data columns, pd.DataFrame of the fields of the valid lines) or
+        (None, None, None) if there is no such line.
+        """
+        plan = self._casting_plan(data_format_code, dtype_policy=self._dtype_policy)
+        names = plan["columns"]
+
+        sample = pd.Series([line.decode(errors="replace") for line in lines])
+        sample = sample.str.rstrip("\r\n")
+        widths = sample.str.count(",") + 1
+
+        # rows wider than the format have leading (index) columns as in
+        # "pd.read_csv", so use the most common width:
+        wide_enough = widths[widths >= len(names)]
+        if len(wide_enough) == 0:
+            return None, None, None
+        width = wide_enough.value_counts().index[0]
+        leading = width - len(names)
+
+        fields = sample.str.split(",", expand=True).iloc[:, leading:width]
+        fields.columns = range(len(names))
+
+        is_valid = (widths == width).values
+        for position, name in enumerate(names):
+            column = fields[position].fillna("").str.strip()
+            if name in plan["time_columns"]:
+                is_valid &= (column != "").values
+            else:
+                numbers = pd.to_numeric(column, errors="coerce").values
+                is_valid &= np.isfinite(numbers)
+
+        if not is_valid.any():
+            return None, None, None
+
+        fields.columns = names
+        return int(np.argmax(is_valid)), leading, fields[is_valid]
+
+    def _read_datafile_with_pyarrow(self, path=None, lines=None, data_format_code=None):
+        """
+        Read the data rows of the file into typed columns with the
+        multithreaded CSV reader of pyarrow.
+
+        :return: pd.DataFrame or None if the data could not be found in the
+        first lines of the file.
+        """
+        first_row, leading, fields = self._find_first_valid_row(
+            lines=lines, data_format_code=data_format_code
+        )
+        if first_row is None:
+            return None
+
+        plan = self._casting_plan(data_format_code, dtype_policy=self._dtype_policy)
+        names = plan["columns"]
+
+        column_types = dict()
+        for name in plan["time_columns"]:
+            # pyarrow parses ISO 8601 timestamps itself (much faster), the
+            # rest is parsed by "_parse_timestamps":
+            times = fields[name].str.strip()
+            if times.str.fullmatch(ISO_TIMESTAMP + r"(Z|\+00:?00)").all():
+                column_types[name] = pa.timestamp("ns", tz="UTC")
+            elif times.str.fullmatch(ISO_TIMESTAMP).all():
+                column_types[name] = pa.timestamp("ns")
+            else:
+                column_types[name] = pa.string()
+        for name, dtype in plan["dtypes"].items():
+            column_types[name] = pa.from_numpy_dtype(dtype)
+
+        with open(path, "rb") as fd:
+            fd.seek(sum(len(line) for line in lines[:first_row]))
+            table = pcsv.read_csv(
+                fd,
+                read_options=pcsv.ReadOptions(
+                    column_names=[f"_{i}" for i in range(leading)] + names,
+                    use_threads=True,
+                ),
+                convert_options=pcsv.ConvertOptions(
+                    column_types=column_types,
+                    include_columns=names,
+                    strings_can_be_null=True,
+                ),
+            )
+
+        columns = dict()
+        for name in names:
+            column = table.column(name).to_pandas()
+            if column_types[name] == pa.string():
+                column = self._parse_timestamps(
+                    column, data_format_code=data_format_code
+                )
+            columns[name] = column
+
+        data = pd.DataFrame(columns)
+        data.index = pd.RangeIndex(first_row, first_row + len(data))
+
+        self._number_of_points = len(data)
+
+        return data
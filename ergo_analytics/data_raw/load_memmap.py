@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Loads raw data from our binary format, mapped into memory: the file is not
+read (or parsed) up front, the operating system pages in what is touched.
+
+The layout of a file is:
+    * the magic bytes "BSAFEIMU",
+    * the length of the header (uint32, little endian),
+    * the header as JSON (data format code, columns, number of rows, ...),
+      padded with spaces to a multiple of 64 bytes,
+    * the timestamps as int64 nanoseconds since the epoch,
+    * the numeric columns as float32 - one column after the other.
+
+Convert flat files with (from project root):
+>> python convert_to_memmap.py data.csv --output-dir data/
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__all__ = ["LoadMemmap", "convert_to_memmap"]
+__author__ = "Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import argparse
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+import pandas as pd
+from ergo_analytics.data_raw import BaseData
+from ergo_analytics.data_raw import LoadDataFromLocalDisk
+from ergo_analytics.utilities import DTYPE_POLICIES
+from constants import DATA_FORMAT_CODES
+import logging
+
+logger = logging.getLogger()
+
+MAGIC = b"BSAFEIMU"
+VERSION = 1
+ALIGNMENT = 64  # bytes
+
+
+class LoadMemmap(BaseData):
+    """
+    Loads raw data from a file in our binary format (see "write") with
+    "np.memmap". The DataFrame returned uses the mapped memory directly (no
+    copies); changes to it are private to the process and never written
+    back to the file. The data is stored "compact" (float32); with the
+    dtype policy "default" the numeric columns are copied to float64.
+
+    Example:
+    >> data = LoadMemmap().get_data(path="data.mmap")
+    """
+
+    _header = None
+    _dtype_policy = "compact"
+
+    def __init__(self):
+        super().__init__()
+
+    @property
+    def header(self):
+        """The header of the most recently loaded file."""
+        return self._header
+
+    @staticmethod
+    def write(data=None, path=None, data_format_code=None):
+        """
+        Write raw data to "path" in the binary format.
+
+        :param data: pd.DataFrame with the columns of "data_format_code".
+        :param path: where to write the file (replaced atomically).
+        :param data_format_code: the format of the data (see "settings").
+        """
+        if data is None or data_format_code is None:
+            msg = "Please provide the data and its data format code!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        data_format_code = str(data_format_code).strip()
+        names = DATA_FORMAT_CODES[data_format_code]["NAMES"]
+        time_column = names[0]
+        numeric_columns = names[1:]
+
+        times = pd.DatetimeIndex(data[time_column])
+        time_zone = None if times.tz is None else str(times.tz)
+        if times.tz is not None:
+            times = times.tz_convert("UTC")
+
+        header = dict(
+            version=VERSION,
+            data_format_code=data_format_code,
+            time_column=time_column,
+            time_zone=time_zone,
+            columns=numeric_columns,
+            number_of_rows=len(data),
+            is_sorted=bool(times.is_monotonic_increasing),
+        )
+        header = json.dumps(header).encode()
+        # pad so the columns start at an aligned offset:
+        prefix_size = len(MAGIC) + 4 + len(header)
+        header += b" " * (-prefix_size % ALIGNMENT)
+
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(MAGIC)
+                tmp.write(struct.pack("<I", len(header)))
+                tmp.write(header)
+                tmp.write(times.asi8.astype("<i8").tobytes())
+                tmp.write(
+                    np.ascontiguousarray(
+                        data[numeric_columns].to_numpy(dtype="<f4").T
+                    ).tobytes()
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def read_header(path=None):
+        """
+        Return (header, offset of the columns in bytes) of the file at
+        "path".
+        """
+        with open(path, "rb") as fd:
+            magic = fd.read(len(MAGIC))
+            if magic != MAGIC:
+                msg = f"'{path}' is not a raw data file in the binary format!"
+                logger.error(msg)
+                raise Exception(msg)
+            (length,) = struct.unpack("<I", fd.read(4))
+            header = json.loads(fd.read(length))
+
+        if header["version"] > VERSION:
+            msg = f"Version {header['version']} of the binary format is not known!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        return header, len(MAGIC) + 4 + length
+
+    def get_data(
+        self, path=None, data_format_code=None, start_time=None, end_time=None
+    ):
+        """
+        Map the file at "path" into memory and return its data.
+
+        :param path: file in the binary format.
+        :param data_format_code: if given, the format the data must be in.
+        :param start_time: optionally only return data from this time on...
+        :param end_time: ...and up to (and including) this time. The time
+        window is found by bisection (on sorted data) so only the pages
+        holding it are touched.
+        :return: pd.DataFrame (float32 numeric columns unless the dtype
+        policy is "default").
+        """
+        if not os.path.isfile(path):
+            msg = f"Could not find local file at '{path}'!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        header, offset = self.read_header(path=path)
+
+        if data_format_code is not None and str(data_format_code).strip() != str(
+            header["data_format_code"]
+        ):
+            msg = (
+                f"The file holds data of format {header['data_format_code']}, "
+                f"not {data_format_code}!"
+            )
+            logger.error(msg)
+            raise Exception(msg)
+
+        number_of_rows = header["number_of_rows"]
+        columns = header["columns"]
+
+        if number_of_rows > 0:
+            # copy-on-write: writes stay in (private) memory:
+            times = np.memmap(
+                path, dtype="<i8", mode="c", offset=offset, shape=(number_of_rows,)
+            )
+            numerics = np.memmap(
+                path,
+                dtype="<f4",
+                mode="c",
+                offset=offset + 8 * number_of_rows,
+                shape=(len(columns), number_of_rows),
+            )
+        else:
+            times = np.empty(0, dtype="<i8")
+            numerics = np.empty((len(columns), 0), dtype="<f4")
+
+        first, last = 0, number_of_rows
+        if start_time is not None or end_time is not None:
+            if not header["is_sorted"]:
+                msg = "Can only select a time window of sorted data!"
+                logger.error(msg)
+                raise Exception(msg)
+            if start_time is not None:
+                first = np.searchsorted(
+                    times, self._as_nanoseconds(start_time), side="left"
+                )
+            if end_time is not None:
+                last = np.searchsorted(
+                    times, self._as_nanoseconds(end_time), side="right"
+                )
+            last = max(first, last)
+
+        time_zone = header["time_zone"]
+        times = pd.arrays.DatetimeArray(
+            times[first:last].view("M8[ns]"),
+            dtype=(
+                np.dtype("M8[ns]")
+                if time_zone is None
+                else pd.DatetimeTZDtype(tz="UTC")
+            ),
+            copy=False,
+        )
+        if time_zone not in [None, "UTC"]:
+            times = times.tz_convert(time_zone)
+
+        numerics = numerics[:, first:last].T
+        if self._dtype_policy != "compact":
+            numerics = numerics.astype(DTYPE_POLICIES[self._dtype_policy])
+
+        # frames from one 2D array (one block) and one time column keep
+        # pointing into the mapped memory when joined with "copy=False":
+        data = pd.concat(
+            [
+                pd.DataFrame({header["time_column"]: times}, copy=False),
+                pd.DataFrame(numerics, columns=columns, copy=False),
+            ],
+            axis=1,
+            copy=False,
+        )
+
+        self._header = header
+        self._data_format_code = header["data_format_code"]
+        self._data_column_names = [header["time_column"]] + columns
+        self._number_of_points = len(data)
+
+        return data
+
+    @staticmethod
+    def _as_nanoseconds(timestamp=None):
+        """UTC nanoseconds since the epoch (naive times are UTC)."""
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+        return timestamp.value
+
+
+def convert_to_memmap(path=None, destination=None, data_format_code=None):
+    """
+    Convert a flat file of raw data to the binary format.
+
+    :param path: the flat file (see "LoadDataFromLocalDisk").
+    :param destination: the file to write; defaults to "path" with the
+    extension ".mmap".
+    :param data_format_code: format of the data; found from the file if None.
+    :return: the path of the file written.
+    """
+    if destination is None:
+        destination = os.path.splitext(path)[0] + ".mmap"
+
+    loader = LoadDataFromLocalDisk()
+    data = loader.get_data(
+        path=path,
+        destination=os.path.dirname(os.path.abspath(destination)),
+        data_format_code=data_format_code,
+    )
+    LoadMemmap.write(
+        data=data, path=destination, data_format_code=loader.data_format_code
+    )
+    logger.info(f"Converted '{path}' ({len(data)} rows) to '{destination}'.")
+
+    return destination
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Convert flat files of raw data to the binary format."
+    )
+    parser.add_argument("paths", nargs="+", help="flat files to convert")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="where to write the files (default: next to the flat files)",
+    )
+    parser.add_argument("--data-format-code", default=None)
+    args = parser.parse_args(args)
+
+    for path in args.paths:
+        destination = None
+        if args.output_dir is not None:
+            name = os.path.splitext(os.path.basename(path))[0] + ".mmap"
+            destination = os.path.join(args.output_dir, name)
+        destination = convert_to_memmap(
+            path=path,
+            destination=destination,
+            data_format_code=args.data_format_code,
+        )
+        print(destination)
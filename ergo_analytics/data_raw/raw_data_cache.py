@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+A local on-disk cache of decoded raw data, partitioned by device and hour
+and stored as Parquet. Overlapping lookback windows (and repeated requests
+for the same shift) then only fetch the time ranges not seen before.
+
+@ author Iterate Labs, Inc.
+Copyright 2018 Iterate Labs, Inc.
+"""
+
+__all__ = ["RawDataCache"]
+__author__ = "Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ergo_analytics.disk_cache import DiskLRUCache
+import logging
+
+logger = logging.getLogger()
+
+HOUR = 3600 * 10**9  # in nanoseconds
+
+
+class RawDataCache(object):
+    """
+    Cache of decoded raw data per device-hour. Each entry holds the rows of
+    one device in one hour together with the time ranges of that hour which
+    have been fetched (possibly without any data), so we know what is
+    missing.
+
+    Example:
+    >> cache = RawDataCache()
+    >> data = LoadElasticSearch().retrieve_data(..., cache=cache)
+    """
+
+    _cache = None
+    _settle_seconds = None
+
+    def __init__(self, directory=None, max_bytes=None, settle_seconds=60):
+        """
+        :param directory: where to keep the cache; defaults to the
+        "RAW_DATA_CACHE_DIR" environment variable or "~/.cache/bsafe/raw_data".
+        :param max_bytes: size limit of the cache; defaults to the
+        "RAW_DATA_CACHE_MAX_BYTES" environment variable or 1 GB.
+        :param settle_seconds: data younger than this may still be on its way
+        into the database so it is never recorded as fetched.
+        """
+        if directory is None:
+            directory = os.getenv("RAW_DATA_CACHE_DIR", "~/.cache/bsafe/raw_data")
+        if max_bytes is None:
+            max_bytes = int(os.getenv("RAW_DATA_CACHE_MAX_BYTES", 10**9))
+
+        self._cache = DiskLRUCache(directory=directory, max_bytes=max_bytes)
+        self._settle_seconds = settle_seconds
+
+    def retrieve(self, mac_address=None, start_time=None, end_time=None, fetch=None):
+        """
+        Return the data of "mac_address" from "start_time" to "end_time"
+        (both included) from the cache, calling "fetch" for any time ranges
+        missing from it.
+
+        :param fetch: function (start_time, end_time) -> (pd.DataFrame or
+        None, data format code) fetching and decoding the data of the device.
+        :return: (pd.DataFrame or None if there is no data, data format code)
+        """
+        start = _as_nanoseconds(start_time)
+        end = _as_nanoseconds(end_time)
+        settled = _as_nanoseconds(pd.Timestamp.utcnow()) - int(
+            self._settle_seconds * 10**9
+        )
+
+        hours = range(start - start % HOUR, end + 1, HOUR)
+        entries = {
+            hour: self._read(mac_address=mac_address, hour=hour) for hour in hours
+        }
+
+        missing = []
+        for hour in hours:
+            window = (max(start, hour), min(end, hour + HOUR - 1))
+            missing.extend(_subtract(window, entries[hour]["covered"]))
+        missing = _merge(missing)
+
+        logger.debug(
+            f"Cache for {mac_address}: {len(hours)} hours, "
+            f"{len(missing)} missing ranges."
+        )
+
+        updated = set()
+        for missing_start, missing_end in missing:
+            # the databases keep times to the millisecond:
+            fetch_start = pd.Timestamp(missing_start, tz="UTC").ceil("ms")
+            fetch_end = pd.Timestamp(missing_end, tz="UTC").floor("ms")
+            data, data_format_code = None, None
+            if fetch_start <= fetch_end:
+                data, data_format_code = fetch(fetch_start, fetch_end)
+            for hour in hours:
+                window = (max(missing_start, hour), min(missing_end, hour + HOUR - 1))
+                if window[0] > window[1]:
+                    continue
+                self._update(
+                    entry=entries[hour],
+                    window=window,
+                    data=data,
+                    data_format_code=data_format_code,
+                    settled=settled,
+                )
+                updated.add(hour)
+
+        for hour in sorted(updated):
+            self._write(mac_address=mac_address, hour=hour, entry=entries[hour])
+
+        data_format_code = None
+        parts = []
+        for hour in hours:
+            data = entries[hour]["data"]
+            if data is None:
+                continue
+            data_format_code = entries[hour]["data_format_code"]
+            times = _times_as_nanoseconds(data)
+            parts.append(data[(times >= start) & (times <= end)])
+
+        if len(parts) == 0 or sum(len(part) for part in parts) == 0:
+            return None, data_format_code
+
+        return pd.concat(parts, ignore_index=True), data_format_code
+
+    @staticmethod
+    def _update(
+        entry=None, window=None, data=None, data_format_code=None, settled=None
+    ):
+        """Replace the rows of "entry" within "window" by those in "data"."""
+        if data is not None and len(data) > 0:
+            if (
+                entry["data_format_code"] is not None
+                and entry["data_format_code"] != data_format_code
+            ):
+                logger.info("The data format changed, dropping the cached hour.")
+                entry.update(data=None, covered=[])
+            entry["data_format_code"] = data_format_code
+
+        new_rows = None
+        if data is not None:
+            times = _times_as_nanoseconds(data)
+            new_rows = data[(times >= window[0]) & (times <= window[1])]
+
+        old_rows = entry["data"]
+        if old_rows is not None:
+            times = _times_as_nanoseconds(old_rows)
+            old_rows = old_rows[(times < window[0]) | (times > window[1])]
+
+        rows = [part for part in [old_rows, new_rows] if part is not None]
+        if len(rows) > 0:
+            rows = pd.concat(rows, ignore_index=True)
+            rows.sort_values("Date-Time", kind="stable", inplace=True)
+            rows.reset_index(drop=True, inplace=True)
+            entry["data"] = rows if len(rows) > 0 else None
+
+        # only what can no longer change is recorded as fetched:
+        if window[0] <= settled:
+            entry["covered"] = _merge(
+                entry["covered"] + [(window[0], min(window[1], settled))]
+            )
+
+    def _key(self, mac_address=None, hour=None):
+        device = re.sub(r"[^0-9A-Za-z]", "", str(mac_address))
+        hour = pd.Timestamp(hour, tz="UTC").strftime("%Y%m%d%H")
+        return f"{device}/{hour}.parquet"
+
+    def _read(self, mac_address=None, hour=None):
+        entry = dict(data=None, covered=[], data_format_code=None)
+
+        raw = self._cache.get(key=self._key(mac_address=mac_address, hour=hour))
+        if raw is None:
+            return entry
+
+        try:
+            table = pq.read_table(pa.BufferReader(raw))
+            metadata = json.loads(table.schema.metadata[b"bsafe"])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry: {e}")
+            return entry
+
+        entry["covered"] = [tuple(interval) for interval in metadata["covered"]]
+        entry["data_format_code"] = metadata["data_format_code"]
+        if table.num_rows > 0:
+            entry["data"] = table.to_pandas()
+
+        return entry
+
+    def _write(self, mac_address=None, hour=None, entry=None):
+        data = entry["data"]
+        if data is None:
+            table = pa.table({})
+        else:
+            table = pa.Table.from_pandas(data, preserve_index=False)
+
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"bsafe"] = json.dumps(
+            dict(covered=entry["covered"], data_format_code=entry["data_format_code"])
+        ).encode()
+        table = table.replace_schema_metadata(metadata)
+
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+        self._cache.put(
+            key=self._key(mac_address=mac_address, hour=hour),
+            data=sink.getvalue().to_pybytes(),
+        )
+
+
+def _as_nanoseconds(timestamp=None):
+    """UTC nanoseconds since the epoch (naive times are UTC)."""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.value
+
+
+def _times_as_nanoseconds(data=None):
+    times = pd.DatetimeIndex(data["Date-Time"])
+    if times.tz is None:
+        times = times.tz_localize("UTC")
+    return np.asarray(times.asi8)
+
+
+def _merge(intervals=None):
+    """Merge overlapping or touching (inclusive, integer) intervals."""
+    merged = []
+    for start, end in sorted(intervals):
+        if len(merged) > 0 and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(window=None, intervals=None):
+    """The parts of the (inclusive) "window" not in any of "intervals"."""
+    start, end = window
+    missing = []
+    for interval_start, interval_end in _merge(intervals):
+        if interval_end < start or interval_start > end:
+            continue
+        if interval_start > start:
+            missing.append((start, interval_start - 1))
+        start = max(start, interval_end + 1)
+    if start <= end:
+        missing.append((start, end))
+    return missing
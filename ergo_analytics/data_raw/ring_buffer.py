@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+A fixed-size buffer of the latest live samples from a wearable.
+
+Every sample is written twice: at its slot and at its slot plus the
+capacity. Then the latest samples are always one contiguous slice of the
+arrays, whatever the write position, so they can be handed out as views
+without copying.
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__all__ = ["RingBuffer"]
+__author__ = "Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import threading
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger()
+
+
+class RingBuffer(object):
+    """
+    Holds the latest "capacity" samples (a timestamp and a value per
+    column) in preallocated numpy arrays.
+
+    The frames returned by "latest" are views of the buffer: they are
+    overwritten once "capacity" more samples have been pushed. Copy them to
+    keep them around for longer.
+
+    Example:
+    >> buffer = RingBuffer(capacity=36000, columns=["Yaw[0](deg)", ...])
+    >> buffer.push(timestamps=times, values=values)
+    >> data = buffer.latest(seconds=60)
+    """
+
+    _capacity = None
+    _columns = None
+    _time_column = None
+    _time_zone = None
+    _times = None  # int64 nanoseconds since the epoch
+    _values = None  # one row per column
+    _head = None  # where the next sample is written
+    _number_of_points = None  # held in the buffer
+    _number_pushed = None  # since the buffer was created
+    _lock = None
+
+    def __init__(
+        self, capacity=None, columns=None, time_column="Date-Time", dtype=np.float64
+    ):
+        """
+        :param capacity: how many samples to hold.
+        :param columns: names of the numeric columns of a sample.
+        :param time_column: name of the timestamp column.
+        :param dtype: dtype of the numeric columns.
+        """
+        if capacity is None or int(capacity) <= 0 or not columns:
+            msg = "Please provide a positive capacity and the columns!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        self._capacity = int(capacity)
+        self._columns = list(columns)
+        self._time_column = time_column
+        self._times = np.zeros(2 * self._capacity, dtype=np.int64)
+        self._values = np.zeros((len(self._columns), 2 * self._capacity), dtype=dtype)
+        self._head = 0
+        self._number_of_points = 0
+        self._number_pushed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def columns(self):
+        return [self._time_column] + self._columns
+
+    @property
+    def number_of_points(self):
+        """How many samples the buffer holds."""
+        return self._number_of_points
+
+    @property
+    def number_pushed(self):
+        """How many samples were pushed in total (consumers can compare it
+        between calls to find out what is new)."""
+        return self._number_pushed
+
+    def push(self, timestamps=None, values=None):
+        """
+        Add samples to the buffer (overwriting the oldest ones when full).
+
+        :param timestamps: the time of each sample (anything "pd.to_datetime"
+        takes); samples are expected to be pushed in time order.
+        :param values: array-like of shape (samples, columns).
+        """
+        times = pd.DatetimeIndex(pd.to_datetime(timestamps))
+        values = np.asarray(values, dtype=self._values.dtype)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+
+        if values.shape != (len(times), len(self._columns)):
+            msg = (
+                f"Expected {len(times)} samples of {len(self._columns)} "
+                f"values, got shape {values.shape}!"
+            )
+            logger.error(msg)
+            raise Exception(msg)
+
+        if times.tz is not None:
+            self._time_zone = str(times.tz)
+            times = times.tz_convert("UTC")
+        times = times.asi8
+
+        number_to_push = len(times)
+        if number_to_push == 0:
+            return
+
+        # only the last "capacity" samples can be kept anyway:
+        skipped = max(number_to_push - self._capacity, 0)
+        times = times[skipped:]
+        values = values[skipped:]
+
+        with self._lock:
+            head = (self._head + skipped) % self._capacity
+            slots = (head + np.arange(len(times))) % self._capacity
+            for offset in [0, self._capacity]:
+                self._times[slots + offset] = times
+                self._values[:, slots + offset] = values.T
+
+            self._head = (head + len(times)) % self._capacity
+            self._number_of_points = min(
+                self._number_of_points + number_to_push, self._capacity
+            )
+            self._number_pushed += number_to_push
+
+    def latest(self, seconds=None, number_of_points=None):
+        """
+        Return the latest samples as a pd.DataFrame viewing the buffer.
+
+        :param seconds: the samples of the last "seconds" (counted back from
+        the latest sample)...
+        :param number_of_points: ...or the last "number_of_points" samples
+        (default: all samples held).
+        """
+        with self._lock:
+            available = self._number_of_points
+            if number_of_points is not None:
+                available = min(available, int(number_of_points))
+
+            end = self._head + self._capacity
+            times = self._times[end - available : end]
+            values = self._values[:, end - available : end]
+
+        if seconds is not None and len(times) > 0:
+            first = np.searchsorted(
+                times, times[-1] - int(seconds * 10**9), side="left"
+            )
+            times = times[first:]
+            values = values[:, first:]
+
+        times = pd.arrays.DatetimeArray(
+            times.view("M8[ns]"),
+            dtype=(
+                np.dtype("M8[ns]")
+                if self._time_zone is None
+                else pd.DatetimeTZDtype(tz="UTC")
+            ),
+            copy=False,
+        )
+        if self._time_zone not in [None, "UTC"]:
+            times = times.tz_convert(self._time_zone)
+
+        # (as in "LoadMemmap" the frames keep pointing into the arrays)
+        return pd.concat(
+            [
+                pd.DataFrame({self._time_column: times}, copy=False),
+                pd.DataFrame(values.T, columns=self._columns, copy=False),
+            ],
+            axis=1,
+            copy=False,
+        )
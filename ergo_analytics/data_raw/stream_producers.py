@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Producers of live samples: they push samples into the ring buffer of a data
+source (see "BaseData.open_stream") from a serial port or by replaying
+recorded data.
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__all__ = ["ReplayProducer", "SerialProducer"]
+__author__ = "Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+from ergo_analytics.data_raw import LoadDataFromLocalDisk
+import logging
+
+logger = logging.getLogger()
+
+
+class BaseProducer(object):
+    """
+    Pushes samples into "source" (a "BaseData" with an open stream) with
+    "read_once" - either in a loop of its own ("run") or in a background
+    thread ("start" / "stop").
+    """
+
+    _source = None
+    _thread = None
+    _stop_event = None
+
+    def __init__(self, source=None):
+        if source is None or source.stream is None:
+            msg = "Please provide a data source with an open stream!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        self._source = source
+        self._stop_event = threading.Event()
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def read_once(self):
+        """Push the samples available now; return how many (None when there
+        will be no more)."""
+        raise NotImplementedError("Implement me!")
+
+    def run(self):
+        """Push samples until there are no more or "stop" is called."""
+        while not self._stop_event.is_set():
+            if self.read_once() is None:
+                break
+
+    def start(self):
+        """Run in a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread (after its current read)."""
+        self._stop_event.set()
+        self.join(timeout=timeout)
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+
+class ReplayProducer(BaseProducer):
+    """
+    Replays recorded data into a stream - for tests, demos, and scoring
+    recordings the way live data would be.
+
+    Example:
+    >> source = BaseData()
+    >> source.open_stream(data_format_code="5")
+    >> ReplayProducer(source=source, path="data.csv", speed=1.0).start()
+    >> data = source.latest(seconds=60)
+    """
+
+    _times = None
+    _values = None
+    _position = None
+    _block_size = None
+    _speed = None
+    _started_at = None
+
+    def __init__(self, source=None, data=None, path=None, speed=None, block_size=10):
+        """
+        :param data: the recording as a pd.DataFrame in the format of the
+        stream...
+        :param path: ...or a flat file of it (see "LoadDataFromLocalDisk").
+        :param speed: None pushes the samples as fast as possible, 1.0 at the
+        pace they were recorded, 2.0 twice as fast, etc.
+        :param block_size: how many samples to push at a time.
+        """
+        super().__init__(source=source)
+
+        if data is None:
+            data = LoadDataFromLocalDisk().get_data(
+                path=path, data_format_code=source.data_format_code
+            )
+
+        columns = source.stream.columns
+        self._times = pd.DatetimeIndex(pd.to_datetime(data[columns[0]]))
+        self._values = data[columns[1:]].to_numpy()
+        self._position = 0
+        self._block_size = int(block_size)
+        self._speed = speed
+
+    def read_once(self):
+        if self._position >= len(self._times):
+            return None
+
+        block = slice(self._position, self._position + self._block_size)
+        times = self._times[block]
+
+        if self._speed is not None:
+            # wait until the last sample of the block is "recorded":
+            if self._started_at is None:
+                self._started_at = time.monotonic()
+            due = (times[-1] - self._times[0]).total_seconds() / self._speed
+            wait = self._started_at + due - time.monotonic()
+            if wait > 0:
+                self._stop_event.wait(wait)
+
+        self._source.push(timestamps=times, values=self._values[block])
+        self._position += len(times)
+
+        return len(times)
+
+
+class SerialProducer(BaseProducer):
+    """
+    Reads samples written by a device to a serial port - one CSV line per
+    sample in the format of the stream, as in the flat files - and pushes
+    them into the stream. Lines which cannot be decoded are skipped.
+
+    Needs "pyserial", an optional dependency which is not in the Pipfile (it
+    is only needed to read from a device): "pip install pyserial". Any URL
+    it knows works, so "loop://" can stand in for a device in tests.
+
+    Example:
+    >> source = BaseData()
+    >> source.open_stream(data_format_code="5")
+    >> producer = SerialProducer(source=source, url="/dev/ttyUSB0")
+    >> producer.start()
+    """
+
+    _port = None
+    _pending = None  # bytes of an incomplete line
+    _number_skipped = None
+
+    def __init__(self, source=None, url=None, port=None, baudrate=115200, timeout=0.1):
+        """
+        :param url: the serial port to open ("serial.serial_for_url")...
+        :param port: ...or a port already open.
+        :param baudrate: baud rate of the port.
+        :param timeout: seconds to wait for data in each read.
+        """
+        super().__init__(source=source)
+
+        if port is None:
+            try:
+                import serial
+            except ImportError:
+                msg = "Reading from a serial port needs pyserial: pip install pyserial"
+                logger.error(msg)
+                raise ImportError(msg)
+
+            port = serial.serial_for_url(url, baudrate=baudrate, timeout=timeout)
+
+        self._port = port
+        self._pending = b""
+        self._number_skipped = 0
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def number_skipped(self):
+        """How many lines could not be decoded."""
+        return self._number_skipped
+
+    def read_once(self):
+        # wait for data (up to the timeout of the port), then take all there is:
+        chunk = self._port.read(max(self._port.in_waiting, 1))
+        chunk += self._port.read(self._port.in_waiting)
+        if len(chunk) == 0:
+            return 0
+
+        *lines, self._pending = (self._pending + chunk).split(b"\n")
+        lines = [line for line in lines if line.strip()]
+        if len(lines) == 0:
+            return 0
+
+        timestamps, values = self._decode(lines=lines)
+        self._source.push(timestamps=timestamps, values=values)
+
+        return len(timestamps)
+
+    def _decode(self, lines=None):
+        """Decode the lines in one pass; returns (timestamps, values)."""
+        columns = self._source.stream.columns
+        rows = [
+            line.decode("utf-8", errors="replace").strip().split(",") for line in lines
+        ]
+        rows = [row for row in rows if len(row) == len(columns)]
+        self._number_skipped += len(lines) - len(rows)
+        if len(rows) == 0:
+            return [], np.empty((0, len(columns) - 1))
+
+        data = pd.DataFrame(rows, columns=columns)
+        timestamps = self._source._parse_timestamps(
+            data[columns[0]],
+            data_format_code=self._source.data_format_code,
+            errors="coerce",
+        )
+        values = data[columns[1:]].apply(pd.to_numeric, errors="coerce").to_numpy()
+
+        is_valid = timestamps.notna().to_numpy() & ~np.isnan(values).any(axis=1)
+        self._number_skipped += len(rows) - int(is_valid.sum())
+
+        return timestamps[is_valid], values[is_valid]
@@ -12,3 +12,4 @@ __version__ = "Alpha"
 
 from .base_structured_data import *
 from .structured_data import *
+from .structured_data_store import *
@@ -49,7 +49,9 @@ class StructuredData(BaseStructuredData):
         self._data_format_code = data_format_code
 
         try:
-            self._time = pd.to_datetime(data["Date-Time"])
+            self._time = data["Date-Time"]
+            if not pd.api.types.is_datetime64_any_dtype(self._time):
+                self._time = pd.to_datetime(self._time)
         except Exception:
             self._time = np.arange(len(data))
 
@@ -66,6 +68,10 @@ class StructuredData(BaseStructuredData):
 
         self._data_matrix = data
 
+    @property
+    def data_format_code(self):
+        return self._data_format_code
+
     @property
     def data_matrix(self):
         """Return the data matrix as originally came in."""
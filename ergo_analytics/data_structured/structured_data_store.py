@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Serialization of the structured data chunks of a pipeline run (as kept in
+the pipestore).
+
+The chunks are stored as one Arrow IPC file: one record batch per chunk (the
+data matrix with its index as a column) and, in the schema metadata, a format
+version and the table of chunks (number of points, data format code, name).
+The file is compressed as a whole (see "compress_bytes"). Reading
+decompresses and opens the file; each chunk is turned into a
+"StructuredData" when first asked for, with the columns viewing the Arrow
+buffers.
+
+@ author Iterate Labs, Inc.
+Copyright 2018- Iterate Labs, Inc.
+All Rights Reserved.
+"""
+
+__all__ = [
+    "dump_structured_data",
+    "load_structured_data",
+    "StructuredDataChunks",
+    "compress_bytes",
+    "decompress_bytes",
+]
+__author__ = "Iterate Labs, Inc."
+__version__ = "Alpha"
+
+from collections.abc import Sequence
+import json
+import pickle
+import struct
+import pyarrow as pa
+import pandas as pd
+
+from .structured_data import StructuredData
+import logging
+
+logger = logging.getLogger()
+
+# bump when the layout changes (files of newer versions are not read):
+FORMAT_VERSION = 1
+
+_MAGIC = b"ARROW1"
+_COMPRESSED_MAGIC = b"BSAFEZ"
+_COMPRESSED_HEADER = struct.Struct("<6s16sQ")  # magic, codec, decompressed size
+_METADATA_KEY = b"bsafe_structured_data"
+_INDEX_COLUMN = "__index__"
+
+
+def dump_structured_data(structured_data=None, compression="zstd"):
+    """
+    Serialize a list of "StructuredData" chunks to bytes (see
+    "load_structured_data").
+
+    :param structured_data: list of "StructuredData".
+    :param compression: "zstd", "lz4" or None.
+    """
+    schema = None
+    batches = []
+    chunks = []
+    for chunk in structured_data:
+        data = chunk.data_matrix
+        chunks.append(
+            dict(
+                number_of_points=len(data),
+                data_format_code=chunk.data_format_code,
+                name=chunk.name,
+                index_name=data.index.name,
+            )
+        )
+        if schema is None:
+            # (with the pandas metadata of the columns)
+            schema = pa.Schema.from_pandas(
+                data.rename_axis(_INDEX_COLUMN).reset_index(), preserve_index=False
+            )
+
+        # the columns one by one (quicker than a frame per chunk):
+        arrays = [pa.Array.from_pandas(data.index)] + [
+            pa.Array.from_pandas(data[column]) for column in data.columns
+        ]
+        if [_INDEX_COLUMN] + list(data.columns) != schema.names or any(
+            not array.type.equals(field.type) for array, field in zip(arrays, schema)
+        ):
+            msg = "The chunks do not all have the same columns (and types)!"
+            logger.error(msg)
+            raise Exception(msg)
+        batches.append(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    if schema is None:
+        schema = pa.schema([])
+
+    metadata = dict(schema.metadata or {})
+    metadata[_METADATA_KEY] = json.dumps(
+        dict(version=FORMAT_VERSION, chunks=chunks)
+    ).encode()
+    schema = schema.with_metadata(metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            # (one record batch per chunk)
+            writer.write_batch(batch)
+
+    return compress_bytes(data=sink.getvalue(), compression=compression)
+
+
+def load_structured_data(data=None):
+    """
+    Deserialize the bytes of "dump_structured_data" into a (lazy) list of
+    "StructuredData" chunks. Lists pickled by earlier versions of the
+    pipestore are unpickled.
+    """
+    data = decompress_bytes(data=data)
+    if not bytes(data[: len(_MAGIC)]) == _MAGIC:
+        return pickle.loads(data)
+
+    return StructuredDataChunks(data=data)
+
+
+def compress_bytes(data=None, compression="zstd"):
+    """
+    Compress "data" (bytes or an Arrow buffer) as a whole with the codec
+    "compression" ("zstd", "lz4", ... or None to leave it as it is), behind
+    a small header for "decompress_bytes".
+    """
+    if compression is None:
+        return data.to_pybytes() if isinstance(data, pa.Buffer) else bytes(data)
+
+    header = _COMPRESSED_HEADER.pack(_COMPRESSED_MAGIC, compression.encode(), len(data))
+    return header + pa.compress(data, codec=compression, asbytes=True)
+
+
+def decompress_bytes(data=None):
+    """Undo "compress_bytes": return the data (an Arrow buffer if it was
+    compressed, else "data" as it is)."""
+    if bytes(data[: len(_COMPRESSED_MAGIC)]) != _COMPRESSED_MAGIC:
+        return data
+
+    magic, codec, size = _COMPRESSED_HEADER.unpack_from(data)
+    return pa.decompress(
+        pa.py_buffer(data)[_COMPRESSED_HEADER.size :],
+        decompressed_size=size,
+        codec=codec.rstrip(b"\0").decode(),
+    )
+
+
+class StructuredDataChunks(Sequence):
+    """
+    Read-only list of the "StructuredData" chunks in the (decompressed)
+    bytes of "dump_structured_data". A chunk is only built when first
+    accessed.
+
+    The data matrices view the Arrow buffers: they are read-only, copy them
+    to write into them.
+    """
+
+    _data = None
+    _reader = None
+    _chunks = None
+    _structured_data = None
+
+    def __init__(self, data=None):
+        """
+        :param data: bytes (or any buffer) from "dump_structured_data".
+        """
+        self._data = data
+        self._reader = pa.ipc.open_file(pa.py_buffer(data))
+
+        metadata = self._reader.schema.metadata or {}
+        if _METADATA_KEY not in metadata:
+            msg = "These are not structured data chunks!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        metadata = json.loads(metadata[_METADATA_KEY])
+        if metadata["version"] > FORMAT_VERSION:
+            msg = (
+                f"The structured data chunks are of format version "
+                f"{metadata['version']}; this version reads up to "
+                f"{FORMAT_VERSION}!"
+            )
+            logger.error(msg)
+            raise Exception(msg)
+
+        self._chunks = metadata["chunks"]
+        if len(self._chunks) != self._reader.num_record_batches:
+            msg = "The table of chunks does not match the data!"
+            logger.error(msg)
+            raise Exception(msg)
+
+        self._structured_data = [None] * len(self._chunks)
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            return [self[j] for j in range(len(self))[ix]]
+
+        ix = range(len(self))[ix]  # (negative indices and bounds)
+        if self._structured_data[ix] is None:
+            self._structured_data[ix] = self._read_chunk(ix=ix)
+
+        return self._structured_data[ix]
+
+    def __reduce__(self):
+        return StructuredDataChunks, (bytes(self._data),)
+
+    @property
+    def number_of_points(self):
+        """Number of points in each chunk (without reading the chunks)."""
+        return [chunk["number_of_points"] for chunk in self._chunks]
+
+    def _read_chunk(self, ix=None):
+        chunk = self._chunks[ix]
+        batch = self._reader.get_batch(ix)
+        assert batch.num_rows == chunk["number_of_points"]
+
+        index = pd.Index(
+            batch.column(_INDEX_COLUMN).to_pandas().array, name=chunk["index_name"]
+        )
+        # (all columns but the index, keeping the pandas metadata)
+        schema = pa.schema(list(batch.schema)[1:], metadata=batch.schema.metadata)
+        data = pa.RecordBatch.from_arrays(batch.columns[1:], schema=schema).to_pandas(
+            split_blocks=True
+        )
+        data.index = index
+
+        structured_data = StructuredData(
+            data=data, data_format_code=chunk["data_format_code"]
+        )
+        structured_data._name = chunk["name"]
+        return structured_data
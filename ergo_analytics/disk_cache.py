@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+A size-limited cache of files in a folder on the local disk. Files are
+written atomically and evicted least-recently-used first.
+
+@ author Iterate Labs, Inc.
+Copyright 2018 Iterate Labs, Inc.
+"""
+
+__all__ = ["DiskLRUCache"]
+__author__ = "Iterate Labs, Inc."
+__version__ = "Alpha"
+
+from collections import OrderedDict
+import os
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger()
+
+
+class DiskLRUCache(object):
+    """
+    Holds bytes under (relative path) keys in "directory". When the files
+    take up more than "max_bytes" the least recently used ones are deleted.
+    The modification time of a file is its time of last use.
+
+    The files (in order of use) and their total size are kept in memory -
+    read from the folder once per process and shared by the caches on it -
+    so storing a file does not look at all the others. Files another
+    process adds are only counted from the next process on.
+    """
+
+    _directory = None
+    _max_bytes = None
+    _index = None  # (see "_Index")
+
+    # process-wide indices (per directory), shared by all caches:
+    _indices = dict()
+    _indices_lock = threading.Lock()
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        :param directory: folder of the cache (created if needed).
+        :param max_bytes: keep the cache below this size; None for no limit.
+        """
+        if directory is None:
+            raise Exception("Please provide a directory for the cache!")
+
+        self._directory = os.path.abspath(os.path.expanduser(directory))
+        self._max_bytes = None if max_bytes is None else int(max_bytes)
+
+        os.makedirs(self._directory, exist_ok=True)
+
+        with self._indices_lock:
+            if self._directory not in self._indices:
+                files = sorted(self._files(), key=lambda file: file[2])
+                self._indices[self._directory] = _Index(
+                    files=[(path, size) for path, size, _ in files]
+                )
+            self._index = self._indices[self._directory]
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def path(self, key=None):
+        """Return the path of the file holding "key"."""
+        return os.path.join(self._directory, *key.split("/"))
+
+    def get(self, key=None):
+        """Return the bytes under "key" or None if not in the cache."""
+        path = self.path(key=key)
+        try:
+            with open(path, "rb") as fd:
+                data = fd.read()
+        except FileNotFoundError:
+            self._index.remove(path=path)
+            return None
+
+        self._touch(path=path)
+        self._index.add(path=path, size=len(data))
+        return data
+
+    def put(self, key=None, data=None):
+        """Store "data" (bytes) under "key", then evict if needed."""
+        path = self.path(key=key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file next to the target and move it in place
+        # so readers never see a partially written file:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._index.add(path=path, size=len(data))
+        self.evict()
+
+    def delete(self, key=None):
+        path = self.path(key=key)
+        self._index.remove(path=path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key=key))
+
+    def size(self):
+        """Total number of bytes in the cache."""
+        return self._index.size
+
+    def evict(self):
+        """Delete least recently used files until below "max_bytes"."""
+        if self._max_bytes is None or self._index.size <= self._max_bytes:
+            return
+
+        for path in self._index.pop_least_recently_used(max_bytes=self._max_bytes):
+            try:
+                os.remove(path)
+                logger.debug(f"Evicted '{path}' from the cache.")
+            except FileNotFoundError:
+                pass
+
+    def _files(self):
+        """(path, size, last used) of all files in the cache."""
+        for root, _, names in os.walk(self._directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _touch(path=None):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+
+class _Index(object):
+    """The files of a cache - path -> size, least recently used first - and
+    their total size."""
+
+    _lock = None
+    _files = None
+    size = None
+
+    def __init__(self, files=None):
+        """
+        :param files: list of (path, size), least recently used first.
+        """
+        self._lock = threading.Lock()
+        self._files = OrderedDict(files or [])
+        self.size = sum(self._files.values())
+
+    def add(self, path=None, size=None):
+        """Add (or update) a file as the most recently used."""
+        with self._lock:
+            self.size += size - self._files.pop(path, 0)
+            self._files[path] = size
+
+    def remove(self, path=None):
+        with self._lock:
+            self.size -= self._files.pop(path, 0)
+
+    def pop_least_recently_used(self, max_bytes=None):
+        """Remove the least recently used files until the rest take up at
+        most "max_bytes"; return their paths."""
+        paths = []
+        with self._lock:
+            while self.size > max_bytes and len(self._files) > 0:
+                path, size = self._files.popitem(last=False)
+                self.size -= size
+                paths.append(path)
+        return paths
@@ -18,6 +18,8 @@ from constants import DATA_FORMAT_CODES
 class AddDegrees(BaseTransformation):
     """This filter can add an arbitrary amount of degrees to the data."""
 
+    pointwise = True
+
     def __init__(self):
         super().__init__()
 
@@ -38,11 +40,12 @@ class AddDegrees(BaseTransformation):
         else:
             return data, {}
 
-        data_transformed = data.copy()
+        # only the columns added to are new arrays; the rest are shared:
+        data_transformed = data.copy(deep=False)
         operate_on_columns = []
         for col in dict_add_this:
             if col in data:
-                data_transformed.loc[:, col] += dict_add_this[col]
+                data_transformed[col] = data[col] + dict_add_this[col]
                 operate_on_columns.append(col)
 
         return (
@@ -25,6 +25,20 @@ class BaseTransformation(object):
     _initial_data = None
     _params = None
 
+    # does the filter pass information from one chunk of data to the next
+    # (via its parameters)? If no filter in a pipeline does, the pipeline
+    # can process the chunks in parallel:
+    carries_state_between_chunks = False
+
+    # is each row of the output computed from the same row of the input
+    # alone (no rows added or removed)? Then applying the filter to all of
+    # the data at once gives the same rows as applying it chunk by chunk:
+    pointwise = False
+
+    # does the filter write into the arrays of the data it is given? Then
+    # the pipeline hands it a copy; other filters get views of the chunk:
+    mutates_input = False
+
     def __init__(self, params=None):
 
         # set default params:
@@ -29,6 +29,9 @@ class ConstructDeltaValues(BaseTransformation):
     the device immediately.
     """
 
+    # the delta angles of a row only depend on the angles of that row:
+    pointwise = True
+
     def __init__(self):
         """
         Construct the standard deviation filter.
@@ -80,11 +83,13 @@ class ConstructDeltaValues(BaseTransformation):
                 )
                 delta_angles.append(delta_angle_tmp)
 
-            delta_angles = np.asarray(delta_angles)
+            # keep the precision of the incoming angles (see "dtype_policy"):
+            delta_angles = np.asarray(delta_angles, dtype=data["Yaw[0](deg)"].dtype)
 
-            data.loc[:, "DeltaYaw"] = delta_angles[:, 0]
-            data.loc[:, "DeltaPitch"] = delta_angles[:, 1]
-            data.loc[:, "DeltaRoll"] = delta_angles[:, 2]
+            # (new columns: the arrays of the incoming data are not written to)
+            data["DeltaYaw"] = delta_angles[:, 0]
+            data["DeltaPitch"] = delta_angles[:, 1]
+            data["DeltaRoll"] = delta_angles[:, 2]
 
         elif params["data_format_code"] == "4":
             # already in delta-angle format
@@ -59,8 +59,7 @@ class WindowOfRelevantDataFilter(BaseTransformation):
 
         operate_on_columns = DATA_FORMAT_CODES[params["data_format_code"]]["NUMERICS"]
 
-        data_to_use = data.copy()
-        data_to_use = data_to_use.loc[
+        data_to_use = data.loc[
             params["from_this_index"] : params["till_this_index"], operate_on_columns
         ]
         data_to_use = data_to_use.iloc[
@@ -25,6 +25,20 @@ class Preprocess(BaseTransformation):
     def __init__(self):
         super().__init__()
 
+    @property
+    def pointwise(self):
+        """Only converting the timestamps is row-wise (cutting to an index
+        range or making up timestamps depends on the chunk)."""
+        params = self._params
+        return params.get("index_range", None) is None and not params.get(
+            "force_new_timestamps", False
+        )
+
+    @property
+    def mutates_input(self):
+        """Making up timestamps overwrites those of the data."""
+        return self._params.get("force_new_timestamps", False)
+
     def _initialize_params(self):
         super()._initialize_params()
         self._params.update(**dict(index_range=None))
@@ -26,6 +26,8 @@ class QuadrantFilter(BaseTransformation):
     times due primarily to Gimball lock.
     """
 
+    pointwise = True
+
     def __init__(self):
         super().__init__()
 
@@ -23,6 +23,11 @@ class ZeroShiftFilter(BaseTransformation):
     Find and correct apparent zero-shifts in the data.
     """
 
+    # the final zero line of a chunk is passed on to the next chunk:
+    carries_state_between_chunks = True
+    # (the zero-shifts are corrected in place)
+    mutates_input = True
+
     def __init__(self):
         super().__init__()
 
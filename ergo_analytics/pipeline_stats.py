@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+What a run of the data filter pipeline cost: for each filter in each chunk
+the wall time, the rows in and out, the bytes allocated and the copies made
+(see "DataFilterPipeline.run_stats").
+
+@ author Iterate Labs, Inc.
+Copyright 2018- Iterate Labs, Inc.
+All Rights Reserved.
+"""
+
+__all__ = ["PipelineRunStats"]
+__author__ = "Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import json
+import logging
+
+logger = logging.getLogger()
+
+FILTER_STATS = ["wall_time", "rows_in", "rows_out", "bytes_allocated", "copies"]
+
+
+class PipelineRunStats(object):
+    """
+    The cost of each filter in each chunk of a pipeline run.
+
+    Each chunk is a dict with the chunk number ("chunk"; None for the filters
+    applied to all of the data before chunking), whether it was reused from
+    an earlier run ("memoized") and a list of the filters run on it
+    ("filters"), each a dict with the filter name and:
+        wall_time: seconds spent in the filter.
+        rows_in, rows_out: rows of the data going in and coming out.
+        bytes_allocated: bytes of the columns the filter made anew (copied
+        or computed).
+        copies: copies of all of the data made before the filter (as it
+        writes into the data; see "BaseTransformation.mutates_input").
+    """
+
+    _chunks = None
+    wall_time = None  # of the whole run, in seconds
+    found_in_pipestore = None
+
+    def __init__(self):
+        self._chunks = []
+        self.found_in_pipestore = False
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def number_of_chunks(self):
+        return sum(1 for chunk in self._chunks if chunk["chunk"] is not None)
+
+    @property
+    def memoized_chunks(self):
+        return sum(1 for chunk in self._chunks if chunk["memoized"])
+
+    def add_chunk(self, filters=None, memoized=False, applied_to_all=False):
+        """
+        Record a chunk (numbered in the order added).
+
+        :param filters: list of the stats of the filters run on it.
+        :param memoized: was the chunk reused from an earlier run?
+        :param applied_to_all: were the filters applied to all of the data
+        (before chunking) instead?
+        """
+        self._chunks.append(
+            dict(
+                chunk=None if applied_to_all else self.number_of_chunks + 1,
+                memoized=memoized,
+                filters=list(filters or []),
+            )
+        )
+
+    def by_filter(self):
+        """Return the stats of each filter summed over the chunks - a dict of
+        filter name -> dict with the sums, the number of chunks ("calls")
+        and the share of the time in all filters ("time_share")."""
+        totals = dict()
+        for chunk in self._chunks:
+            for stats in chunk["filters"]:
+                if stats["filter"] not in totals:
+                    totals[stats["filter"]] = dict.fromkeys(FILTER_STATS, 0)
+                    totals[stats["filter"]]["calls"] = 0
+                for key in FILTER_STATS:
+                    totals[stats["filter"]][key] += stats[key]
+                totals[stats["filter"]]["calls"] += 1
+
+        total_time = sum(stats["wall_time"] for stats in totals.values())
+        for stats in totals.values():
+            stats["time_share"] = (
+                stats["wall_time"] / total_time if total_time > 0 else 0.0
+            )
+
+        return totals
+
+    def to_dict(self):
+        return dict(
+            wall_time=self.wall_time,
+            found_in_pipestore=self.found_in_pipestore,
+            number_of_chunks=self.number_of_chunks,
+            memoized_chunks=self.memoized_chunks,
+            filters=self.by_filter(),
+            chunks=self._chunks,
+        )
+
+    def to_json(self, path=None, indent=2):
+        """
+        Return the stats (see "to_dict") as JSON.
+
+        :param path: also write them to this file.
+        """
+        stats = json.dumps(self.to_dict(), indent=indent)
+        if path is not None:
+            with open(path, "w") as fd:
+                fd.write(stats)
+        return stats
+
+    def __repr__(self):
+        slowest = sorted(
+            self.by_filter().items(), key=lambda item: -item[1]["wall_time"]
+        )
+        filters = ", ".join(
+            f"{name}: {stats['wall_time']:.3f} s" for name, stats in slowest
+        )
+        return (
+            f"<PipelineRunStats {self.number_of_chunks} chunks "
+            f"({self.memoized_chunks} memoized); {filters}>"
+        )
@@ -5,7 +5,15 @@
 Copyright 2018 Iterate Labs, Inc.
 """
 
-__all__ = ["is_numeric", "digitize_values", "rad_to_deg", "subsample_data"]
+__all__ = [
+    "is_numeric",
+    "digitize_values",
+    "rad_to_deg",
+    "subsample_data",
+    "subsample_stream",
+    "DTYPE_POLICIES",
+    "apply_dtype_policy",
+]
 __author__ = "Jesper Kristensen"
 __copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
 __version__ = "Alpha"
@@ -18,11 +26,21 @@ from numpy import array_split
 from numpy import arange
 from numpy import median
 from numpy import where
+from numpy import float32
+from numpy import float64
 from numpy.random import choice
+from pandas import concat
+from pandas import to_datetime
+from pandas.api.types import is_datetime64_any_dtype
+from pandas.api.types import is_float_dtype
 
 logger = logging.getLogger()
 BSAFE_PATH = "."
 
+# how to store the data: the dtype of the (angle) float columns by policy -
+# "compact" halves the memory of long recordings:
+DTYPE_POLICIES = {"default": float64, "compact": float32}
+
 
 def subsample_data(
     data=None,
@@ -166,6 +184,38 @@ def subsample_data(
             yield data.iloc[ix : ix + subsample_size_index], dict()
 
 
+def subsample_stream(chunks=None, subsample_size_index=1000, exact_chunk_size=True):
+    """
+    The streaming counterpart of "subsample_data" with consecutive
+    subsamples: "chunks" is an iterable of dataframes (for example from
+    "LoadElasticSearch.retrieve_data_iter") which are re-cut into consecutive
+    subsamples of "subsample_size_index" rows while holding no more than one
+    subsample (plus one incoming chunk) in memory at a time.
+
+    Yields the same (subsample, info) pairs as "subsample_data" would on all
+    the chunks concatenated.
+    """
+    subsample_size_index = int(subsample_size_index)
+
+    buffer = None
+    number_yielded = 0
+    for chunk in chunks:
+        buffer = chunk if buffer is None else concat([buffer, chunk])
+
+        while len(buffer) >= subsample_size_index:
+            yield buffer.iloc[:subsample_size_index], dict()
+            number_yielded += 1
+            buffer = buffer.iloc[subsample_size_index:]
+
+    if buffer is None:
+        return
+
+    # like "subsample_data" we always return at least one subsample and
+    # only return a partial subsample at the end when it is not exact:
+    if number_yielded == 0 or (not exact_chunk_size and len(buffer) > 0):
+        yield buffer, dict()
+
+
 def is_numeric(val):
     """
     Check that a value is numeric.
@@ -206,3 +256,42 @@ def rad_to_deg(data=None):
     :return: data with values converted to degrees.
     """
     return degrees(data)
+
+
+def apply_dtype_policy(data=None, dtype_policy="default", time_column="Date-Time"):
+    """
+    Cast the float columns of "data" to the dtype of "dtype_policy" (see
+    "DTYPE_POLICIES") and make sure the time column holds int64 nanoseconds
+    (datetime64) rather than timestamp objects. Columns already of the
+    right dtype are not copied.
+
+    :param data: pd.DataFrame.
+    :param dtype_policy: "default" (float64) or "compact" (float32).
+    :return: pd.DataFrame following the policy.
+    """
+    if dtype_policy is None:
+        dtype_policy = "default"
+    if dtype_policy not in DTYPE_POLICIES:
+        msg = (
+            f"Unknown dtype policy '{dtype_policy}'! "
+            f"Valid options: {list(DTYPE_POLICIES)}"
+        )
+        logger.error(msg)
+        raise Exception(msg)
+
+    dtype = DTYPE_POLICIES[dtype_policy]
+    dtypes = {
+        column: dtype
+        for column in data.columns
+        if is_float_dtype(data[column]) and data[column].dtype != dtype
+    }
+    if len(dtypes) > 0:
+        data = data.astype(dtypes, copy=False)
+
+    if time_column in data and not is_datetime64_any_dtype(data[time_column]):
+        try:
+            data = data.assign(**{time_column: to_datetime(data[time_column])})
+        except (ValueError, TypeError) as e:
+            logger.debug(f"Leaving the '{time_column}' column as is: {e}")
+
+    return data
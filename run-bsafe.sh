@@ -6,6 +6,15 @@
 #export INPUT_S3_PATH=s3://mindy-iteratelabs-phone-data/NEWFACTORY/raw/2021/12/19/C0:D7:06:E5:78:5F/C0_D7_06_E5_78_5F_20211209_67
 # export INPUT_S3_PATH=s3://mindy-iteratelabs-phone-data/NEWFACTORY/raw/2021/12/19/C0:D7:06:E5:78:5F/56_22_5B_23_5E_B6.crash
 #export OUTPUT_S3=mindy-iteratelabs-bsafe-data
+# with PIPESTORE_LOCAL_DIR set the pipestore keeps results on the local disk
+# in front of OUTPUT_S3 ("local" skips S3 - the default when only
+# PIPESTORE_LOCAL_DIR is set):
+#export PIPESTORE_MODE=s3
+#export PIPESTORE_LOCAL_DIR=~/.cache/bsafe/pipestore
+#export PIPESTORE_LOCAL_MAX_BYTES=1000000000
+#export PIPESTORE_UPLOAD_WORKERS=2
+#export PIPESTORE_UPLOAD_MAX_PENDING=16
+#export PIPESTORE_UPLOAD_MAX_ATTEMPTS=5
 export GIT_PYTHON_REFRESH=quiet
 #export INFINITY_GAUNTLET_PASSWORD=Lc6PS3!SD_XJ-34H
 #export INFINITY_GAUNTLET_URL=https://api.mentore.iteratelabs.co
@@ -16,6 +25,16 @@ set
 function urldecode() { : "${*//+/ }"; echo -e "${_//%/\\x}"; }
 file=`urldecode $file`
 
+# score a batch of files in one process pool (a manifest file listing them
+# or a glob like s3://bucket/raw/2021/12/19/*/*):
+if [ -n "$INPUT_S3_MANIFEST" ]; then
+  echo "______________________________________"
+  echo "run pipenv run python3 run_v2.py --manifest $INPUT_S3_MANIFEST "
+  echo "______________________________________"
+  pipenv run python3 run_v2.py --manifest "$INPUT_S3_MANIFEST" --status-file bsafe_batch_status.jsonl
+  exit $?
+fi
+
 echo "______________________________________"
 echo "run pipenv run python3 run_v2.py $file "
 echo "______________________________________"
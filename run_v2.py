@@ -1,4 +1,10 @@
+
 import os
+import sys
+import glob
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from ergo_analytics.metrics import AngularActivityScore, PostureScore
 from productivity import active_score
 from app.api_client import ApiClient
@@ -13,68 +19,322 @@ from ergo_analytics import (
 from ergo_analytics.filters import ConstructDeltaValues, QuadrantFilter
 from productivity.active_score import ActiveScore
 import argparse
-parser = argparse.ArgumentParser(description='Bsafe')
-parser.add_argument('pos_arg', type=str,
-                    help='S3 Data File Location')
-
-args = parser.parse_args()
-api_client = ApiClient()
-
 
 #file = 's3://sqs-asg-s3bucket-1mdwlg73hw49m/raw/2021/04/14/F9:9D:BD:50:ED:23/F9:9D:BD:50:ED:23_2021314_13'
 #s3://mindy-iteratelabs-phone-data/NEWFACTORY/raw/2021/12/19/C0:D7:06:E5:78:5F/C0_D7_06_E5_78_5F_20211209_67
-file = args.pos_arg
-mac_address = file.split('/')[-2].split('/')[-1]
-print ("Working with mac_address" +mac_address)
 
+data_format_code = "5"
+names = ["Date-Time","Yaw[0](deg)","Pitch[0](deg)","Roll[0](deg)","Yaw[1](deg)","Pitch[1](deg)","Roll[1](deg)"]
 
-run_as_test = bool(os.getenv("RUN_AS_TEST", False))
+# the API client of a batch worker (see "_init_worker"):
+_api_client = None
 
-data_format_code = "5"
-test_data = pd.read_csv(file,names=["Date-Time","Yaw[0](deg)","Pitch[0](deg)","Roll[0](deg)","Yaw[1](deg)","Pitch[1](deg)","Roll[1](deg)"])
-
-#
-pipeline = DataFilterPipeline()
-pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
-pipeline.add_filter(name="quadrant", filter=QuadrantFilter())
-
-list_of_structured_data_chunks = pipeline.run(
-    on_raw_data=test_data,
-    with_format_code=data_format_code,
-    is_sorted=True,
-    use_subsampling=True,
-    subsample_size_index=600,
-    number_of_subsamples=15,
-    randomize_subsampling=False,
-)
 
-delta_only_pipeline = DataFilterPipeline(verify_pipeline=False)
-delta_only_pipeline.add_filter(
-    name="construct-delta", filter=ConstructDeltaValues()
-)
-structured_all_data = delta_only_pipeline.run(
-    on_raw_data=test_data, with_format_code=data_format_code, use_subsampling=False,
-)[0].data_matrix
+def score_file(
+    file=None,
+    chunksize=None,
+    api_client=None,
+    run_as_test=False,
+    chunk_workers=1,
+    chunk_executor="process",
+):
+    """Score the data in "file" and send the report (to "api_client").
 
-metrics = ErgoMetrics(
-    list_of_structured_data_chunks=list_of_structured_data_chunks,
-    structured_all_data=structured_all_data,
-)
+    :param chunksize: stream the file in blocks of this many rows (default:
+    read the whole file at once).
+    :param chunk_workers: process the chunks of the file in parallel with
+    this many workers (see "DataFilterPipeline.run").
+    :param chunk_executor: "process" or "thread" - what those workers are.
+    """
+    mac_address = file.split('/')[-2].split('/')[-1]
+    print ("Working with mac_address" +mac_address)
+
+    #
+    pipeline = DataFilterPipeline()
+    if chunksize is None:
+        # (streamed, the delta values are constructed as the file is read)
+        pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+    pipeline.add_filter(name="quadrant", filter=QuadrantFilter())
+
+    if chunksize is None:
+        test_data = pd.read_csv(file,names=names)
+
+        delta_only_pipeline = DataFilterPipeline(verify_pipeline=False)
+        delta_only_pipeline.add_filter(
+            name="construct-delta", filter=ConstructDeltaValues()
+        )
+
+        # the delta values are constructed once for both pipelines:
+        list_of_structured_data_chunks, structured_all_data = DataFilterPipeline.run_many(
+            runs=[
+                (
+                    pipeline,
+                    dict(
+                        is_sorted=True,
+                        use_subsampling=True,
+                        subsample_size_index=600,
+                        number_of_subsamples=15,
+                        randomize_subsampling=False,
+                        max_workers=chunk_workers,
+                        executor=chunk_executor,
+                    ),
+                ),
+                (delta_only_pipeline, dict(use_subsampling=False)),
+            ],
+            on_raw_data=test_data,
+            with_format_code=data_format_code,
+        )
+        structured_all_data = structured_all_data[0].data_matrix
+    else:
+        # stream the file: only one block of raw data (plus one subsample) is
+        # in memory at a time. The delta values are constructed once, into
+        # each block as it is read (they only depend on the row), so the
+        # pipeline starts after them. Of them we keep what the productivity
+        # metrics need over the whole file:
+        delta_values = []
+
+        def construct_delta_values(blocks):
+            construct_delta = ConstructDeltaValues()
+            for block in blocks:
+                block, _ = construct_delta.apply(
+                    data=block, parameters={"data_format_code": data_format_code}
+                )
+                delta_values.append(block[["Date-Time", "DeltaYaw", "DeltaPitch", "DeltaRoll"]])
+                yield block
+
+        # consecutive subsamples are cut (and scored) as the rows arrive:
+        list_of_structured_data_chunks = pipeline.run(
+            on_raw_data=construct_delta_values(pd.read_csv(file, names=names, chunksize=chunksize)),
+            with_format_code=data_format_code,
+            is_sorted=True,
+            use_subsampling=True,
+            subsample_size_index=600,
+            consecutive_subsamples=True,
+            randomize_subsampling=False,
+            max_workers=chunk_workers,
+            executor=chunk_executor,
+        )
+        structured_all_data = pd.concat(delta_values, ignore_index=True)
+
+    metrics = ErgoMetrics(
+        list_of_structured_data_chunks=list_of_structured_data_chunks,
+        structured_all_data=structured_all_data,
+    )
+
+    metrics.add(AngularActivityScore)
+    metrics.add(PostureScore)
+    metrics.compute()
+
+    reporter = ErgoReport(ergo_metrics=metrics)
+
+    # test that we are sending the correct format:
+    payload = reporter.to_http(api_client=api_client,
+                mac_address=mac_address,
+                run_as_test=run_as_test,)
+
+    return payload
+
+
+def read_manifest(manifest=None):
+    """The files to score: "manifest" is either a file listing them (one per
+    line, blank lines and lines starting with "#" are skipped) or a glob
+    such as "s3://bucket/raw/2021/12/19/*/*" or "data/*.csv".
+    """
+    if os.path.isfile(manifest):
+        with open(manifest) as fd:
+            files = [line.strip() for line in fd]
+        files = [f for f in files if f and not f.startswith("#")]
+    elif manifest.startswith("s3://"):
+        import s3fs
+
+        fs = s3fs.S3FileSystem()
+        files = ["s3://" + f for f in sorted(fs.glob(manifest))]
+    else:
+        files = sorted(glob.glob(manifest))
+
+    # each file once (in the order given):
+    return list(dict.fromkeys(files))
+
+
+def _init_worker():
+    """Set up a batch worker process once (not once per file)."""
+    global _api_client
+    _api_client = ApiClient()
+
+
+def _score_in_worker(
+    file=None, chunksize=None, run_as_test=False, chunk_workers=1
+):
+    start = time.time()
+    try:
+        # (threads: this is a worker process of the batch already)
+        score_file(
+            file=file,
+            chunksize=chunksize,
+            api_client=_api_client,
+            run_as_test=run_as_test,
+            chunk_workers=chunk_workers,
+            chunk_executor="thread",
+        )
+        status, error = "ok", None
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+
+    return dict(file=file, status=status, seconds=time.time() - start, error=error)
+
+
+def _read_status_file(status_file=None):
+    """The latest status of each file in "status_file" (JSON lines)."""
+    statuses = dict()
+    if status_file is None or not os.path.isfile(status_file):
+        return statuses
+
+    with open(status_file) as fd:
+        for line in fd:
+            if line.strip():
+                status = json.loads(line)
+                statuses[status["file"]] = status
+
+    return statuses
+
+
+def run_batch(
+    files=None,
+    workers=None,
+    retries=2,
+    chunksize=None,
+    run_as_test=False,
+    status_file=None,
+    chunk_workers=1,
+):
+    """Score "files" in a pool of "workers" processes (default: one per CPU),
+    each set up once, and retry the files that failed up to "retries" times.
+
+    :param chunk_workers: threads processing the chunks of each file (see
+    "score_file").
+    :param status_file: the status of each file is appended here as it
+    finishes (JSON lines); files already completed in it are not scored
+    again, so a batch can be re-run to only redo what failed.
+    :return: dict of file -> dict(status, seconds, attempt, error).
+    """
+    statuses = _read_status_file(status_file=status_file)
+    todo = [f for f in files if statuses.get(f, {}).get("status") != "ok"]
+    if len(todo) < len(files):
+        print(f"Skipping {len(files) - len(todo)} files already scored.")
+
+    for attempt in range(1, retries + 2):
+        if len(todo) == 0:
+            break
+
+        # a fresh pool per round (a crashed worker breaks its pool):
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _score_in_worker,
+                    file=f,
+                    chunksize=chunksize,
+                    run_as_test=run_as_test,
+                    chunk_workers=chunk_workers,
+                ): f
+                for f in todo
+            }
+            for future in as_completed(futures):
+                try:
+                    status = future.result()
+                except Exception as e:
+                    # the worker died:
+                    status = dict(
+                        file=futures[future],
+                        status="failed",
+                        seconds=None,
+                        error=f"{type(e).__name__}: {e}",
+                    )
+                status["attempt"] = attempt
+                statuses[status["file"]] = status
+                print(
+                    f"[{status['status']}] {status['file']} "
+                    f"(attempt {attempt}, {status['seconds'] or 0:.1f}s)"
+                    + (f": {status['error']}" if status["error"] else "")
+                )
+
+                if status_file is not None:
+                    with open(status_file, "a") as fd:
+                        fd.write(json.dumps(status) + "\n")
+
+        todo = [f for f in todo if statuses[f]["status"] != "ok"]
+
+    return {f: statuses[f] for f in files}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Bsafe')
+    parser.add_argument('pos_arg', type=str, nargs='?',
+                        help='S3 Data File Location')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Stream the file in blocks of this many rows '
+                             '(default: read the whole file at once)')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Score a batch: a file listing the files '
+                             '(one per line) or a glob like s3://bucket/raw/*/*')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes scoring the batch (default: one per CPU)')
+    parser.add_argument('--chunk-workers', type=int, default=1,
+                        help='Process the chunks of each file in parallel '
+                             'with this many workers (default: 1, in order)')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='How often to retry files that failed')
+    parser.add_argument('--status-file', type=str, default=None,
+                        help='Append the status of each file here (JSON lines); '
+                             'files completed in it are skipped')
+
+    args = parser.parse_args(args)
+
+    run_as_test = bool(os.getenv("RUN_AS_TEST", False))
+
+    if args.manifest is None:
+        if args.pos_arg is None:
+            parser.error("Please provide a file or a --manifest!")
+
+        file = args.pos_arg
+        payload = score_file(
+            file=file,
+            chunksize=args.chunksize,
+            api_client=ApiClient(),
+            run_as_test=run_as_test,
+            chunk_workers=args.chunk_workers,
+        )
+
+        print(file)
+        print(payload)
+        return
+
+    files = read_manifest(manifest=args.manifest)
+    print(f"Scoring {len(files)} files.")
 
-metrics.add(AngularActivityScore)
-metrics.add(PostureScore)
-metrics.compute()
+    start = time.time()
+    statuses = run_batch(
+        files=files,
+        workers=args.workers,
+        retries=args.retries,
+        chunksize=args.chunksize,
+        run_as_test=run_as_test,
+        status_file=args.status_file,
+        chunk_workers=args.chunk_workers,
+    )
 
-reporter = ErgoReport(ergo_metrics=metrics)
+    failed = [f for f in files if statuses[f]["status"] != "ok"]
+    print(
+        f"Scored {len(files) - len(failed)} of {len(files)} files "
+        f"in {time.time() - start:.1f}s."
+    )
+    for f in failed:
+        print(f"FAILED: {f}: {statuses[f]['error']}")
 
-# test that we are sending the correct format:
-payload = reporter.to_http(api_client=api_client,
-            mac_address=mac_address,
-            run_as_test=run_as_test,)
+    if len(failed) > 0:
+        sys.exit(1)
 
-print(file)
-print(payload)
 
-#for k in payload:
-#    print(k, payload[k])
-#print(" ")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Fixtures shared by the tests.
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import pytest
+from ergo_analytics import DataFilterPipeline
+
+
+@pytest.fixture(autouse=True)
+def local_pipestore(tmp_path, monkeypatch):
+    """Give each test a pipestore on the local disk of its own, so nothing
+    is found in it that an earlier test (or run) put there."""
+    monkeypatch.delenv("PIPESTORE_MODE", raising=False)
+    monkeypatch.setenv("PIPESTORE_LOCAL_DIR", str(tmp_path / "pipestore"))
+    return tmp_path / "pipestore"
+
+
+@pytest.fixture
+def pipestore_uploads(monkeypatch):
+    """Run pipelines without the pipestore: nothing is found in it, and what
+    would be uploaded is collected in the dict returned (hash -> data)."""
+    uploads = dict()
+    monkeypatch.setattr(
+        DataFilterPipeline,
+        "check_pipestore",
+        lambda self, data=None, options=None: (
+            False,
+            None,
+            self.get_pipestore_hash(data=data, options=options),
+        ),
+    )
+    monkeypatch.setattr(
+        DataFilterPipeline,
+        "_upload_to_pipestore",
+        lambda self, hash=None, data=None: uploads.update({hash: data}),
+    )
+    return uploads
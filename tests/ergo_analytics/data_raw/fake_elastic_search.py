@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+A small in-memory Elastic Search "server" that plugs into the official
+Elastic Search client as its connection class. It understands just enough
+of the search, scroll, count and alias APIs (including sliced scrolls) for
+us to test our data loaders without a running Elastic Search database.
+
+Example:
+>> FakeElasticSearchConnection.reset(documents=[...])
+>> es = Elasticsearch(connection_class=FakeElasticSearchConnection)
+
+@ author Iterate Labs, Inc.
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Iterate Labs, Inc."
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import datetime
+import itertools
+import json
+import threading
+import time
+from elasticsearch import Connection
+from elasticsearch import Elasticsearch
+
+
+class FakeElasticSearchConnection(Connection):
+    """Connection class answering requests from documents held in memory."""
+
+    documents = []  # list of dicts, each with an "_index" key
+    aliases = dict()  # index name -> list of aliases
+    latency = 0  # seconds of (simulated) network latency per request
+    requests = []  # (method, url) of every request made
+
+    _scrolls = dict()
+    _results = dict()  # cached query results: every slice runs the same query
+    _scroll_ids = itertools.count()
+    _lock = threading.Lock()
+
+    @classmethod
+    def reset(cls, documents=None, aliases=None, latency=0):
+        cls.documents = list(documents or [])
+        cls.aliases = dict(aliases or {})
+        cls.latency = latency
+        cls.requests = []
+        cls._scrolls = dict()
+        cls._results = dict()
+
+    @classmethod
+    def client(cls):
+        """Return an Elastic Search client wired to this fake."""
+        return Elasticsearch(hosts=["fake:9200"], connection_class=cls)
+
+    def perform_request(
+        self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None
+    ):
+        with self._lock:
+            self.requests.append((method, url))
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if isinstance(body, bytes):
+            body = body.decode()
+        body = json.loads(body) if body else dict()
+        params = params or dict()
+        path = url.split("?")[0].strip("/").split("/")
+
+        if path == [""]:
+            response = {
+                "version": {"number": "7.10.2", "build_flavor": "default"},
+                "tagline": "You Know, for Search",
+            }
+        elif path[-1] == "_alias":
+            response = {
+                index: {"aliases": {alias: {} for alias in self.aliases[index]}}
+                for index in self.aliases
+            }
+        elif path[-1] == "_count":
+            response = {"count": len(self._find(path[0], body))}
+        elif path[-2:] == ["_search", "scroll"]:
+            if method == "DELETE":
+                response = {"succeeded": True}
+            else:
+                response = self._page(body["scroll_id"], int(body.get("size", 0)))
+        elif path[-1] == "_search":
+            _slice = body.pop("slice", None)
+            key = (path[0], json.dumps(body, sort_keys=True))
+            with self._lock:
+                if key not in self._results:
+                    self._results[key] = self._find(path[0], body)
+                hits = self._results[key]
+            if _slice is not None:
+                hits = hits[_slice["id"] :: _slice["max"]]
+
+            scroll_id = str(next(self._scroll_ids))
+            with self._lock:
+                self._scrolls[scroll_id] = (
+                    hits,
+                    int(params.get("size", body.get("size", 10))),
+                )
+            response = self._page(scroll_id)
+        else:
+            raise NotImplementedError(f"{method} {url}")
+
+        return 200, {"X-Elastic-Product": "Elasticsearch"}, json.dumps(response)
+
+    def _page(self, scroll_id=None, size=0):
+        with self._lock:
+            hits, page_size = self._scrolls.get(scroll_id, ([], 0))
+            page, rest = hits[:page_size], hits[page_size:]
+            self._scrolls[scroll_id] = (rest, page_size)
+        return {
+            "_scroll_id": scroll_id,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": len(hits), "hits": page},
+        }
+
+    def _find(self, index=None, body=None):
+        """Evaluate the query and sort of a search body."""
+        indices = set(index.split(","))
+        documents = [
+            doc
+            for doc in self.documents
+            if (
+                "*" in indices
+                or doc["_index"] in indices
+                or any(
+                    alias in indices for alias in self.aliases.get(doc["_index"], [])
+                )
+            )
+            and self._matches(body.get("query", {"match_all": {}}), doc)
+        ]
+
+        sorts = body.get("sort", [])
+        sort_field = None
+        for sort in [sorts] if isinstance(sorts, (str, dict)) else sorts:
+            field = sort if isinstance(sort, str) else list(sort)[0]
+            if field != "_doc":
+                sort_field = field
+        if sort_field is not None:
+            documents = sorted(documents, key=lambda doc: doc[sort_field])
+
+        return [
+            {
+                "_index": doc["_index"],
+                "_id": str(ix),
+                "_source": {k: v for k, v in doc.items() if k != "_index"},
+                "sort": [doc[sort_field]] if sort_field is not None else None,
+            }
+            for ix, doc in enumerate(documents)
+        ]
+
+    def _matches(self, query=None, doc=None):
+        ((kind, clause),) = query.items()
+
+        if kind == "match_all":
+            return True
+        if kind == "bool":
+            clauses = clause.get("must", []) + clause.get("filter", [])
+            return all(self._matches(q, doc) for q in clauses)
+
+        ((field, value),) = clause.items()
+        doc_value = doc.get(field.replace(".keyword", ""))
+        if kind in ("match", "term"):
+            value = value["query"] if isinstance(value, dict) else value
+            return doc_value == value
+        if kind == "terms":
+            return doc_value in value
+        if kind == "range":
+            doc_value = _as_time(doc_value)
+            return (
+                ("gte" not in value or doc_value >= _as_time(value["gte"]))
+                and ("gt" not in value or doc_value > _as_time(value["gt"]))
+                and ("lte" not in value or doc_value <= _as_time(value["lte"]))
+                and ("lt" not in value or doc_value < _as_time(value["lt"]))
+            )
+
+        raise NotImplementedError(kind)
+
+
+def _as_time(value=None):
+    """Compare dates as dates (not strings) like Elastic Search does."""
+    try:
+        value = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def make_documents(mac_addresses=None, number_per_device=100, index="cassia-test"):
+    """Create format "5" wearable documents, 10 per second, per device."""
+    documents = []
+    for mac_address in mac_addresses:
+        for ix in range(number_per_device):
+            seconds, tenths = divmod(ix, 10)
+            minutes, seconds = divmod(seconds, 60)
+            documents.append(
+                {
+                    "_index": index,
+                    "device": mac_address,
+                    "received_timestamp": (
+                        f"2020-07-15T02:{minutes:02d}:{seconds:02d}.{tenths}00Z"
+                    ),
+                    "wearable_timestamp": ix,
+                    "value": ",".join(str(float(ix + k)) for k in range(6)),
+                }
+            )
+    return documents
@@ -15,7 +15,11 @@ __author__ = "Jesper Kristensen"
 __copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
 __version__ = "Alpha"
 
+import numpy as np
+import pandas as pd
+import pytest
 from ergo_analytics.data_raw import BaseData
+from constants import DATA_FORMAT_CODES
 
 
 def test_base_data():
@@ -31,3 +35,88 @@ def test_base_data():
     #
     bd._data_column_names = []
     assert bd.data_column_names == []
+
+
+def as_strings(data=None, timestamp_format=None, prefix=""):
+    data = data.astype(str)
+    data["Date-Time"] = prefix + pd.Series(TIMES.strftime(timestamp_format))
+    return data
+
+
+TIMES = pd.date_range("2019-07-14 14:27:28.566", periods=1000, freq="10ms")
+DATA = pd.DataFrame(
+    np.round(np.random.RandomState(0).randn(1000, 6) * 100, 2),
+    columns=DATA_FORMAT_CODES["5"]["NAMES"][1:],
+)
+DATA.insert(0, "Date-Time", TIMES)
+
+
+@pytest.mark.parametrize(
+    "timestamp_format,prefix",
+    [
+        ("%m/%d/%y %H:%M:%S.%f", ""),
+        ("%m/%d/%y %H:%M:%S.%f", "RTC: "),
+        ("%Y-%m-%d %H:%M:%S.%f", ""),
+    ],
+)
+def test_cast_to_correct_types(timestamp_format, prefix):
+
+    BaseData._timestamp_formats.clear()
+    raw = as_strings(DATA, timestamp_format=timestamp_format, prefix=prefix)
+
+    bd = BaseData()
+    data = bd._cast_to_correct_types(all_data=raw, data_format_code="5")
+
+    pd.testing.assert_frame_equal(data, DATA)
+    assert isinstance(data.index, pd.RangeIndex)
+    assert bd.number_of_points == len(DATA)
+
+    # the format found is used for the next data of this format:
+    if timestamp_format.startswith("%m"):
+        assert BaseData._timestamp_formats["5"] == "%m/%d/%y %H:%M:%S.%f"
+    else:
+        assert BaseData._timestamp_formats["5"] is None
+
+
+def test_cast_to_correct_types_of_integers_and_index():
+
+    names = DATA_FORMAT_CODES["3"]["NAMES"]
+    types = DATA_FORMAT_CODES["3"]["TYPES"]
+    raw = pd.DataFrame([["1"] * len(names)] * 3, columns=names, index=[4, 5, 7])
+    raw[names[0]] = "2019-07-14 14:27:28.566"
+
+    data = BaseData()._cast_to_correct_types(all_data=raw, data_format_code="3")
+
+    for name, _type in zip(names, types):
+        if _type is int:
+            assert data[name].dtype == np.int64
+        elif _type is float:
+            assert data[name].dtype == np.float64
+    assert list(data.index) == [4, 5, 7]
+
+
+def test_timestamp_format_changes():
+    """A new timestamp format for the same data format code is found again."""
+
+    BaseData._timestamp_formats.clear()
+    bd = BaseData()
+
+    for timestamp_format in ["%m/%d/%y %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S.%f"]:
+        raw = as_strings(DATA, timestamp_format=timestamp_format)
+        data = bd._cast_to_correct_types(all_data=raw, data_format_code="5")
+        pd.testing.assert_frame_equal(data, DATA)
+
+
+def test_decode_values_with_cached_timestamp_format():
+
+    BaseData._timestamp_formats.clear()
+    raw = as_strings(DATA, timestamp_format="%m/%d/%y %H:%M:%S.%f")
+    values = raw[DATA.columns[1:]].apply(",".join, axis=1)
+    timestamps = raw["Date-Time"].copy()
+    timestamps.iloc[3] = "not a time"
+
+    bd = BaseData()
+    data = bd._decode_values(values=values, timestamps=timestamps, data_format_code="5")
+
+    assert bd.number_of_quarantined_points == 1
+    pd.testing.assert_frame_equal(data, DATA.drop(index=3).reset_index(drop=True))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the loading of data from the Parquet backup on S3 - here with the
+partitions written to the local disk.
+
+================================
+How to run (from project root):
+================================
+>> python -m pytest tests/ergo_analytics/data_raw/test_load_aws_s3.py
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import os
+import fsspec
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from ergo_analytics.data_raw import LoadS3
+
+MAC_ADDRESSES = ["F9:E2:82:9A:55:61", "C0:D7:06:E5:78:5F"]
+
+
+def write_partitions(root=None, time_type="string"):
+    """
+    Write 3 hours of format "5" data at 1Hz for two devices as one file per
+    "year/month/day/hour" partition, 10 minute row groups.
+    """
+    times = pd.date_range("2020-07-15T01:00:00Z", periods=3 * 3600, freq="S")
+
+    for hour, times_in_hour in pd.Series(times).groupby(times.floor("H")):
+        frames = []
+        for mac_address in MAC_ADDRESSES:
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "device": mac_address,
+                        "received_timestamp": times_in_hour.values,
+                        "value": [
+                            ",".join([str(float(time.minute))] * 6)
+                            for time in times_in_hour
+                        ],
+                        "firmware_version": "1.0",
+                    }
+                )
+            )
+        frame = pd.concat(frames, ignore_index=True)
+        frame.sort_values(["device", "received_timestamp"], inplace=True)
+
+        if time_type == "string":
+            frame["received_timestamp"] = (
+                frame["received_timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3]
+                + "Z"
+            )
+        elif time_type == "string with space":
+            frame["received_timestamp"] = frame["received_timestamp"].dt.strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+        elif time_type == "millis":
+            frame["received_timestamp"] = (
+                frame["received_timestamp"].astype(np.int64) // 10**6
+            )
+
+        folder = os.path.join(root, hour.strftime("%Y/%m/%d/%H"))
+        os.makedirs(folder)
+        pq.write_table(
+            pa.Table.from_pandas(frame, preserve_index=False),
+            os.path.join(folder, "cassia-s3-prod-5.parquet"),
+            row_group_size=600,
+        )
+
+
+@pytest.mark.parametrize(
+    "time_type", ["string", "string with space", "timestamp", "millis"]
+)
+def test_retrieve_data(tmp_path, time_type):
+
+    write_partitions(root=str(tmp_path), time_type=time_type)
+
+    loader = LoadS3(root=str(tmp_path), filesystem=fsspec.filesystem("file"))
+    data = loader.retrieve_data(
+        mac_address="C0:D7:06:E5:78:5F",
+        start_time="2020-07-15T02:50:00Z",
+        end_time="2020-07-15T03:05:00Z",
+    )
+
+    assert loader.data_format_code == "5"
+    assert len(data) == 15 * 60 + 1
+    assert data["Date-Time"].is_monotonic_increasing
+    times = data["Date-Time"]
+    if times.dt.tz is None:  # times stored without a time zone are UTC
+        times = times.dt.tz_localize("UTC")
+    assert times.iloc[0] == pd.Timestamp("2020-07-15T02:50:00Z")
+    assert times.iloc[-1] == pd.Timestamp("2020-07-15T03:05:00Z")
+    assert data["Yaw[0](deg)"].iloc[0] == 50.0
+    assert list(data.columns) == [
+        "Date-Time",
+        "Yaw[0](deg)",
+        "Pitch[0](deg)",
+        "Roll[0](deg)",
+        "Yaw[1](deg)",
+        "Pitch[1](deg)",
+        "Roll[1](deg)",
+    ]
+
+
+def test_partition_pruning(tmp_path):
+    """Only the hours around the time window are read."""
+
+    write_partitions(root=str(tmp_path))
+
+    loader = LoadS3(root=str(tmp_path), filesystem=fsspec.filesystem("file"))
+
+    files = loader.return_files_given_time(
+        start_time="2020-07-15T01:10:00Z",
+        end_time="2020-07-15T01:20:00Z",
+        partition_slack_hours=0,
+    )
+    assert [f.split(str(tmp_path))[1][1:14] for f in files] == ["2020/07/15/01"]
+
+    files = loader.return_files_given_time(
+        start_time="2020-07-15T01:10:00Z", end_time="2020-07-15T01:20:00Z"
+    )
+    assert len(files) == 2  # 00 (does not exist), 01 and 02
+
+
+def test_limit_and_no_data(tmp_path):
+
+    write_partitions(root=str(tmp_path))
+
+    loader = LoadS3(root=str(tmp_path), filesystem=fsspec.filesystem("file"))
+
+    data = loader.retrieve_data(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T01:00:00Z",
+        end_time="2020-07-15T04:00:00Z",
+        limit=100,
+    )
+    assert len(data) == 100
+
+    assert (
+        loader.retrieve_data(
+            mac_address="00:00:00:00:00:00",
+            start_time="2020-07-15T01:00:00Z",
+            end_time="2020-07-15T04:00:00Z",
+        )
+        is None
+    )
+    assert (
+        loader.retrieve_data(
+            mac_address="F9:E2:82:9A:55:61",
+            start_time="2020-07-16T01:00:00Z",
+            end_time="2020-07-16T04:00:00Z",
+        )
+        is None
+    )
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the loading of data from Elastic Search.
+
+================================
+How to run (from project root):
+================================
+>> python -m pytest tests/ergo_analytics/data_raw/test_load_elastic_search.py
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import numpy as np
+import pandas as pd
+import pytest
+from ergo_analytics.data_raw import LoadElasticSearch
+from constants import DATA_FORMAT_CODES
+from fake_elastic_search import FakeElasticSearchConnection
+from fake_elastic_search import make_documents
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    """A loader talking to the in-memory Elastic Search instead of a server."""
+    FakeElasticSearchConnection.reset(
+        documents=make_documents(
+            mac_addresses=["F9:E2:82:9A:55:61", "C0:D7:06:E5:78:5F"],
+            number_per_device=2500,
+        ),
+        aliases={"cassia-test": ["cassia"]},
+    )
+    monkeypatch.setattr(
+        LoadElasticSearch,
+        "_create_client",
+        staticmethod(
+            lambda host=None, credentials=None: FakeElasticSearchConnection.client()
+        ),
+    )
+    LoadElasticSearch.clear_cache()
+    yield LoadElasticSearch()
+    LoadElasticSearch.clear_cache()
+
+
+def test_bulk_decode():
+
+    loader = LoadElasticSearch()
+
+    timestamps = [f"2020-07-15T02:50:00.{ix:03d}Z" for ix in range(4)]
+    values = [
+        "1.0,2.0,3.0,4.0,5.0,6.0\n",
+        " 7.0, 8.0, 9.0, 10.0, 11.0, 12.0",
+        "13.0,14.0,15.0,16.0,17.0,18.0\r\n",
+        "19.0,20.0,21.0,22.0,23.0,24.0",
+    ]
+
+    data = loader._decode_values(values=values, timestamps=timestamps)
+
+    # the format code is found from the number of fields:
+    assert loader.data_format_code == "5"
+    assert list(data.columns) == DATA_FORMAT_CODES["5"]["NAMES"]
+    assert loader.number_of_points == 4
+    assert loader.number_of_quarantined_points == 0
+
+    assert isinstance(data.index, pd.RangeIndex)
+    assert data["Yaw[0](deg)"].dtype == np.float64
+    assert list(data["Yaw[0](deg)"]) == [1.0, 7.0, 13.0, 19.0]
+    assert list(data["Roll[1](deg)"]) == [6.0, 12.0, 18.0, 24.0]
+    assert data["Date-Time"].iloc[1] == pd.Timestamp("2020-07-15T02:50:00.001Z")
+
+
+def test_bulk_decode_quarantines_bad_rows():
+
+    loader = LoadElasticSearch()
+
+    timestamps = [
+        "2020-07-15T02:50:00.000Z",
+        "2020-07-15T02:50:00.001Z",  # too few fields
+        "2020-07-15T02:50:00.002Z",  # non-numeric value
+        "not a time",
+        "2020-07-15T02:50:00.004Z",
+    ]
+    values = [
+        "1,2,3,4,5,6",
+        "1,2,3",
+        "1,abc,3,4,5,6",
+        "1,2,3,4,5,6",
+        "nan,2,3,4,5,6",  # a missing value is not corrupt
+    ]
+
+    data = loader._decode_values(
+        values=values, timestamps=timestamps, data_format_code="5"
+    )
+
+    assert len(data) == 2
+    assert loader.number_of_quarantined_points == 3
+    assert np.isnan(data["Yaw[0](deg)"].iloc[1])
+    assert list(loader.quarantined_data.index) == [1, 2, 3]
+
+
+def test_bulk_decode_wrong_format_code():
+    """An incorrect data format code is corrected from the data itself."""
+
+    loader = LoadElasticSearch()
+
+    data = loader._decode_values(
+        values=["RTC: 07/14/19 14:27:28.566, 268.61, -11.15, 10.71"],
+        data_format_code="5",
+    )
+
+    assert loader.data_format_code == "4"
+    assert data["Date-Time"].iloc[0] == pd.Timestamp("2019-07-14 14:27:28.566")
+    assert data["DeltaYaw"].iloc[0] == 268.61
+
+
+@pytest.mark.parametrize("number_of_slices", [None, 1, 2, 5])
+def test_sliced_scroll(loader, number_of_slices):
+    """Sliced scrolls return the same data, in order, as one scroll."""
+
+    data = loader.retrieve_data(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T02:02:00Z",
+        index="cassia-test",
+        number_of_slices=number_of_slices,
+    )
+
+    assert len(data) == 1201  # 2 minutes at 10Hz, both ends included
+    assert data["Date-Time"].is_monotonic_increasing
+    assert list(data["Yaw[0](deg)"]) == list(map(float, range(1201)))
+
+    searches = [
+        url
+        for method, url in FakeElasticSearchConnection.requests
+        if url.endswith("_search")
+    ]
+    assert len(searches) == max(number_of_slices or 1, 1)
+
+
+def test_sliced_scroll_with_limit(loader):
+
+    data = loader.retrieve_data(
+        mac_address="C0:D7:06:E5:78:5F",
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T03:00:00Z",
+        index="cassia-test",
+        number_of_slices=3,
+        limit=100,
+    )
+
+    assert len(data) == 100
+    assert list(data["Yaw[0](deg)"]) == list(map(float, range(100)))
+
+
+def test_retrieve_data_for_devices(loader):
+    """The whole fleet is fetched with one search, not one per device."""
+
+    mac_addresses = ["F9:E2:82:9A:55:61", "C0:D7:06:E5:78:5F", "00:00:00:00:00:00"]
+
+    all_data = loader.retrieve_data_for_devices(
+        mac_addresses=mac_addresses,
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T02:01:00Z",
+        index="cassia-test",
+    )
+
+    searches = [
+        url
+        for method, url in FakeElasticSearchConnection.requests
+        if url.endswith("_search")
+    ]
+    assert len(searches) == 1
+
+    assert set(all_data) == set(mac_addresses)
+    assert all_data["00:00:00:00:00:00"] is None
+    assert loader.data_format_codes == {
+        "F9:E2:82:9A:55:61": "5",
+        "C0:D7:06:E5:78:5F": "5",
+    }
+
+    for mac_address in mac_addresses[:2]:
+        data = loader.retrieve_data(
+            mac_address=mac_address,
+            start_time="2020-07-15T02:00:00Z",
+            end_time="2020-07-15T02:01:00Z",
+            index="cassia-test",
+        )
+        pd.testing.assert_frame_equal(all_data[mac_address], data)
+
+
+def test_retrieve_data_for_devices_in_batches(loader):
+
+    all_data = loader.retrieve_data_for_devices(
+        mac_addresses=["F9:E2:82:9A:55:61", "C0:D7:06:E5:78:5F"],
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T02:00:09.900Z",
+        index="cassia-test",
+        devices_per_query=1,
+        number_of_slices=2,
+    )
+
+    searches = [
+        url
+        for method, url in FakeElasticSearchConnection.requests
+        if url.endswith("_search")
+    ]
+    assert len(searches) == 4  # 2 queries, each read in 2 slices
+    assert [len(data) for data in all_data.values()] == [100, 100]
+
+
+def test_client_and_alias_cache(loader):
+    """Clients and alias resolutions are reused across loaders."""
+
+    for _ in range(3):
+        data = LoadElasticSearch().retrieve_data(
+            mac_address="F9:E2:82:9A:55:61",
+            start_time="2020-07-15T02:00:00Z",
+            end_time="2020-07-15T02:00:09.900Z",
+            from_alias="cassia",
+        )
+        assert len(data) == 100
+
+    assert LoadElasticSearch.cache_info() == {
+        "client_hits": 2,
+        "client_misses": 1,
+        "alias_hits": 2,
+        "alias_misses": 1,
+    }
+
+    urls = [url for method, url in FakeElasticSearchConnection.requests]
+    assert len([url for url in urls if url.endswith("_alias")]) == 1
+    assert len([url for url in urls if url.endswith("_count")]) == 0
+
+
+def test_alias_cache_expires(loader, monkeypatch):
+
+    monkeypatch.setattr(LoadElasticSearch, "alias_cache_ttl", 0)
+
+    for _ in range(2):
+        loader.retrieve_data(
+            mac_address="F9:E2:82:9A:55:61",
+            start_time="2020-07-15T02:00:00Z",
+            end_time="2020-07-15T02:00:09.900Z",
+            from_alias="cassia",
+        )
+
+    assert LoadElasticSearch.cache_info()["alias_misses"] == 2
+
+
+def test_no_documents(loader):
+
+    data = loader.retrieve_data(
+        mac_address="00:00:00:00:00:00",
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T02:01:00Z",
+        index="cassia-test",
+    )
+
+    assert data is None
+
+
+@pytest.mark.parametrize("number_of_slices", [None, 3])
+def test_retrieve_data_iter(loader, number_of_slices):
+    """The chunks together are the same as retrieving all the data at once."""
+
+    kwargs = dict(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T02:02:00Z",
+        index="cassia-test",
+        number_of_slices=number_of_slices,
+    )
+
+    chunks = list(loader.retrieve_data_iter(chunk_size=500, **kwargs))
+
+    assert [len(chunk) for chunk in chunks] == [500, 500, 201]
+    assert loader.number_of_points == 1201
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks), loader.retrieve_data(**kwargs), check_index_type=False
+    )
+
+
+def test_retrieve_data_iter_is_lazy(loader):
+
+    chunks = loader.retrieve_data_iter(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T02:10:00Z",
+        index="cassia-test",
+        chunk_size=100,
+    )
+    assert len(next(chunks)) == 100
+
+    # the first page of the scroll (1000 documents) was all that was needed:
+    assert len(FakeElasticSearchConnection.requests) == 2  # product check, search
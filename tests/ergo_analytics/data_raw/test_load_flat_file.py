@@ -17,9 +17,12 @@ __version__ = "Alpha"
 
 import os
 import pandas as pd
+import pytest
 from ergo_analytics.data_raw import LoadDataFromLocalDisk
 from constants import DATA_FORMAT_CODES
 
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+
 
 def test_base_data():
 
@@ -63,3 +66,67 @@ def test_base_data():
 
     # let's clean up the file:
     os.remove("fake_data.csv")
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "Demos/real_data/demo/8D_B8_0.csv",
+        "Demos/demo-format-5/data.csv",
+        "Demos/demo-format-1/data_small.csv",
+    ],
+)
+def test_engines_agree(path):
+
+    path = os.path.join(ROOT_DIR, path)
+
+    data = dict()
+    for engine in ["pandas", "pyarrow"]:
+        loader = LoadDataFromLocalDisk(engine=engine)
+        data[engine] = loader.get_data(path=path, destination=".")
+        assert loader.data_format_code is not None
+
+    pd.testing.assert_frame_equal(data["pyarrow"], data["pandas"])
+    assert isinstance(data["pyarrow"].index, pd.RangeIndex)
+
+
+def test_rows_before_the_data_are_skipped(tmp_path):
+
+    lines = [
+        "some device log line",
+        "Date-Time,Yaw[0](deg),Pitch[0](deg),Roll[0](deg),Yaw[1](deg),"
+        "Pitch[1](deg),Roll[1](deg)",
+        "2020-10-22 10:40:16.341000+00:00,,,,,,",
+    ]
+    lines += [
+        f"2020-10-22 10:40:{ix + 17:02d}.341000+00:00,{ix},1,2,3,4,5"
+        for ix in range(20)
+    ]
+    path = tmp_path / "data.csv"
+    path.write_text("\n".join(lines) + "\n")
+
+    loader = LoadDataFromLocalDisk()
+    data = loader.get_data(path=str(path), destination=str(tmp_path))
+
+    assert loader.data_format_code == "5"
+    assert len(data) == 20
+    assert data["Yaw[0](deg)"].tolist() == list(map(float, range(20)))
+    assert data["Date-Time"].iloc[0] == pd.Timestamp("2020-10-22 10:40:17.341Z")
+
+
+def test_falls_back_to_pandas(tmp_path):
+    """Rows pyarrow cannot read (here a short row) are left to pandas."""
+
+    lines = [f"03/20/19 17:48:{ix + 10:02d}.510,{ix},1,2,3,4,5" for ix in range(20)]
+    lines[10] = "03/20/19 17:48:20.510,10,1,2"
+    path = tmp_path / "data.csv"
+    path.write_text("\n".join(lines) + "\n")
+
+    data = dict()
+    for engine in ["pandas", "pyarrow"]:
+        data[engine] = LoadDataFromLocalDisk(engine=engine).get_data(
+            path=str(path), destination=str(tmp_path), data_format_code="5"
+        )
+
+    pd.testing.assert_frame_equal(data["pyarrow"], data["pandas"])
+    assert data["pyarrow"]["Yaw[1](deg)"].isna().sum() == 1
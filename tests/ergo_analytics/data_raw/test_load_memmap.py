@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the memory-mapped binary format of raw data.
+
+================================
+How to run (from project root):
+================================
+>> python -m pytest tests/ergo_analytics/data_raw/test_load_memmap.py
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from ergo_analytics.data_raw import LoadDataFromLocalDisk
+from ergo_analytics.data_raw import LoadMemmap
+from ergo_analytics.data_raw import convert_to_memmap
+from ergo_analytics.data_raw import load_memmap
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+
+
+@pytest.mark.parametrize(
+    "path", ["Demos/real_data/demo/8D_B8_0.csv", "Demos/demo-format-1/data_small.csv"]
+)
+def test_round_trip(tmp_path, path):
+
+    path = os.path.join(ROOT_DIR, path)
+    flat_file_loader = LoadDataFromLocalDisk()
+    expected = flat_file_loader.get_data(path=path, destination=str(tmp_path))
+
+    destination = convert_to_memmap(path=path, destination=str(tmp_path / "data.mmap"))
+
+    loader = LoadMemmap()
+    data = loader.get_data(path=destination)
+
+    assert list(data.columns) == list(expected.columns)
+    assert loader.data_column_names == list(expected.columns)
+    assert loader.data_format_code == flat_file_loader.data_format_code
+    assert loader.number_of_points == len(expected)
+    assert isinstance(data.index, pd.RangeIndex)
+    pd.testing.assert_series_equal(data["Date-Time"], expected["Date-Time"])
+    np.testing.assert_allclose(
+        data.iloc[:, 1:].to_numpy(dtype=np.float64),
+        expected.iloc[:, 1:].to_numpy(),
+        rtol=1e-6,
+    )
+
+
+def test_data_is_not_copied(tmp_path):
+
+    data = pd.DataFrame(
+        np.arange(600, dtype=np.float64).reshape(100, 6),
+        columns=[
+            "Yaw[0](deg)",
+            "Pitch[0](deg)",
+            "Roll[0](deg)",
+            "Yaw[1](deg)",
+            "Pitch[1](deg)",
+            "Roll[1](deg)",
+        ],
+    )
+    data.insert(0, "Date-Time", pd.date_range("2020-07-15", periods=100, freq="100ms"))
+    path = str(tmp_path / "data.mmap")
+    LoadMemmap.write(data=data, path=path, data_format_code="5")
+
+    loaded = LoadMemmap().get_data(path=path, data_format_code="5")
+    pd.testing.assert_frame_equal(
+        loaded, data.astype({c: np.float32 for c in data.columns[1:]})
+    )
+
+    # the columns are views of the mapped file:
+    for values in [loaded["Yaw[0](deg)"].values, loaded["Date-Time"].array._ndarray]:
+        while values is not None and not isinstance(values, np.memmap):
+            values = values.base
+        assert isinstance(values, np.memmap)
+
+    # writes are private to the process:
+    loaded.loc[0, "Yaw[0](deg)"] = -1.0
+    assert LoadMemmap().get_data(path=path)["Yaw[0](deg)"].iloc[0] == 0.0
+
+
+def test_time_window(tmp_path):
+
+    data = pd.DataFrame(
+        np.zeros((1000, 3)), columns=["DeltaYaw", "DeltaPitch", "DeltaRoll"]
+    )
+    data.insert(
+        0, "Date-Time", pd.date_range("2020-07-15T02:00:00Z", periods=1000, freq="S")
+    )
+    path = str(tmp_path / "data.mmap")
+    LoadMemmap.write(data=data, path=path, data_format_code="4")
+
+    loaded = LoadMemmap().get_data(
+        path=path, start_time="2020-07-15T02:01:00Z", end_time="2020-07-15T02:02:00Z"
+    )
+    assert len(loaded) == 61
+    assert loaded["Date-Time"].iloc[0] == pd.Timestamp("2020-07-15T02:01:00Z")
+
+    with pytest.raises(Exception):
+        LoadMemmap().get_data(path=path, data_format_code="5")
+
+
+def test_command_line(tmp_path, capsys):
+
+    load_memmap.main(
+        [
+            os.path.join(ROOT_DIR, "Demos/demo-format-5/data_small.csv"),
+            "--output-dir",
+            str(tmp_path),
+        ]
+    )
+
+    assert capsys.readouterr().out.strip() == str(tmp_path / "data_small.mmap")
+    assert len(LoadMemmap().get_data(path=str(tmp_path / "data_small.mmap"))) == 100
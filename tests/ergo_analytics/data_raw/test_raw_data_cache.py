@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the local cache of decoded raw data per device-hour.
+
+================================
+How to run (from project root):
+================================
+>> python -m pytest tests/ergo_analytics/data_raw/test_raw_data_cache.py
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import numpy as np
+import pandas as pd
+from ergo_analytics.data_raw import RawDataCache
+from ergo_analytics.data_raw import LoadElasticSearch
+from constants import DATA_FORMAT_CODES
+from fake_elastic_search import FakeElasticSearchConnection
+from fake_elastic_search import make_documents
+
+# one data point per second for 3 hours:
+ALL_DATA = pd.DataFrame(
+    np.arange(3 * 3600 * 6, dtype=np.float64).reshape(-1, 6),
+    columns=DATA_FORMAT_CODES["5"]["NAMES"][1:],
+)
+ALL_DATA.insert(
+    0,
+    "Date-Time",
+    pd.date_range("2020-07-15T01:00:00Z", periods=3 * 3600, freq="S"),
+)
+
+
+class Database(object):
+    """Serves "ALL_DATA" and remembers what was asked for."""
+
+    def __init__(self):
+        self.calls = []
+
+    def fetch(self, start_time=None, end_time=None):
+        self.calls.append((start_time, end_time))
+        times = ALL_DATA["Date-Time"]
+        data = ALL_DATA[(times >= start_time) & (times <= end_time)]
+        if len(data) == 0:
+            return None, None
+        return data.reset_index(drop=True), "5"
+
+
+def expected(start_time=None, end_time=None):
+    times = ALL_DATA["Date-Time"]
+    return ALL_DATA[
+        (times >= pd.Timestamp(start_time)) & (times <= pd.Timestamp(end_time))
+    ].reset_index(drop=True)
+
+
+def test_only_missing_ranges_are_fetched(tmp_path):
+
+    database = Database()
+    cache = RawDataCache(directory=str(tmp_path))
+
+    data, data_format_code = cache.retrieve(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T01:30:00Z",
+        end_time="2020-07-15T01:45:00Z",
+        fetch=database.fetch,
+    )
+    assert data_format_code == "5"
+    pd.testing.assert_frame_equal(
+        data, expected("2020-07-15T01:30:00Z", "2020-07-15T01:45:00Z")
+    )
+    assert len(database.calls) == 1
+
+    # an overlapping lookback window only fetches what is new:
+    data, _ = cache.retrieve(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T01:40:00Z",
+        end_time="2020-07-15T02:10:00Z",
+        fetch=database.fetch,
+    )
+    pd.testing.assert_frame_equal(
+        data, expected("2020-07-15T01:40:00Z", "2020-07-15T02:10:00Z")
+    )
+    assert database.calls[1][0] > pd.Timestamp("2020-07-15T01:45:00Z")
+    assert database.calls[1][1] == pd.Timestamp("2020-07-15T02:10:00Z")
+
+    # all of it is cached now:
+    data, _ = cache.retrieve(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T01:35:00Z",
+        end_time="2020-07-15T02:05:00Z",
+        fetch=database.fetch,
+    )
+    pd.testing.assert_frame_equal(
+        data, expected("2020-07-15T01:35:00Z", "2020-07-15T02:05:00Z")
+    )
+    assert len(database.calls) == 2
+
+    # a gap in the middle is fetched alone and stitched in:
+    cache.retrieve(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T02:30:00Z",
+        end_time="2020-07-15T02:40:00Z",
+        fetch=database.fetch,
+    )
+    data, _ = cache.retrieve(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T01:30:00Z",
+        end_time="2020-07-15T02:40:00Z",
+        fetch=database.fetch,
+    )
+    pd.testing.assert_frame_equal(
+        data, expected("2020-07-15T01:30:00Z", "2020-07-15T02:40:00Z")
+    )
+    assert len(database.calls) == 4
+    assert database.calls[-1][1] < pd.Timestamp("2020-07-15T02:30:00Z")
+
+
+def test_devices_are_cached_apart(tmp_path):
+
+    database = Database()
+    cache = RawDataCache(directory=str(tmp_path))
+
+    for mac_address in ["F9:E2:82:9A:55:61", "C0:D7:06:E5:78:5F"]:
+        cache.retrieve(
+            mac_address=mac_address,
+            start_time="2020-07-15T01:30:00Z",
+            end_time="2020-07-15T01:45:00Z",
+            fetch=database.fetch,
+        )
+
+    assert len(database.calls) == 2
+
+
+def test_no_data_is_cached_too(tmp_path):
+
+    database = Database()
+    cache = RawDataCache(directory=str(tmp_path))
+
+    for _ in range(2):
+        data, _ = cache.retrieve(
+            mac_address="F9:E2:82:9A:55:61",
+            start_time="2020-07-16T01:30:00Z",
+            end_time="2020-07-16T01:45:00Z",
+            fetch=database.fetch,
+        )
+        assert data is None
+
+    assert len(database.calls) == 1
+
+
+def test_recent_data_is_fetched_again(tmp_path):
+    """Data still arriving in the database is not recorded as fetched."""
+
+    cache = RawDataCache(directory=str(tmp_path), settle_seconds=60)
+    calls = []
+
+    def fetch(start_time=None, end_time=None):
+        calls.append((start_time, end_time))
+        return None, None
+
+    now = pd.Timestamp.utcnow()
+    for _ in range(2):
+        cache.retrieve(
+            mac_address="F9:E2:82:9A:55:61",
+            start_time=now - pd.Timedelta(minutes=15),
+            end_time=now,
+            fetch=fetch,
+        )
+
+    assert len(calls) == 2
+    assert calls[1][0] >= now - pd.Timedelta(seconds=61)
+
+
+def test_size_limit(tmp_path):
+
+    database = Database()
+    cache = RawDataCache(directory=str(tmp_path), max_bytes=400_000)
+
+    cache.retrieve(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T01:00:00Z",
+        end_time="2020-07-15T03:59:59Z",
+        fetch=database.fetch,
+    )
+
+    sizes = [f.stat().st_size for f in tmp_path.rglob("*.parquet")]
+    assert 0 < sum(sizes) <= 400_000
+    assert len(sizes) == 2  # the hour written first was evicted
+
+
+def test_elastic_search_with_cache(tmp_path, monkeypatch):
+
+    FakeElasticSearchConnection.reset(
+        documents=make_documents(
+            mac_addresses=["F9:E2:82:9A:55:61"], number_per_device=3000
+        )
+    )
+    monkeypatch.setattr(
+        LoadElasticSearch,
+        "_create_client",
+        staticmethod(
+            lambda host=None, credentials=None: FakeElasticSearchConnection.client()
+        ),
+    )
+    LoadElasticSearch.clear_cache()
+
+    cache = RawDataCache(directory=str(tmp_path))
+    kwargs = dict(
+        mac_address="F9:E2:82:9A:55:61",
+        start_time="2020-07-15T02:00:00Z",
+        end_time="2020-07-15T02:04:00Z",
+        index="cassia-test",
+    )
+
+    loader = LoadElasticSearch()
+    data = loader.retrieve_data(cache=cache, **kwargs)
+    pd.testing.assert_frame_equal(data, loader.retrieve_data(**kwargs))
+
+    FakeElasticSearchConnection.requests = []
+    data = loader.retrieve_data(cache=cache, **dict(kwargs, limit=100))
+
+    assert len(data) == 100
+    assert loader.data_format_code == "5"
+    assert FakeElasticSearchConnection.requests == []
+    LoadElasticSearch.clear_cache()
@@ -6,7 +6,12 @@ Copyright 2018 Iterate Labs, Inc.
 All Rights Reserved. Patent pending.
 """
 
+import types
+import fsspec
+import numpy as np
+import pandas as pd
 from ergo_analytics.data_raw import BaseData
+from ergo_analytics.data_raw import base_data
 
 
 def __test_retrieve_any_device():
@@ -21,3 +26,36 @@ def __test_retrieve_any_device():
     assert ":" in mac_address
 
     assert len(raw_data) > 20
+
+
+def test_retrieve_any_device_from_cached_query(tmp_path, monkeypatch):
+    """The cached Athena result is decoded in bulk."""
+
+    number_of_rows = 5000
+    times = pd.date_range("2020-07-15T02:00:00Z", periods=number_of_rows, freq="100ms")
+    values = np.arange(number_of_rows * 6, dtype=np.float64).reshape(-1, 6)
+    query = pd.DataFrame(
+        {
+            "device": "F9:E2:82:9A:55:61",
+            "wearable_timestamp": times.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "value": [",".join(map(str, row)) for row in values],
+        }
+    ).iloc[::-1]
+    (tmp_path / "queries").mkdir()
+    query.to_csv(tmp_path / "queries" / "result.csv", index=False)
+
+    monkeypatch.setitem(base_data.config, "athena_query_dir", str(tmp_path / "queries"))
+    monkeypatch.setattr(
+        base_data,
+        "s3fs",
+        types.SimpleNamespace(S3FileSystem=lambda **kwargs: fsspec.filesystem("file")),
+    )
+
+    data_loader = BaseData()
+    mac_address, raw_data = data_loader.retrieve_any_macaddress_with_data()
+
+    assert mac_address == "F9:E2:82:9A:55:61"
+    assert data_loader.data_format_code == "5"
+    assert len(raw_data) == number_of_rows
+    assert (raw_data["Date-Time"].values == times.values).all()
+    assert (raw_data.iloc[:, 1:].values == values).all()
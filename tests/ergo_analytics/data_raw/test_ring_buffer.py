@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the ring buffer of live samples and the streaming interface of the
+data sources.
+
+================================
+How to run (from project root):
+================================
+>> python -m pytest tests/ergo_analytics/data_raw/test_ring_buffer.py
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import numpy as np
+import pandas as pd
+import pytest
+from ergo_analytics.data_raw import BaseData
+from ergo_analytics.data_raw import RingBuffer
+
+COLUMNS = ["DeltaYaw", "DeltaPitch", "DeltaRoll"]
+TIMES = pd.date_range("2020-07-15T02:00:00", periods=1000, freq="100ms")
+VALUES = np.arange(3000, dtype=np.float64).reshape(1000, 3)
+
+
+def test_latest_samples_wrap_around():
+
+    buffer = RingBuffer(capacity=100, columns=COLUMNS)
+    assert len(buffer.latest()) == 0
+
+    # pushes of all sizes (including more than the capacity at once):
+    for start, end in [(0, 30), (30, 95), (95, 250), (250, 251), (251, 420)]:
+        buffer.push(timestamps=TIMES[start:end], values=VALUES[start:end])
+
+        data = buffer.latest()
+        assert buffer.number_of_points == min(end, 100)
+        assert buffer.number_pushed == end
+        assert list(data.columns) == ["Date-Time"] + COLUMNS
+        np.testing.assert_array_equal(
+            data[COLUMNS].to_numpy(), VALUES[end - len(data) : end]
+        )
+        np.testing.assert_array_equal(data["Date-Time"], TIMES[end - len(data) : end])
+
+    assert len(buffer.latest(number_of_points=7)) == 7
+    assert buffer.latest(number_of_points=7)["DeltaYaw"].iloc[-1] == VALUES[419, 0]
+
+
+def test_latest_seconds_are_a_view():
+
+    buffer = RingBuffer(capacity=100, columns=COLUMNS)
+    buffer.push(timestamps=TIMES[:170], values=VALUES[:170])
+
+    data = buffer.latest(seconds=2)
+    assert len(data) == 21  # 10 Hz, both ends included
+    assert data["Date-Time"].iloc[0] == TIMES[169] - pd.Timedelta(seconds=2)
+
+    # the columns point into the buffer:
+    assert np.shares_memory(data["DeltaYaw"].to_numpy(), buffer._values)
+    assert np.shares_memory(data["Date-Time"].array._ndarray, buffer._times)
+
+
+def test_time_zone_is_kept():
+
+    buffer = RingBuffer(capacity=10, columns=COLUMNS)
+    times = TIMES[:5].tz_localize("US/Eastern")
+    buffer.push(timestamps=times, values=VALUES[:5])
+
+    pd.testing.assert_index_equal(
+        pd.DatetimeIndex(buffer.latest()["Date-Time"]), times, check_names=False
+    )
+
+
+def test_wrong_shape():
+
+    buffer = RingBuffer(capacity=10, columns=COLUMNS)
+    with pytest.raises(Exception):
+        buffer.push(timestamps=TIMES[:5], values=VALUES[:4])
+
+
+def test_stream_on_data_source():
+
+    source = BaseData()
+    with pytest.raises(Exception):
+        source.latest()
+
+    source.open_stream(data_format_code="4", capacity=100)
+    source.push(timestamps=TIMES[:50], values=VALUES[:50])
+
+    assert source.data_column_names == ["Date-Time"] + COLUMNS
+    assert source.number_of_points == 50
+    assert len(source.latest(seconds=1)) == 11
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the producers pushing live samples into a stream.
+
+================================
+How to run (from project root):
+================================
+>> python -m pytest tests/ergo_analytics/data_raw/test_stream_producers.py
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from ergo_analytics.data_raw import BaseData
+from ergo_analytics.data_raw import LoadDataFromLocalDisk
+from ergo_analytics.data_raw import ReplayProducer
+from ergo_analytics.data_raw import SerialProducer
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+PATH = os.path.join(ROOT_DIR, "Demos/demo-format-5/data.csv")
+
+
+def wait_for(condition=None, timeout=10):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout
+        time.sleep(0.01)
+
+
+def test_replay_producer(tmp_path):
+
+    expected = LoadDataFromLocalDisk().get_data(path=PATH, destination=str(tmp_path))
+
+    source = BaseData()
+    source.open_stream(data_format_code="5", capacity=200)
+    producer = ReplayProducer(source=source, path=PATH, block_size=64)
+    producer.run()
+
+    assert source.stream.number_pushed == len(expected)
+    pd.testing.assert_frame_equal(
+        source.latest(), expected.iloc[-200:].reset_index(drop=True)
+    )
+
+
+def test_replay_producer_keeps_pace():
+
+    data = pd.DataFrame(
+        np.zeros((11, 3)), columns=["DeltaYaw", "DeltaPitch", "DeltaRoll"]
+    )
+    data.insert(0, "Date-Time", pd.date_range("2020-07-15", periods=11, freq="20ms"))
+
+    source = BaseData()
+    source.open_stream(data_format_code="4", capacity=100)
+    producer = ReplayProducer(source=source, data=data, speed=1.0, block_size=1)
+
+    start = time.monotonic()
+    producer.start()
+    producer.join(timeout=10)
+
+    assert source.number_of_points == 11
+    assert time.monotonic() - start >= 0.2
+
+
+def test_serial_producer_on_loop_port():
+
+    serial = pytest.importorskip("serial")
+
+    source = BaseData()
+    source.open_stream(data_format_code="5", capacity=1000)
+    port = serial.serial_for_url("loop://", timeout=0.05)
+    producer = SerialProducer(source=source, port=port)
+    producer.start()
+
+    with open(PATH, "rb") as fd:
+        lines = fd.read().splitlines(keepends=True)[1:]  # (skip the header)
+
+    # the device writes lines in pieces, with some garbage in between:
+    port.write(b"".join(lines[:100]) + b"booting...\n" + lines[100][:20])
+    port.write(lines[100][20:] + b"".join(lines[101:]))
+
+    wait_for(lambda: source.stream.number_pushed == len(lines))
+    producer.stop(timeout=10)
+    assert not producer.is_running
+    assert producer.number_skipped == 1
+
+    expected = LoadDataFromLocalDisk().get_data(path=PATH)
+    pd.testing.assert_frame_equal(source.latest(), expected, check_exact=False)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Tests storing structured data chunks (as in the pipestore).
+
+================================
+How to run (from project root):
+================================
+>> python -m pytest tests/ergo_analytics/data_structured/test_structured_data_store.py
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from ergo_analytics import DataFilterPipeline
+from ergo_analytics.data_structured import StructuredData
+from ergo_analytics.data_structured import StructuredDataChunks
+from ergo_analytics.data_structured import dump_structured_data
+from ergo_analytics.data_structured import load_structured_data
+from ergo_analytics.filters import ConstructDeltaValues
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+
+
+def make_chunks(number_of_chunks=3, number_of_points=50):
+    chunks = []
+    for ix in range(number_of_chunks):
+        data = pd.DataFrame(
+            {
+                "Date-Time": pd.date_range(
+                    "2020-07-15", periods=number_of_points, freq="100ms", tz="UTC"
+                ),
+                "DeltaYaw": np.random.randn(number_of_points),
+                "DeltaPitch": np.random.randn(number_of_points).astype(np.float32),
+                "DeltaRoll": np.random.randn(number_of_points),
+            },
+            index=np.arange(number_of_points) * 2 + ix,
+        )
+        chunks.append(StructuredData(data=data, data_format_code="5"))
+    return chunks
+
+
+def test_round_trip():
+
+    chunks = make_chunks()
+    loaded = load_structured_data(data=dump_structured_data(structured_data=chunks))
+
+    assert isinstance(loaded, StructuredDataChunks)
+    assert len(loaded) == 3
+    assert loaded.number_of_points == [50, 50, 50]
+    # nothing is read before it is asked for:
+    assert loaded._structured_data == [None, None, None]
+
+    for chunk, loaded_chunk in zip(chunks, loaded):
+        pd.testing.assert_frame_equal(loaded_chunk.data_matrix, chunk.data_matrix)
+        assert loaded_chunk.data_format_code == "5"
+    assert loaded[-1] is loaded[2]
+    assert [chunk.number_of_points for chunk in loaded[1:]] == [50, 50]
+
+    # the columns view the (decompressed) Arrow buffers:
+    with pytest.raises(ValueError):
+        loaded[0].data_matrix["DeltaYaw"].to_numpy()[0] = 1.0
+
+    # (and the chunks can be pickled, e.g. to send them to another process)
+    pickled = pickle.loads(pickle.dumps(loaded))
+    pd.testing.assert_frame_equal(pickled[1].data_matrix, chunks[1].data_matrix)
+
+    assert len(load_structured_data(data=dump_structured_data(structured_data=[]))) == 0
+
+    # (with any codec, or none)
+    for compression in [None, "lz4", "zstd"]:
+        loaded = load_structured_data(
+            data=dump_structured_data(structured_data=chunks, compression=compression)
+        )
+        pd.testing.assert_frame_equal(loaded[1].data_matrix, chunks[1].data_matrix)
+
+
+def test_versions():
+
+    # results pickled by earlier versions are still read:
+    chunks = make_chunks(number_of_chunks=1)
+    loaded = load_structured_data(data=pickle.dumps(chunks))
+    pd.testing.assert_frame_equal(loaded[0].data_matrix, chunks[0].data_matrix)
+
+    # files of a newer format version are not:
+    data = dump_structured_data(structured_data=chunks, compression=None)
+    reader = pa.ipc.open_file(pa.py_buffer(data))
+    metadata = dict(reader.schema.metadata)
+    metadata[b"bsafe_structured_data"] = json.dumps(
+        dict(version=1000, chunks=[])
+    ).encode()
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, reader.schema.with_metadata(metadata)):
+        pass
+    with pytest.raises(Exception):
+        load_structured_data(data=sink.getvalue().to_pybytes())
+
+    # chunks of different columns cannot be stored together:
+    other = StructuredData(
+        data=chunks[0].data_matrix.drop(columns=["Date-Time"]), data_format_code="5"
+    )
+    with pytest.raises(Exception):
+        dump_structured_data(structured_data=chunks + [other])
+
+
+def test_pipeline_results_from_the_pipestore(tmp_path, monkeypatch):
+
+    monkeypatch.setenv("PIPESTORE_MODE", "local")
+    monkeypatch.setenv("PIPESTORE_LOCAL_DIR", str(tmp_path))
+
+    test_data = pd.read_csv(
+        os.path.join(ROOT_DIR, "Demos", "demo-format-5", "data_small.csv")
+    )
+
+    def run():
+        pipeline = DataFilterPipeline()
+        pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+        results = pipeline.run(
+            on_raw_data=test_data,
+            with_format_code="5",
+            use_subsampling=True,
+            consecutive_subsamples=True,
+            subsample_size_index=20,
+            max_workers=1,
+        )
+        return pipeline, results
+
+    pipeline, expected = run()
+    assert not pipeline._found_in_pipestore
+
+    pipeline, results = run()
+    assert pipeline._found_in_pipestore
+    assert isinstance(results, StructuredDataChunks)
+    assert len(results) == len(expected)
+    for chunk, expected_chunk in zip(results, expected):
+        pd.testing.assert_frame_equal(chunk.data_matrix, expected_chunk.data_matrix)
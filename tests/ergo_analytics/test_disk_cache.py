@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Test the size-limited cache of files on the local disk.
+
+@ author Jesper Kristensen
+Copyright Iterate Labs, Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import os
+import time
+import pytest
+from ergo_analytics import DiskLRUCache
+
+
+def test_put_and_get(tmp_path):
+
+    cache = DiskLRUCache(directory=str(tmp_path))
+
+    assert cache.get(key="a/b.bin") is None
+    cache.put(key="a/b.bin", data=b"12345")
+
+    assert "a/b.bin" in cache
+    assert cache.get(key="a/b.bin") == b"12345"
+    assert cache.size() == 5
+    assert not [name for name in os.listdir(tmp_path / "a") if name.endswith(".tmp")]
+
+    cache.delete(key="a/b.bin")
+    assert "a/b.bin" not in cache
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+
+    cache = DiskLRUCache(directory=str(tmp_path), max_bytes=250)
+
+    for key in ["first", "second"]:
+        cache.put(key=key, data=b"x" * 100)
+        time.sleep(0.01)
+
+    # using "first" makes "second" the least recently used:
+    cache.get(key="first")
+    time.sleep(0.01)
+    cache.put(key="third", data=b"x" * 100)
+
+    assert "first" in cache
+    assert "second" not in cache
+    assert "third" in cache
+    assert cache.size() == 200
+
+
+def test_files_are_listed_once(tmp_path, monkeypatch):
+
+    cache = DiskLRUCache(directory=str(tmp_path), max_bytes=250)
+    cache.put(key="first", data=b"x" * 100)
+
+    # another cache on the folder shares what was read from it:
+    monkeypatch.setattr(
+        DiskLRUCache, "_files", lambda self: pytest.fail("listed the files")
+    )
+    other = DiskLRUCache(directory=str(tmp_path), max_bytes=250)
+    for key in ["second", "third"]:
+        other.put(key=key, data=b"x" * 100)
+
+    assert "first" not in cache
+    assert cache.size() == other.size() == 200
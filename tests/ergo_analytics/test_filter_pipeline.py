@@ -17,6 +17,7 @@ __author__ = "Jesper Kristensen"
 __copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
 __version__ = "Alpha"
 
+import json
 import os
 import sys
 
@@ -25,8 +26,13 @@ import pandas as pd
 from unittest.mock import MagicMock
 from ergo_analytics.filters import ConstructDeltaValues
 from ergo_analytics.filters import QuadrantFilter
+from ergo_analytics.filters import ZeroShiftFilter
+from ergo_analytics.filters import Preprocess
+from ergo_analytics.filters import DataCentering
 from ergo_analytics import DataFilterPipeline
+from ergo_analytics import data_filter_pipeline
 from ergo_analytics import ErgoMetrics
+from ergo_analytics.aws_utilities import Pipestore
 
 ROOT_DIR = os.path.abspath(os.path.expanduser("."))
 
@@ -229,3 +235,495 @@ def test_consecutive_and_random_both_times():
             subsample_size_index=8,
             randomize_subsampling=True,
         )
+
+
+def test_running_pipeline_on_stream(pipestore_uploads):
+    """
+    Running on a stream of chunks gives the same result as running on all
+    the data at once.
+    """
+
+    data_format_code = "5"
+    test_data_path = os.path.join(
+        ROOT_DIR, "Demos", f"demo-format-{data_format_code}", "data_small.csv"
+    )
+    test_data = pd.read_csv(test_data_path)
+
+    pipeline = DataFilterPipeline(verify_pipeline=False)
+    pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+
+    kwargs = dict(
+        with_format_code=data_format_code,
+        is_sorted=True,
+        use_subsampling=True,
+        consecutive_subsamples=True,
+        subsample_size_index=8,
+        randomize_subsampling=False,
+    )
+    expected = pipeline.run(on_raw_data=test_data, **kwargs)
+    expected_hash = pipeline._most_recent_pipestore_hash
+
+    chunks = (test_data.iloc[ix : ix + 30] for ix in range(0, len(test_data), 30))
+    streamed = pipeline.run(on_raw_data=chunks, **kwargs)
+
+    assert len(streamed) == len(expected) == 12
+    for streamed_chunk, expected_chunk in zip(streamed, expected):
+        pd.testing.assert_frame_equal(
+            streamed_chunk.data_matrix, expected_chunk.data_matrix
+        )
+
+    # the stream was hashed like the data as a whole:
+    assert pipeline._most_recent_pipestore_hash == expected_hash
+    assert list(pipestore_uploads) == [expected_hash]
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+@pytest.mark.usefixtures("pipestore_uploads")
+def test_running_chunks_in_parallel(monkeypatch, executor):
+    """
+    Chunks processed in parallel come back in order and as if processed one
+    after the other.
+    """
+
+    data_format_code = "5"
+    test_data_path = os.path.join(
+        ROOT_DIR, "Demos", f"demo-format-{data_format_code}", "data.csv"
+    )
+    test_data = pd.read_csv(test_data_path)
+
+    # (applied per chunk rather than once to all of the data, see
+    # "test_pointwise_filters_are_applied_once")
+    monkeypatch.setattr(ConstructDeltaValues, "pointwise", False)
+    monkeypatch.setattr(QuadrantFilter, "pointwise", False)
+
+    pipeline = DataFilterPipeline()
+    pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+    pipeline.add_filter(name="quadrant", filter=QuadrantFilter())
+    assert not pipeline.carries_state_between_chunks
+
+    kwargs = dict(
+        with_format_code=data_format_code,
+        use_subsampling=True,
+        consecutive_subsamples=True,
+        subsample_size_index=40,
+        executor=executor,
+    )
+    expected = pipeline.run(on_raw_data=test_data, max_workers=1, **kwargs)
+    expected_result = pipeline.get_result(name=pipeline.view()["quadrant"])
+
+    chunks = (test_data.iloc[ix : ix + 30] for ix in range(0, len(test_data), 30))
+    for on_raw_data in [test_data, chunks]:
+        in_parallel = pipeline.run(on_raw_data=on_raw_data, max_workers=3, **kwargs)
+
+        assert len(in_parallel) == len(expected) == 12
+        for chunk, expected_chunk in zip(in_parallel, expected):
+            pd.testing.assert_frame_equal(chunk.data_matrix, expected_chunk.data_matrix)
+
+        # the results of the filters are those of the last chunk:
+        pd.testing.assert_frame_equal(
+            pipeline.get_result(name=pipeline.view()["quadrant"])["data"],
+            expected_result["data"],
+        )
+        assert pipeline.get_parameters(name="quadrant")["data_format_code"] == "5"
+
+    monkeypatch.setattr(
+        DataFilterPipeline,
+        "_run_chunks_in_parallel",
+        lambda self, **kwargs: pytest.fail("ran in parallel"),
+    )
+    # only when asked for:
+    assert len(pipeline.run(on_raw_data=test_data, **kwargs)) == 12
+
+    # a filter passing information between chunks keeps them in order:
+    pipeline.add_filter(name="zero-shift", filter=ZeroShiftFilter())
+    assert pipeline.carries_state_between_chunks
+    assert len(pipeline.run(on_raw_data=test_data, max_workers=3, **kwargs)) == 12
+
+
+@pytest.mark.usefixtures("pipestore_uploads")
+def test_raw_data_is_not_changed():
+    """
+    The filters see views of the raw data; those writing into their data get
+    a copy so the raw data is left as it was.
+    """
+
+    data_format_code = "5"
+    test_data_path = os.path.join(
+        ROOT_DIR, "Demos", f"demo-format-{data_format_code}", "data.csv"
+    )
+    test_data = pd.read_csv(test_data_path, index_col=False)
+    test_data.index = test_data.index + 1000
+    original_data = test_data.copy()
+
+    preprocess = Preprocess()
+    preprocess.update(new_params=dict(force_new_timestamps=True))
+    assert preprocess.mutates_input
+    pipeline = DataFilterPipeline()
+    pipeline.add_filter(name="preprocess", filter=preprocess)
+    pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+    pipeline.add_filter(name="zero-shift", filter=ZeroShiftFilter())
+    pipeline.count_copies()
+
+    structured_data = pipeline.run(
+        on_raw_data=test_data,
+        with_format_code=data_format_code,
+        use_subsampling=True,
+        consecutive_subsamples=True,
+        subsample_size_index=100,
+    )
+    assert len(structured_data) == 5
+
+    pd.testing.assert_frame_equal(test_data, original_data)
+
+    # the bytes copied are counted per chunk and filter:
+    assert len(pipeline.bytes_copied) == 5
+    for chunk, bytes_copied in zip(structured_data, pipeline.bytes_copied):
+        number_of_points = len(chunk.data_matrix)
+        assert list(bytes_copied) == ["preprocess", "construct-delta", "zero-shift"]
+        # (the copy made for the first filter writing to the data)
+        assert bytes_copied["preprocess"] >= number_of_points * 8 * 6
+        # the delta columns are new:
+        assert bytes_copied["construct-delta"] >= number_of_points * 8 * 3
+
+
+def test_run_many_applies_shared_filters_once(monkeypatch, pipestore_uploads):
+    """
+    Pipelines starting with the same pointwise filters share their work and
+    get the same results as when run one by one.
+    """
+
+    data_format_code = "5"
+    test_data_path = os.path.join(
+        ROOT_DIR, "Demos", f"demo-format-{data_format_code}", "data.csv"
+    )
+    test_data = pd.read_csv(test_data_path)
+
+    def make_runs():
+        delta_only_pipeline = DataFilterPipeline(verify_pipeline=False)
+        delta_only_pipeline.add_filter(
+            name="construct-delta", filter=ConstructDeltaValues()
+        )
+        pipeline = DataFilterPipeline()
+        pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+        pipeline.add_filter(name="quadrant", filter=QuadrantFilter())
+        return [
+            (delta_only_pipeline, dict(use_subsampling=False, max_workers=1)),
+            (
+                pipeline,
+                dict(
+                    use_subsampling=True,
+                    consecutive_subsamples=True,
+                    subsample_size_index=40,
+                    max_workers=1,
+                ),
+            ),
+        ]
+
+    expected = [
+        pipeline.run(on_raw_data=test_data, with_format_code=data_format_code, **kwargs)
+        for pipeline, kwargs in make_runs()
+    ]
+    expected_hashes = list(pipestore_uploads)
+
+    applied_to = []
+    apply = ConstructDeltaValues.apply
+
+    def counting_apply(self, data=None, **kwargs):
+        applied_to.append(len(data))
+        return apply(self, data=data, **kwargs)
+
+    monkeypatch.setattr(ConstructDeltaValues, "apply", counting_apply)
+
+    pipestore_uploads.clear()
+    results = DataFilterPipeline.run_many(
+        runs=make_runs(), on_raw_data=test_data, with_format_code=data_format_code
+    )
+
+    # the delta values were constructed once, on all of the data:
+    assert applied_to == [len(test_data)]
+    assert list(pipestore_uploads) == expected_hashes
+    for result, expected_result in zip(results, expected):
+        assert len(result) == len(expected_result)
+        for chunk, expected_chunk in zip(result, expected_result):
+            pd.testing.assert_frame_equal(chunk.data_matrix, expected_chunk.data_matrix)
+
+
+@pytest.mark.usefixtures("pipestore_uploads")
+def test_pointwise_filters_are_applied_once(monkeypatch):
+    """
+    With chunks anchored in time (overlapping) the leading pointwise filters
+    are applied to all of the data once; the results are the same.
+    """
+
+    data_format_code = "5"
+    test_data_path = os.path.join(
+        ROOT_DIR, "Demos", f"demo-format-{data_format_code}", "data.csv"
+    )
+    test_data = pd.read_csv(test_data_path)
+
+    def make_pipeline():
+        pipeline = DataFilterPipeline()
+        pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+        pipeline.add_filter(name="quadrant", filter=QuadrantFilter())
+        pipeline.add_filter(name="centering", filter=DataCentering())
+        return pipeline
+
+    assert list(make_pipeline()._leading_pointwise_filters()) == [
+        "construct-delta",
+        "quadrant",
+    ]
+
+    def run():
+        return make_pipeline().run(
+            on_raw_data=test_data,
+            with_format_code=data_format_code,
+            use_subsampling=True,
+            consecutive_subsamples=True,
+            anchor_data_vs_time=True,
+            subsample_size_index=100,
+            max_workers=1,
+        )
+
+    applied_to = dict(ConstructDeltaValues=[], DataCentering=[])
+
+    def counting(filter_class=None):
+        apply = filter_class.apply
+
+        def counting_apply(self, data=None, **kwargs):
+            applied_to[filter_class.__name__].append(len(data))
+            return apply(self, data=data, **kwargs)
+
+        monkeypatch.setattr(filter_class, "apply", counting_apply)
+
+    counting(filter_class=ConstructDeltaValues)
+    counting(filter_class=DataCentering)
+
+    with monkeypatch.context() as m:
+        m.setattr(ConstructDeltaValues, "pointwise", False)
+        m.setattr(QuadrantFilter, "pointwise", False)
+        expected = run()
+    assert applied_to["ConstructDeltaValues"] == [100, 200, 300, 400, 500]
+
+    applied_to["ConstructDeltaValues"].clear()
+    applied_to["DataCentering"].clear()
+    structured_data = run()
+
+    assert applied_to["ConstructDeltaValues"] == [len(test_data)]
+    # (the filters depending on the chunk still see each chunk)
+    assert applied_to["DataCentering"] == [100, 200, 300, 400, 500]
+    assert len(structured_data) == len(expected)
+    for chunk, expected_chunk in zip(structured_data, expected):
+        pd.testing.assert_frame_equal(chunk.data_matrix, expected_chunk.data_matrix)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_memoized_chunks_are_reused(tmp_path, monkeypatch, max_workers):
+    """
+    Rerunning on a recording that has grown only processes the new chunks
+    when the chunks are memoized; the results are the same.
+    """
+
+    monkeypatch.setenv("PIPESTORE_MODE", "local")
+    monkeypatch.setenv("PIPESTORE_LOCAL_DIR", str(tmp_path / "memoized"))
+
+    data_format_code = "5"
+    test_data_path = os.path.join(
+        ROOT_DIR, "Demos", f"demo-format-{data_format_code}", "data.csv"
+    )
+    test_data = pd.read_csv(test_data_path)
+
+    applied_to = []
+    apply = DataCentering.apply
+
+    def counting_apply(self, data=None, **kwargs):
+        applied_to.append(len(data))
+        return apply(self, data=data, **kwargs)
+
+    monkeypatch.setattr(DataCentering, "apply", counting_apply)
+
+    def run(data=None, memoize_chunks=True):
+        pipeline = DataFilterPipeline()
+        pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+        pipeline.add_filter(name="centering", filter=DataCentering())
+        return pipeline.run(
+            on_raw_data=data,
+            with_format_code=data_format_code,
+            use_subsampling=True,
+            consecutive_subsamples=True,
+            subsample_size_index=100,
+            max_workers=max_workers,
+            executor="thread",
+            memoize_chunks=memoize_chunks,
+        )
+
+    run(data=test_data.iloc[:300])
+    assert applied_to == [100, 100, 100]
+
+    # (the whole run is not in the pipestore, the data has changed)
+    applied_to.clear()
+    structured_data = run(data=test_data)
+    assert applied_to == [100, 100]
+
+    # another version of the code does not reuse them:
+    applied_to.clear()
+    with monkeypatch.context() as m:
+        m.setattr(data_filter_pipeline, "_code_fingerprint", lambda modules=(): "new")
+        run(data=test_data.iloc[:200])
+    assert applied_to == [100, 100]
+
+    # (in a pipestore of its own)
+    monkeypatch.setenv("PIPESTORE_LOCAL_DIR", str(tmp_path / "not-memoized"))
+    applied_to.clear()
+    expected = run(data=test_data, memoize_chunks=False)
+    assert applied_to == [100] * 5
+
+    assert len(structured_data) == len(expected)
+    for chunk, expected_chunk in zip(structured_data, expected):
+        pd.testing.assert_frame_equal(chunk.data_matrix, expected_chunk.data_matrix)
+
+
+def test_prefetched_results(tmp_path, monkeypatch):
+    """
+    Results fetched from the pipestore beforehand are used instead of
+    looking up the pipestore.
+    """
+
+    monkeypatch.setenv("PIPESTORE_MODE", "local")
+    monkeypatch.setenv("PIPESTORE_LOCAL_DIR", str(tmp_path))
+
+    test_data = pd.read_csv(
+        os.path.join(ROOT_DIR, "Demos", "demo-format-5", "data_small.csv")
+    )
+    arguments = dict(
+        with_format_code="5",
+        use_subsampling=True,
+        consecutive_subsamples=True,
+        subsample_size_index=20,
+        dtype_policy="compact",
+        max_workers=1,
+    )
+
+    pipeline = DataFilterPipeline()
+    pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+    pipeline_hash = pipeline.get_run_hash(on_raw_data=test_data, **arguments)
+
+    # nothing prefetched: run without looking up the pipestore
+    monkeypatch.setattr(
+        DataFilterPipeline,
+        "check_pipestore",
+        MagicMock(side_effect=Exception("should not be looked up")),
+    )
+    expected = pipeline.run(on_raw_data=test_data, prefetched=dict(), **arguments)
+    assert not pipeline._found_in_pipestore
+    assert pipeline._most_recent_pipestore_hash == pipeline_hash
+
+    prefetched = Pipestore().get_many(hashes=[pipeline_hash, "other"])
+    assert list(prefetched) == [pipeline_hash]
+
+    structured_data = pipeline.run(
+        on_raw_data=test_data, prefetched=prefetched, **arguments
+    )
+    assert pipeline._found_in_pipestore
+    assert len(structured_data) == len(expected)
+    for chunk, expected_chunk in zip(structured_data, expected):
+        pd.testing.assert_frame_equal(chunk.data_matrix, expected_chunk.data_matrix)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+@pytest.mark.usefixtures("pipestore_uploads")
+def test_run_stats(tmp_path, max_workers):
+    """
+    The cost of each filter in each chunk is recorded (in the workers too)
+    and can be exported.
+    """
+
+    test_data = pd.read_csv(
+        os.path.join(ROOT_DIR, "Demos", "demo-format-5", "data.csv")
+    )
+
+    pipeline = DataFilterPipeline()
+    pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+    pipeline.add_filter(name="centering", filter=DataCentering())
+    assert pipeline.run_stats is None
+
+    pipeline.run(
+        on_raw_data=test_data,
+        with_format_code="5",
+        use_subsampling=True,
+        consecutive_subsamples=True,
+        subsample_size_index=100,
+        max_workers=max_workers,
+        executor="thread",
+    )
+    stats = pipeline.run_stats
+
+    # the pointwise filter was applied to all of the data first:
+    assert stats.chunks[0]["chunk"] is None
+    assert [s["filter"] for s in stats.chunks[0]["filters"]] == ["construct-delta"]
+    assert stats.chunks[0]["filters"][0]["rows_in"] == len(test_data)
+    # (and made the delta columns)
+    assert stats.chunks[0]["filters"][0]["bytes_allocated"] >= len(test_data) * 8 * 3
+
+    assert stats.number_of_chunks == 5
+    assert [chunk["chunk"] for chunk in stats.chunks[1:]] == [1, 2, 3, 4, 5]
+    for chunk in stats.chunks[1:]:
+        (filter_stats,) = chunk["filters"]
+        assert filter_stats["filter"] == "centering"
+        assert filter_stats["rows_in"] == filter_stats["rows_out"] == 100
+        assert filter_stats["wall_time"] > 0
+
+    totals = stats.by_filter()
+    assert totals["centering"]["calls"] == 5
+    assert totals["centering"]["rows_in"] == 500
+    assert sum(t["time_share"] for t in totals.values()) == pytest.approx(1)
+    assert stats.wall_time > totals["centering"]["wall_time"]
+
+    description = pipeline.describe()
+    assert [d["stats"]["calls"] for d in description.values()] == [1, 5]
+
+    path = str(tmp_path / "stats.json")
+    assert json.loads(stats.to_json(path=path)) == json.load(open(path))
+    assert json.load(open(path))["number_of_chunks"] == 5
+
+
+def test_find_shared_prefix():
+
+    def pipeline_of(*filters):
+        pipeline = DataFilterPipeline(verify_pipeline=False)
+        for filter in filters:
+            pipeline.add_filter(name=filter.__class__.__name__, filter=filter)
+        return pipeline
+
+    prefix = DataFilterPipeline._find_shared_prefix(
+        pipelines=[
+            pipeline_of(Preprocess(), ConstructDeltaValues(), QuadrantFilter()),
+            pipeline_of(Preprocess(), ConstructDeltaValues(), DataCentering()),
+        ]
+    )
+    assert list(prefix) == ["Preprocess", "ConstructDeltaValues"]
+
+    # making up timestamps depends on the chunk:
+    preprocess = Preprocess()
+    preprocess.update(new_params=dict(force_new_timestamps=True))
+    assert not preprocess.pointwise
+    prefix = DataFilterPipeline._find_shared_prefix(
+        pipelines=[
+            pipeline_of(preprocess, ConstructDeltaValues()),
+            pipeline_of(preprocess, ConstructDeltaValues()),
+        ]
+    )
+    assert len(prefix) == 0
+
+    # as do filters which are not pointwise:
+    prefix = DataFilterPipeline._find_shared_prefix(
+        pipelines=[pipeline_of(DataCentering()), pipeline_of(DataCentering())]
+    )
+    assert len(prefix) == 0
+
+    # the same filters with other parameters are different:
+    quadrant = QuadrantFilter()
+    quadrant.update(new_params=dict(units="rad"))
+    prefix = DataFilterPipeline._find_shared_prefix(
+        pipelines=[pipeline_of(QuadrantFilter()), pipeline_of(quadrant)]
+    )
+    assert len(prefix) == 0
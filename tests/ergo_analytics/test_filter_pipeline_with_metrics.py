@@ -23,12 +23,15 @@ import logging
 import sys
 
 import pytest
+import numpy as np
 import pandas as pd
 from ergo_analytics.filters import ConstructDeltaValues
 from ergo_analytics.filters import QuadrantFilter
 from ergo_analytics import DataFilterPipeline
 from ergo_analytics import ErgoMetrics
 from ergo_analytics.metrics import AngularActivityScore
+from ergo_analytics.metrics import PostureScore
+from ergo_analytics.data_raw import LoadDataFromLocalDisk
 
 ROOT_DIR = os.path.abspath(os.path.expanduser("."))
 
@@ -170,3 +173,48 @@ def test_some_of_the_chunks_have_none_data():
 
     combined_score = metrics.get_score(name="AngularActivityScore")[3][0]
     assert pytest.approx(combined_score, 0.00001) == 1.0738636363636365
+
+
+@pytest.mark.usefixtures("pipestore_uploads")
+def test_compact_dtype_policy():
+    """Scores with float32 angles are within tolerance of the float64 ones."""
+
+    test_data_path = os.path.join(ROOT_DIR, "Demos", "real_data", "demo", "8D_B8_0.csv")
+    test_data = LoadDataFromLocalDisk().get_data(path=test_data_path).iloc[:1800]
+
+    scores = dict()
+    for dtype_policy in ["default", "compact"]:
+        pipeline = DataFilterPipeline()
+        pipeline.add_filter(name="construct-delta", filter=ConstructDeltaValues())
+        pipeline.add_filter(name="quadrant", filter=QuadrantFilter())
+
+        list_of_structured_data_chunks = pipeline.run(
+            on_raw_data=test_data,
+            with_format_code="5",
+            use_subsampling=True,
+            consecutive_subsamples=True,
+            subsample_size_index=600,
+            dtype_policy=dtype_policy,
+        )
+
+        expected_dtype = np.float32 if dtype_policy == "compact" else np.float64
+        for chunk in list_of_structured_data_chunks:
+            assert chunk.get_data(type="pitch", loc="delta").dtype == expected_dtype
+            assert chunk.time.dtype.kind == "M"  # int64 nanoseconds
+
+        metrics = ErgoMetrics(
+            list_of_structured_data_chunks=list_of_structured_data_chunks
+        )
+        metrics.add(AngularActivityScore)
+        metrics.add(PostureScore)
+        metrics.compute()
+
+        scores[dtype_policy] = {
+            name: np.asarray(metrics.get_score(name=name), dtype=np.float64)
+            for name in ["AngularActivityScore", "PostureScore"]
+        }
+
+    for name in scores["default"]:
+        np.testing.assert_allclose(
+            scores["compact"][name], scores["default"][name], rtol=1e-2
+        )
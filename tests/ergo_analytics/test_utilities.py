@@ -18,6 +18,8 @@ import pandas as pd
 import pytest
 from unittest.mock import MagicMock
 from ergo_analytics import subsample_data
+from ergo_analytics import subsample_stream
+from ergo_analytics import apply_dtype_policy
 
 data_format_code = "5"  # in which format is the data coming to us?
 
@@ -499,3 +501,56 @@ def test_floats():
         count_num_times += 1
 
     assert count_num_times == 100
+
+
+@pytest.mark.parametrize("exact_chunk_size", [True, False])
+@pytest.mark.parametrize("subsample_size_index", [1000, 2048, 10000])
+def test_subsample_stream(exact_chunk_size, subsample_size_index):
+    """Streamed chunks are subsampled like all the data at once."""
+
+    chunks = (test_data.iloc[ix : ix + 700] for ix in range(0, len(test_data), 700))
+
+    streamed = list(
+        subsample_stream(
+            chunks=chunks,
+            subsample_size_index=subsample_size_index,
+            exact_chunk_size=exact_chunk_size,
+        )
+    )
+    expected = list(
+        subsample_data(
+            data=test_data,
+            use_subsampling=True,
+            consecutive_subsamples=True,
+            randomize=False,
+            subsample_size_index=subsample_size_index,
+            exact_chunk_size=exact_chunk_size,
+        )
+    )
+
+    assert len(streamed) == len(expected)
+    for (streamed_chunk, _), (expected_chunk, _) in zip(streamed, expected):
+        pd.testing.assert_frame_equal(streamed_chunk, expected_chunk)
+
+
+def test_apply_dtype_policy():
+
+    data = pd.DataFrame(
+        {
+            "Date-Time": ["2020-07-15T02:00:00Z", "2020-07-15T02:00:01Z"],
+            "DeltaYaw": [1.5, 2.5],
+            "Count": [1, 2],
+        }
+    )
+
+    compact = apply_dtype_policy(data=data, dtype_policy="compact")
+    assert compact["DeltaYaw"].dtype == np.float32
+    assert compact["Count"].dtype == np.int64
+    assert compact["Date-Time"].dtype == "datetime64[ns, UTC]"
+    assert data["DeltaYaw"].dtype == np.float64  # the input is left as is
+
+    default = apply_dtype_policy(data=compact, dtype_policy="default")
+    assert default["DeltaYaw"].dtype == np.float64
+
+    with pytest.raises(Exception):
+        apply_dtype_policy(data=data, dtype_policy="tiny")
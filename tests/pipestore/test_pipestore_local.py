@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Test the local disk tier of the pipestore.
+
+@ author Jesper Kristensen
+Copyright Iterate Labs Inc. 2018-
+"""
+
+__author__ = "Jesper Kristensen"
+__copyright__ = "Copyright (C) 2018- Iterate Labs, Inc."
+__version__ = "Alpha"
+
+import io
+import os
+import pickle
+import pytest
+from botocore.exceptions import ClientError
+from ergo_analytics.aws_utilities import Pipestore
+from ergo_analytics.aws_utilities import PipestoreUploader
+
+
+class FakeS3Client(object):
+    """Just enough of an S3 client for the pipestore, counting the calls."""
+
+    def __init__(self, failures=0, missing="NoSuchKey"):
+        self.objects = dict()
+        self.calls = []
+        self.failures = failures  # the first this many uploads fail
+        self.missing = missing  # the error code of a missing key
+
+    def get_object(self, Bucket=None, Key=None):
+        self.calls.append("get_object")
+        if Key not in self.objects:
+            raise ClientError(dict(Error=dict(Code=self.missing)), "GetObject")
+        return dict(Body=io.BytesIO(self.objects[Key]))
+
+    def list_objects_v2(self, Bucket=None, Prefix=None, ContinuationToken=None):
+        self.calls.append("list_objects_v2")
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        listing = dict(Contents=[dict(Key=key) for key in keys[start : start + 2]])
+        if start + 2 < len(keys):
+            listing.update(IsTruncated=True, NextContinuationToken=str(start + 2))
+        return listing
+
+    def put_object(self, Bucket=None, Key=None, Body=None, **kwargs):
+        self.calls.append("put_object")
+        if self.failures > 0:
+            self.failures -= 1
+            raise ClientError(dict(Error=dict(Code="SlowDown")), "PutObject")
+        self.objects[Key] = Body
+        return dict(ResponseMetadata=dict(HTTPStatusCode=200))
+
+
+def test_local_mode(tmp_path, monkeypatch):
+
+    monkeypatch.delenv("OUTPUT_S3", raising=False)
+    monkeypatch.delenv("PIPESTORE_MODE", raising=False)
+    monkeypatch.setenv("PIPESTORE_LOCAL_DIR", str(tmp_path))
+
+    pst = Pipestore()
+    assert pst.mode == "local"
+    assert pst.pipestore_hash_exists(hash="abc") == (False, None)
+
+    pst.upload_data(hash="abc", data=pickle.dumps([1, 2, 3]))
+    assert Pipestore().pipestore_hash_exists(hash="abc") == (True, [1, 2, 3])
+
+    pst.delete_data(hash="abc")
+    assert pst.pipestore_hash_exists(hash="abc") == (False, None)
+
+    # S3 needs a bucket:
+    with pytest.raises(Exception):
+        Pipestore(mode="s3")
+
+    # the local cache is opt-in:
+    monkeypatch.delenv("PIPESTORE_LOCAL_DIR")
+    with pytest.raises(Exception):
+        Pipestore()
+    monkeypatch.setenv("OUTPUT_S3", "bucket")
+    pst = Pipestore()
+    assert pst.mode == "s3"
+    assert pst._local is None
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+
+    pst = Pipestore(mode="local", local_dir=str(tmp_path), local_max_bytes=2500)
+    for ix, hash in enumerate(["a", "b"]):
+        pst.upload_data(hash=hash, data=pickle.dumps(bytes(1000)))
+        # (in the past, one second apart)
+        path = pst._local.path(key=pst._return_path(hash=hash))
+        os.utime(path, (1000 + ix, 1000 + ix))
+
+    # using "a" makes "b" the least recently used:
+    pst.pipestore_hash_exists(hash="a")
+    pst.upload_data(hash="c", data=pickle.dumps(bytes(1000)))
+
+    assert pst.pipestore_hash_exists(hash="a")[0]
+    assert not pst.pipestore_hash_exists(hash="b")[0]
+    assert pst.pipestore_hash_exists(hash="c")[0]
+
+
+def test_local_tier_in_front_of_s3(tmp_path, monkeypatch):
+
+    monkeypatch.setenv("OUTPUT_S3", "bucket")
+    client = FakeS3Client()
+    monkeypatch.setattr(Pipestore, "_get_s3_client", lambda self: client)
+
+    pst = Pipestore(local_dir=str(tmp_path / "first"))
+    assert pst.mode == "s3"
+    assert pst.pipestore_hash_exists(hash="abc") == (False, None)
+    pst.upload_data(hash="abc", data=pickle.dumps("results"))
+    assert client.calls == ["get_object", "put_object"]
+
+    # found locally:
+    assert pst.pipestore_hash_exists(hash="abc") == (True, "results")
+    assert client.calls == ["get_object", "put_object"]
+
+    # another machine downloads it once:
+    other = Pipestore(local_dir=str(tmp_path / "second"))
+    for _ in range(2):
+        assert other.pipestore_hash_exists(hash="abc") == (True, "results")
+    assert client.calls == ["get_object", "put_object", "get_object"]
+
+
+def test_access_denied_is_a_miss(tmp_path, monkeypatch):
+    """Without "s3:ListBucket" S3 answers 403 for a missing key."""
+
+    monkeypatch.setenv("OUTPUT_S3", "bucket")
+    client = FakeS3Client(missing="AccessDenied")
+    monkeypatch.setattr(Pipestore, "_get_s3_client", lambda self: client)
+
+    pst = Pipestore()
+    assert pst.pipestore_hash_exists(hash="abc") == (False, None)
+    assert pst.get_chunk(hash="abc") is None
+
+    # (other errors are not)
+    client.missing = "InternalError"
+    with pytest.raises(ClientError):
+        pst.pipestore_hash_exists(hash="abc")
+
+
+def test_get_many(tmp_path, monkeypatch):
+
+    monkeypatch.setenv("OUTPUT_S3", "bucket")
+    client = FakeS3Client()
+    monkeypatch.setattr(Pipestore, "_get_s3_client", lambda self: client)
+
+    pst = Pipestore(local_dir=str(tmp_path / "first"))
+    for hash in ["a", "b", "c", "d"]:
+        pst.upload_data(hash=hash, data=pickle.dumps(hash))
+    pst.upload_chunk(hash="x", data=b"not results")
+
+    # another machine lists the bucket once (in pages of two here):
+    client.calls.clear()
+    other = Pipestore(local_dir=str(tmp_path / "second"))
+    assert other.get_many(hashes=["a", "c", "d", "x", "a"]) == dict(a="a", c="c", d="d")
+    assert client.calls == ["list_objects_v2"] * 2 + ["get_object"] * 3
+
+    # the results are local now:
+    client.calls.clear()
+    assert other.prefetch(hashes=["c", "d"]) == {"c", "d"}
+    assert other.pipestore_hash_exists(hash="a") == (True, "a")
+    assert client.calls == []
+
+    assert other.prefetch(hashes=["b", "y"]) == {"b"}
+    assert client.calls == ["list_objects_v2"] * 2 + ["get_object"]
+
+
+def test_background_uploads(tmp_path, monkeypatch):
+
+    monkeypatch.setenv("OUTPUT_S3", "bucket")
+    client = FakeS3Client(failures=3)
+    monkeypatch.setattr(Pipestore, "_get_s3_client", lambda self: client)
+    monkeypatch.setattr(PipestoreUploader, "_retry_delay", 0.01)
+
+    pst = Pipestore(local_dir=str(tmp_path))
+    before = PipestoreUploader.metrics()
+    for hash in ["a", "b"]:
+        pst.upload_data(hash=hash, data=pickle.dumps(hash), background=True)
+        # (in the local cache right away)
+        assert pst.pipestore_hash_exists(hash=hash) == (True, hash)
+
+    assert PipestoreUploader.flush(timeout=10)
+    assert sorted(client.objects) == [pst._return_path(hash=h) for h in "ab"]
+
+    metrics = PipestoreUploader.metrics()
+    changes = {key: metrics[key] - before[key] for key in before}
+    assert changes["submitted"] == 2
+    assert changes["uploaded"] == 2
+    assert changes["failed"] == 3
+    assert changes["retried"] == 3
+    assert changes["dropped"] == 0
+    assert metrics["pending"] == metrics["queued_for_retry"] == 0
+
+    # given up on after too many attempts:
+    client.failures = 1000
+    pst.upload_data(hash="c", data=pickle.dumps("c"), background=True)
+    assert PipestoreUploader.flush(timeout=10)
+    assert PipestoreUploader.metrics()["dropped"] == before["dropped"] + 1
+    assert pst._return_path(hash="c") not in client.objects
@@ -0,0 +1,66 @@
+"""
+Tests the batch mode of "run_v2.py".
+
+@author: Jesper Kristensen
+Iterate Labs, Inc. All Rights Reserved, Patent Pending
+"""
+
+import json
+import os
+import run_v2
+
+
+def test_read_manifest(tmp_path):
+
+    for name in ["a.csv", "b.csv"]:
+        (tmp_path / name).write_text("")
+
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# the files\ns3://bucket/x\n\ns3://bucket/y\ns3://bucket/x\n")
+
+    assert run_v2.read_manifest(manifest=str(manifest)) == [
+        "s3://bucket/x",
+        "s3://bucket/y",
+    ]
+    assert run_v2.read_manifest(manifest=str(tmp_path / "*.csv")) == [
+        str(tmp_path / "a.csv"),
+        str(tmp_path / "b.csv"),
+    ]
+
+
+def test_failed_files_are_retried(tmp_path, monkeypatch):
+
+    calls = tmp_path / "calls.txt"
+
+    def score_file(file=None, **kwargs):
+        # (the workers are forked so they record their calls in a file)
+        with open(calls, "a") as fd:
+            fd.write(file + "\n")
+        attempts = calls.read_text().split().count(file)
+        if file.endswith("bad") or (file.endswith("flaky") and attempts < 2):
+            raise Exception("no data")
+
+    monkeypatch.setattr(run_v2, "score_file", score_file)
+    monkeypatch.setattr(run_v2, "ApiClient", lambda: None)
+
+    status_file = str(tmp_path / "status.jsonl")
+    files = ["s3://bucket/good", "s3://bucket/flaky", "s3://bucket/bad"]
+    statuses = run_v2.run_batch(
+        files=files, workers=2, retries=2, status_file=status_file
+    )
+
+    assert [statuses[f]["status"] for f in files] == ["ok", "ok", "failed"]
+    assert statuses["s3://bucket/flaky"]["attempt"] == 2
+    assert statuses["s3://bucket/bad"]["attempt"] == 3
+    assert statuses["s3://bucket/bad"]["error"] == "Exception: no data"
+    assert calls.read_text().split().count("s3://bucket/good") == 1
+
+    with open(status_file) as fd:
+        assert len([json.loads(line) for line in fd]) == 6
+
+    # running the batch again only redoes what failed:
+    os.remove(calls)
+    statuses = run_v2.run_batch(files=files, retries=0, status_file=status_file)
+
+    assert calls.read_text().split() == ["s3://bucket/bad"]
+    assert statuses["s3://bucket/good"]["status"] == "ok"
@@ -0,0 +1,85 @@
+"""
+Tests scoring a file with "run_v2.py" streamed in blocks of rows
+("--chunksize").
+
+@author: Jesper Kristensen
+Iterate Labs, Inc. All Rights Reserved, Patent Pending
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import run_v2
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+
+MAC_ADDRESS = "F9:E2:82:9A:55:61"
+
+
+class FakeApiClient(object):
+    """Keeps the payloads posted instead of sending them."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def post_request(self, endpoint=None, payload=None):
+        self.payloads.append(payload)
+        return FakeResponse()
+
+
+class FakeResponse(object):
+    text = "ok"
+
+    def raise_for_status(self):
+        pass
+
+
+def write_file(folder=None):
+    """1500 rows of the format 5 demo data at 10Hz, as in the raw files
+    (no header) under a folder named by the wearable."""
+    demo = pd.read_csv(os.path.join(ROOT_DIR, "Demos/demo-format-5/data.csv"))
+    data = pd.concat([demo] * 3, ignore_index=True)
+    data["Date-Time"] = pd.date_range(
+        "2019-03-20 16:22:15.908", periods=len(data), freq="100ms"
+    ).strftime("%m/%d/%y %H:%M:%S.%f")
+
+    os.makedirs(os.path.join(folder, MAC_ADDRESS))
+    file = os.path.join(folder, MAC_ADDRESS, "data")
+    data.to_csv(file, header=False, index=False)
+    return file
+
+
+def score(file=None, chunksize=None):
+    api_client = FakeApiClient()
+    # (the report draws the strain scores of the angles at random)
+    np.random.seed(0)
+    run_v2.score_file(file=file, chunksize=chunksize, api_client=api_client)
+    assert len(api_client.payloads) == 1
+    payload = api_client.payloads[0]
+    payload.pop("analyzed_at")
+    return payload
+
+
+def test_score_file_in_blocks(tmp_path):
+
+    file = write_file(folder=str(tmp_path))
+
+    payload = score(file=file, chunksize=64)
+
+    assert payload["mac"] == MAC_ADDRESS
+    assert payload["start_time"] == "2019-03-20 16:22:15.908000"
+    # (the end of the last whole subsample of 600 rows)
+    assert payload["end_time"] == "2019-03-20 16:24:15.808000"
+    for key in [
+        "safety_score",
+        "speed_score",
+        "posture_score",
+        "strain_score",
+        "intense_active_score",
+        "mild_active_score",
+    ]:
+        assert np.isfinite(payload[key])
+
+    # the scores do not depend on how the file is cut into blocks:
+    assert score(file=file, chunksize=1000) == payload
+    assert score(file=file, chunksize=64) == payload